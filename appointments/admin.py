@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     UserProfile, Appointment, Organization, ChatRoom, ChatMessage, 
     AuditLog, DoctorOrganizationJoinRequest, MedicalRecord, Prescription,
-    Insurance, Payment, EmergencyContact, MedicationReminder, TelemedicineSession
+    Insurance, Payment, EmergencyContact, MedicationReminder, TelemedicineSession,
+    GeocodeCache, OutboundEmail, OutboxEvent
 )
 
 @admin.register(Organization)
@@ -97,11 +98,14 @@ class ChatMessageAdmin(admin.ModelAdmin):
 
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
-    list_display = ['user', 'action', 'timestamp', 'object_type', 'object_id']
+    list_display = ['user', 'action', 'timestamp', 'object_type', 'object_id', 'ip_address']
     list_filter = ['action', 'timestamp', 'object_type']
     search_fields = ['user__username', 'action', 'details']
     ordering = ['-timestamp']
     readonly_fields = ['timestamp']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    show_full_result_count = False  # no COUNT(*) over the whole table per page
 
 @admin.register(DoctorOrganizationJoinRequest)
 class DoctorOrganizationJoinRequestAdmin(admin.ModelAdmin):
@@ -109,3 +113,30 @@ class DoctorOrganizationJoinRequestAdmin(admin.ModelAdmin):
     list_filter = ['status', 'created_at', 'reviewed_at']
     search_fields = ['doctor__username', 'organization__name']
     ordering = ['-created_at']
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ['address', 'latitude', 'longitude', 'provider', 'created_at']
+    list_filter = ['provider', 'created_at']
+    search_fields = ['address', 'place_id']
+    ordering = ['-created_at']
+    readonly_fields = ['address_hash', 'created_at']
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'created_at', 'sent_at', 'attempts']
+    list_filter = ['sent_at', 'created_at']
+    search_fields = ['subject']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'sent_at', 'attempts', 'last_error']
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'created_at', 'processed_at', 'attempts', 'dead_lettered_at']
+    list_filter = ['event_type', 'processed_at', 'dead_lettered_at']
+    search_fields = ['idempotency_key']
+    ordering = ['-id']
+    readonly_fields = [
+        'event_type', 'payload', 'idempotency_key', 'created_at', 'processed_at',
+        'attempts', 'last_error', 'dead_lettered_at'
+    ]
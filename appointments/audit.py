@@ -0,0 +1,91 @@
+"""
+Buffered audit logging. record() builds the AuditLog row in memory and
+releases it when the surrounding transaction commits (rolled-back actions
+are not audited). Inside a request (AuditLogMiddleware) or a Celery task
+the released rows are collected and written with one bulk_create when the
+request or task ends; anywhere else they are written straight away.
+The request's client IP and user agent are filled in automatically.
+"""
+import logging
+from contextvars import ContextVar
+
+from django.db import transaction
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Rows released in the current request or task, or None outside such a scope
+_buffer = ContextVar('audit_buffer', default=None)
+
+# (ip_address, user_agent) of the current request
+_client = ContextVar('audit_client', default=(None, None))
+
+
+def client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def record(action, user=None, user_id=None, details='', object_type=None, object_id=None,
+           ip_address=None, user_agent=None):
+    """Queue one audit row; costs no database round-trip in a request or task"""
+    request_ip, request_agent = _client.get()
+    if user is not None and not user.is_authenticated:
+        user = None
+    entry = AuditLog(
+        user_id=user.id if user else user_id,
+        action=action,
+        details=details or '',
+        object_type=object_type,
+        object_id=object_id,
+        ip_address=ip_address or request_ip,
+        user_agent=user_agent if user_agent is not None else request_agent,
+    )
+    transaction.on_commit(lambda: _release(entry))
+
+
+def _release(entry):
+    buffered = _buffer.get()
+    if buffered is None:
+        flush([entry])
+    else:
+        buffered.append(entry)
+
+
+def start_collecting(request=None):
+    client = (client_ip(request), request.META.get('HTTP_USER_AGENT', '')) if request else (None, None)
+    return _buffer.set([]), _client.set(client)
+
+
+def stop_collecting(tokens):
+    buffer_token, client_token = tokens
+    entries = _buffer.get() or []
+    _buffer.reset(buffer_token)
+    _client.reset(client_token)
+    return entries
+
+
+def flush(entries):
+    if not entries:
+        return
+    try:
+        AuditLog.objects.bulk_create(entries, batch_size=500)
+    except Exception as e:
+        logger.error(f"Writing {len(entries)} audit log entries failed: {e}")
+
+
+class AuditLogMiddleware:
+    """Collect the request's audit rows and write them in one INSERT at the end"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tokens = start_collecting(request)
+        try:
+            return self.get_response(request)
+        finally:
+            flush(stop_collecting(tokens))
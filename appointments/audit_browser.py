@@ -0,0 +1,94 @@
+"""
+Audit log browser, keyset-paginated on (timestamp, id) newest first. The
+unfiltered browse walks the (timestamp, id) index backwards, and so do
+date ranges. An object's history, a user's actions and a single action
+start from their (..., timestamp) indexes. Other combinations, such as a
+user and an action together, use one of these indexes and filter the
+remaining conditions row by row.
+"""
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AuditLog
+from .pagination import keyset_page
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_moment(value, end_of_day=False):
+    """An aware datetime from an ISO date or datetime, or None"""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:
+        return None
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def parse_filters(params):
+    """The supported filters present and valid in a GET QueryDict"""
+    filters = {}
+    for name in ('user', 'object_id'):
+        try:
+            filters[name] = int(params[name])
+        except (KeyError, ValueError):
+            pass
+    for name in ('action', 'object_type'):
+        if params.get(name):
+            filters[name] = params[name]
+    since = parse_moment(params.get('since'))
+    until = parse_moment(params.get('until'), end_of_day=True)
+    if since:
+        filters['since'] = since
+    if until:
+        filters['until'] = until
+    return filters
+
+
+def get_page(filters=None, cursor=None, limit=PAGE_SIZE):
+    """
+    One page of audit entries matching filters, newest first.
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    filters = filters or {}
+    entries = AuditLog.objects.select_related('user').only(
+        'id', 'action', 'timestamp', 'details', 'object_type', 'object_id', 'ip_address', 'user_agent',
+        'user__id', 'user__username', 'user__first_name', 'user__last_name'
+    )
+    if 'user' in filters:
+        entries = entries.filter(user_id=filters['user'])
+    if 'action' in filters:
+        entries = entries.filter(action=filters['action'])
+    if 'object_type' in filters:
+        entries = entries.filter(object_type=filters['object_type'])
+    if 'object_id' in filters:
+        entries = entries.filter(object_id=filters['object_id'])
+    if 'since' in filters:
+        entries = entries.filter(timestamp__gte=filters['since'])
+    if 'until' in filters:
+        entries = entries.filter(timestamp__lte=filters['until'])
+    return keyset_page(entries, 'timestamp', cursor, limit, MAX_PAGE_SIZE)
+
+
+def serialize(entry):
+    return {
+        'id': entry.id,
+        'user_id': entry.user_id,
+        'user': (entry.user.get_full_name() or entry.user.username) if entry.user else None,
+        'action': entry.action,
+        'object_type': entry.object_type,
+        'object_id': entry.object_id,
+        'details': entry.details,
+        'ip_address': entry.ip_address,
+        'user_agent': entry.user_agent,
+        'timestamp': entry.timestamp.isoformat(),
+    }
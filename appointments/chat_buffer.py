@@ -0,0 +1,134 @@
+"""
+Write-behind buffer for chat traffic arriving over WebSockets. Messages
+and read receipts from every connection in the process are collected and
+persisted together (bulk_create / bulk UPDATE) once CHAT_WRITE_BATCH_SIZE
+messages are waiting or CHAT_WRITE_INTERVAL seconds have passed. The
+database work runs in a worker thread, never on the event loop. Messages
+have already been delivered to clients, so a batch that cannot be written
+is retried, row by row and then on later flushes, rather than dropped.
+"""
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from . import chat_summary
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriteBuffer:
+    def __init__(self):
+        self.messages = []
+        self.receipts = set()
+        self.flush_task = None
+        self.failures = 0
+
+    async def add_message(self, room_id, sender_id, message):
+        self.messages.append(ChatMessage(room_id=room_id, sender_id=sender_id, message=message))
+        if len(self.messages) >= settings.CHAT_WRITE_BATCH_SIZE:
+            await self.flush()
+        else:
+            self.schedule()
+
+    def add_receipt(self, room_id, reader_id):
+        """Mark the room's messages from other participants read on the next flush"""
+        self.receipts.add((room_id, reader_id))
+        self.schedule()
+
+    def schedule(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.CHAT_WRITE_INTERVAL)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        messages, self.messages = self.messages, []
+        receipts, self.receipts = self.receipts, set()
+        if not (messages or receipts):
+            return
+        messages, receipts = await database_sync_to_async(persist)(messages, receipts)
+        if not (messages or receipts):
+            self.failures = 0
+        elif self.failures < settings.CHAT_WRITE_MAX_RETRIES:
+            # Put the unwritten rows back ahead of anything newer and try again later
+            self.failures += 1
+            self.messages = messages + self.messages
+            self.receipts |= receipts
+            self.schedule()
+        else:
+            self.failures = 0
+            logger.error(
+                f"Dropping {len(messages)} chat messages and {len(receipts)} receipts "
+                f"after {settings.CHAT_WRITE_MAX_RETRIES} retries"
+            )
+
+
+def persist(messages, receipts):
+    """
+    Write one batch: messages first, so receipts sent after a message in
+    the same batch cover it. If the batch fails, falls back to one row at
+    a time so a single bad row cannot sink the others.
+    Returns the messages and receipts that could not be written.
+    """
+    try:
+        with transaction.atomic():
+            write_messages(messages)
+            for receipt in receipts:
+                write_receipt(*receipt)
+        return [], set()
+    except Exception as e:
+        logger.error(f"Persisting {len(messages)} chat messages and {len(receipts)} receipts failed: {e}")
+
+    failed_messages = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                write_messages([message])
+        except Exception as e:
+            logger.error(f"Persisting chat message for room {message.room_id} failed: {e}")
+            failed_messages.append(message)
+    failed_receipts = set()
+    for receipt in receipts:
+        try:
+            with transaction.atomic():
+                write_receipt(*receipt)
+        except Exception as e:
+            logger.error(f"Persisting read receipt for room {receipt[0]} failed: {e}")
+            failed_receipts.add(receipt)
+    return failed_messages, failed_receipts
+
+
+def write_messages(messages):
+    if messages:
+        # A rolled-back bulk insert may have assigned ids; insert afresh
+        for message in messages:
+            message.pk = None
+        ChatMessage.objects.bulk_create(messages, batch_size=500)
+        chat_summary.record_messages(messages)
+
+
+def write_receipt(room_id, reader_id):
+    ChatMessage.objects.filter(room_id=room_id, is_read=False).exclude(
+        sender_id=reader_id
+    ).update(is_read=True)
+    chat_summary.record_read(room_id, reader_id)
+
+
+# One buffer per event loop: consumers of a worker share it, and tasks never
+# outlive the loop they were created on
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_buffer():
+    loop = asyncio.get_running_loop()
+    if loop not in _buffers:
+        _buffers[loop] = ChatWriteBuffer()
+    return _buffers[loop]
@@ -0,0 +1,33 @@
+"""
+Chat history: the latest messages of a room first, then older pages on
+demand, keyset-paginated on (created_at, id).
+"""
+from .models import ChatMessage
+from .pagination import keyset_page
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def get_page(room, cursor=None, limit=PAGE_SIZE):
+    """
+    One page of a room's messages in display order (oldest first) and the
+    cursor for the page before it, or None when this is the oldest page
+    """
+    messages = ChatMessage.objects.filter(room=room).select_related('sender').only(
+        'id', 'message', 'created_at', 'is_read', 'room_id',
+        'sender__id', 'sender__username', 'sender__first_name', 'sender__last_name'
+    )
+    page, older_cursor = keyset_page(messages, 'created_at', cursor, limit, MAX_PAGE_SIZE)
+    page.reverse()
+    return page, older_cursor
+
+
+def serialize(message):
+    return {
+        'id': message.id,
+        'message': message.message,
+        'user_id': message.sender_id,
+        'username': message.sender.get_full_name() or message.sender.username,
+        'timestamp': message.created_at.isoformat(),
+    }
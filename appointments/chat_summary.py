@@ -0,0 +1,86 @@
+"""
+Chat room lookup key and the room-summary projection (last message per
+room, unread count per participant), updated whenever messages are
+written or read.
+"""
+import hashlib
+import logging
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ChatRoom, ChatRoomSummary
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 255
+
+
+def participant_key(participant_ids):
+    """Order-independent key for a set of participants"""
+    ids = ','.join(str(i) for i in sorted(set(participant_ids)))
+    return hashlib.sha256(ids.encode()).hexdigest()
+
+
+def sync_participants(room):
+    """
+    Refresh the participant key and denormalized names, and make sure
+    every participant, and only they, have a summary row. If another room
+    already holds the new participant set's key, this room gives its key
+    up, so lookups by participants keep finding exactly one room.
+    """
+    participants = list(room.participants.only('id', 'username', 'first_name', 'last_name'))
+    names = ', '.join(p.get_full_name() or p.username for p in participants)
+    ids = [p.id for p in participants]
+    key = participant_key(ids) if ids else None
+    if key and ChatRoom.objects.filter(participant_key=key).exclude(id=room.id).exists():
+        key = None
+    try:
+        with transaction.atomic():
+            ChatRoom.objects.filter(id=room.id).update(participant_names=names, participant_key=key)
+    except IntegrityError:
+        # Another room took the key in the meantime
+        key = None
+        ChatRoom.objects.filter(id=room.id).update(participant_names=names, participant_key=None)
+    room.participant_key = key
+    ChatRoomSummary.objects.filter(room=room).exclude(user_id__in=ids).delete()
+    ChatRoomSummary.objects.bulk_create(
+        [ChatRoomSummary(room=room, user_id=user_id) for user_id in ids],
+        ignore_conflicts=True
+    )
+
+
+def record_messages(messages):
+    """
+    Update summaries for newly written messages: one UPDATE per room for
+    the last message, one per (room, sender) for the others' unread counts
+    """
+    if not messages:
+        return
+    latest = {}
+    for message in messages:
+        latest[message.room_id] = message
+    senders = {message.sender_id for message in messages}
+    names = {
+        user.id: user.get_full_name() or user.username
+        for user in User.objects.filter(id__in=senders).only('id', 'username', 'first_name', 'last_name')
+    }
+    for room_id, message in latest.items():
+        ChatRoom.objects.filter(id=room_id).update(
+            last_message=message.message[:PREVIEW_LENGTH],
+            last_message_sender=names.get(message.sender_id, ''),
+            last_message_at=message.created_at or timezone.now()
+        )
+    for (room_id, sender_id), count in Counter((m.room_id, m.sender_id) for m in messages).items():
+        ChatRoomSummary.objects.filter(room_id=room_id).exclude(user_id=sender_id).update(
+            unread_count=F('unread_count') + count
+        )
+
+
+def record_read(room_id, user_id):
+    ChatRoomSummary.objects.filter(room_id=room_id, user_id=user_id).update(
+        unread_count=0, last_read_at=timezone.now()
+    )
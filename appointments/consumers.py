@@ -1,206 +1,457 @@
-import json
+import asyncio
+import itertools
+import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
-from .models import Appointment, UserProfile
-from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from . import eventlog, notification_counts
+from .chat_buffer import get_buffer
+from .encoding import negotiate
+from .models import UserProfile, ChatRoom
+from .realtime import (
+    publish, user_group, org_group, receptionist_group, chat_group, queue_group,
+    TokenBucket
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_CHAT_MESSAGE_LENGTH = 2000
+
+
+class AuthenticatedConsumer(AsyncWebsocketConsumer):
+    """
+    Base consumer that only accepts authenticated users. Group membership is
+    derived from scope['user'] by get_groups(), never from client input, and
+    every group joined is tracked so disconnect leaves all of them.
+
+    Bursty updates are coalesced per stream for WEBSOCKET_COALESCE_WINDOW and
+    sent as one frame, and frames are rate limited in both directions. A
+    client too slow to keep up gets a single 'resync' frame instead of an
+    ever growing buffer. Events that cannot replace each other (chat
+    messages, new notifications) take a unique key, so they share the same
+    budget and bound without being merged.
+    """
 
-class AppointmentConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'appointments_{self.room_name}'
+        self.user = self.scope.get('user')
+        self.subscriptions = set()
+        self.pending = {}
+        self.overflowed = set()
+        self.flush_task = None
+        self.sequence = itertools.count()
+        self.send_bucket = TokenBucket(settings.WEBSOCKET_SEND_RATE, settings.WEBSOCKET_SEND_BURST)
+        self.receive_bucket = TokenBucket(settings.WEBSOCKET_RECEIVE_RATE, settings.WEBSOCKET_RECEIVE_BURST)
+        # JSON unless the client offers the msgpack subprotocol
+        self.offered_subprotocols = self.scope.get('subprotocols') or []
+        self.codec = negotiate(self.offered_subprotocols)
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
 
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        self.profile = await self.get_profile()
+        groups = await self.get_groups()
+        if groups is None:
+            await self.close(code=4403)
+            return
 
-        await self.accept()
+        for group in groups:
+            await self.subscribe(group)
+        await self.accept(subprotocol=self.codec.subprotocol if self.codec.subprotocol in self.offered_subprotocols else None)
 
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if getattr(self, 'flush_task', None):
+            self.flush_task.cancel()
+        for group in list(getattr(self, 'subscriptions', ())):
+            await self.unsubscribe(group)
 
-    # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message_type = text_data_json.get('type', 'update')
-        
-        if message_type == 'appointment_update':
-            appointment_id = text_data_json.get('appointment_id')
-            status = text_data_json.get('status')
-            patient_status = text_data_json.get('patient_status')
-            
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'appointment_update',
-                    'appointment_id': appointment_id,
-                    'status': status,
-                    'patient_status': patient_status,
-                    'timestamp': datetime.now().isoformat(),
-                }
-            )
-        elif message_type == 'doctor_status_update':
-            doctor_id = text_data_json.get('doctor_id')
-            on_duty = text_data_json.get('on_duty')
-            # Broadcast doctor status update to the org group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'doctor_status_update',
-                    'doctor_id': doctor_id,
-                    'on_duty': on_duty,
-                    'timestamp': datetime.now().isoformat(),
-                }
-            )
+    async def subscribe(self, group):
+        if group not in self.subscriptions:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions.add(group)
+
+    async def unsubscribe(self, group):
+        if group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.subscriptions.discard(group)
+
+    async def get_groups(self):
+        """Return the groups to join, or None to reject the connection"""
+        raise NotImplementedError
+
+    async def send_stream(self, stream, payload):
+        """Deliver a server event to the client; multiplexed sockets tag it with its stream"""
+        await self.send(**self.codec.dumps(self.codec.pack(payload)))
+
+    async def send_coalesced(self, stream, key, payload):
+        """
+        Buffer an update; a newer update with the same key replaces it
+        """
+        updates = self.pending.setdefault(stream, {})
+        # A replayed update must not replace a newer live one
+        current = updates.get(key)
+        if current and (current.get('offset') or 0) > (payload.get('offset') or 0):
+            return
+        updates.pop(key, None)
+        updates[key] = payload
+        if len(updates) > settings.WEBSOCKET_MAX_PENDING:
+            # The client has fallen too far behind; it must refetch anyway
+            del self.pending[stream]
+            self.overflowed.add(stream)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_pending())
+
+    async def flush_pending(self):
+        await asyncio.sleep(settings.WEBSOCKET_COALESCE_WINDOW)
+        # Backpressure: while the send budget is spent, keep merging updates
+        while not self.send_bucket.consume():
+            await asyncio.sleep(self.send_bucket.delay())
+
+        pending, self.pending = self.pending, {}
+        overflowed, self.overflowed = self.overflowed, set()
+        self.flush_task = None
+
+        for stream in overflowed:
+            await self.send_stream(stream, {'type': 'resync'})
+        for stream, updates in pending.items():
+            updates = list(updates.values())
+            if len(updates) == 1:
+                await self.send_stream(stream, updates[0])
+            else:
+                await self.send_stream(stream, {'type': 'batch', 'updates': updates})
+
+    async def websocket_receive(self, message):
+        if not self.receive_bucket.consume():
+            await self.send_stream(None, {'type': 'error', 'error': 'rate_limited'})
+            return
+        await super().websocket_receive(message)
+
+    @database_sync_to_async
+    def get_profile(self):
+        return UserProfile.objects.filter(user_id=self.user.id).only('role', 'organization_id').first()
+
+    @property
+    def organization_id(self):
+        return self.profile.organization_id if self.profile else None
+
+    def parse(self, text_data=None, bytes_data=None):
+        try:
+            data = self.codec.loads(text_data, bytes_data)
+        except Exception:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+# Streams. Each mixin authorizes its groups, handles client frames and renders
+# group events; the dedicated consumers and MultiplexConsumer share them.
+
+class AppointmentStreamMixin:
+    async def appointment_groups(self, room_name=None):
+        if not self.organization_id:
+            return None
+        # The client names the org the page expects; it must be the user's own
+        if room_name and room_name != f'org_{self.organization_id}':
+            return None
+        return [org_group(self.organization_id)]
+
+    async def resume_appointments(self, last_offset):
+        """
+        Replay the org updates missed since last_offset, or ask for a resync
+        when the log no longer covers the gap
+        """
+        try:
+            last_offset = int(last_offset)
+        except (TypeError, ValueError):
+            return
+        messages = await database_sync_to_async(eventlog.replay)(self.organization_id, last_offset)
+        if messages is None:
+            await self.send_stream('appointments', {'type': 'resync'})
+            return
+        for message in messages:
+            if message.get('type') in ('appointment_update', 'doctor_status_update'):
+                await getattr(self, message['type'])(message)
+
+    async def receive_appointments(self, data):
+        # Appointment changes go through the HTTP views; clients can only
+        # report their own duty status
+        if data.get('type') == 'doctor_status_update' and self.profile.role == 'doctor':
+            on_duty = bool(data.get('on_duty'))
+            message = await self.set_on_duty(on_duty)
+            await publish(org_group(self.organization_id), message)
+
+    @database_sync_to_async
+    def set_on_duty(self, on_duty):
+        UserProfile.objects.filter(user_id=self.user.id).update(on_duty=on_duty)
+        message = {
+            'type': 'doctor_status_update',
+            'doctor_id': self.user.id,
+            'on_duty': on_duty,
+            'timestamp': timezone.now().isoformat(),
+        }
+        eventlog.record([(self.organization_id, message)])
+        return message
 
     # Receive message from room group
     async def appointment_update(self, event):
-        appointment_id = event['appointment_id']
-        status = event['status']
-        patient_status = event['patient_status']
-        timestamp = event['timestamp']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_coalesced('appointments', ('appointment', event['appointment_id']), {
             'type': 'appointment_update',
-            'appointment_id': appointment_id,
-            'status': status,
-            'patient_status': patient_status,
-            'timestamp': timestamp,
-        }))
+            'appointment_id': event['appointment_id'],
+            'status': event['status'],
+            'patient_status': event['patient_status'],
+            'timestamp': event['timestamp'],
+            'offset': event.get('offset'),
+        })
 
-class NotificationConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.user_id = self.scope['url_route']['kwargs']['user_id']
-        self.room_group_name = f'notifications_{self.user_id}'
-
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+    async def doctor_status_update(self, event):
+        await self.send_coalesced('appointments', ('doctor', event['doctor_id']), {
+            'type': 'doctor_status_update',
+            'doctor_id': event['doctor_id'],
+            'on_duty': event['on_duty'],
+            'timestamp': event['timestamp'],
+            'offset': event.get('offset'),
+        })
 
-        await self.accept()
 
-    async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+class NotificationStreamMixin:
+    async def notification_groups(self, user_id=None):
+        # Only the user's own notification stream
+        if user_id and str(user_id) != str(self.user.id):
+            return None
+        groups = [user_group(self.user.id)]
+        # Receptionists also join their organization's group so org-wide
+        # updates reach all of them with a single group_send
+        if self.profile and self.profile.role == 'receptionist' and self.organization_id:
+            groups.append(receptionist_group(self.organization_id))
+        return groups
 
-    # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message_type = text_data_json.get('type', 'notification')
-        
-        if message_type == 'mark_read':
-            notification_id = text_data_json.get('notification_id')
-            
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
+    async def receive_notifications(self, data):
+        if data.get('type') == 'mark_read':
+            notification_id = data.get('notification_id')
+            if await self.mark_read(notification_id):
+                # Let the user's other open tabs update too
+                await publish(user_group(self.user.id), {
                     'type': 'notification_read',
                     'notification_id': notification_id,
-                }
-            )
+                })
+
+    @database_sync_to_async
+    def mark_read(self, notification_id):
+        return notification_counts.mark_read(self.user, notification_id)
 
     # Receive message from room group
     async def notification_message(self, event):
-        notification_type = event['notification_type']
-        message = event['message']
-        data = event.get('data', {})
-        timestamp = event['timestamp']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_coalesced('notifications', ('notification', next(self.sequence)), {
             'type': 'notification',
-            'notification_type': notification_type,
-            'message': message,
-            'data': data,
-            'timestamp': timestamp,
-        }))
+            'notification_type': event['notification_type'],
+            'message': event['message'],
+            'data': event.get('data', {}),
+            'timestamp': event['timestamp'],
+        })
 
     async def notification_read(self, event):
-        notification_id = event['notification_id']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_coalesced('notifications', ('read', event['notification_id']), {
             'type': 'notification_read',
-            'notification_id': notification_id,
-        }))
+            'notification_id': event['notification_id'],
+        })
+
+    async def notification_count(self, event):
+        # Only the latest count matters
+        await self.send_coalesced('notifications', 'count', {
+            'type': 'notification_count',
+            'count': event['count'],
+        })
+
+
+class QueueStreamMixin:
+    async def queue_groups(self):
+        # Status changes of the user's own appointments, as patient or doctor
+        return [queue_group(self.user.id)]
+
+    # Receive message from room group
+    async def queue_update(self, event):
+        await self.send_coalesced('queue', event['appointment_id'], {
+            'type': 'queue_update',
+            'appointment_id': event['appointment_id'],
+            'status': event['status'],
+            'patient_status': event['patient_status'],
+            'timestamp': event['timestamp'],
+        })
+
+
+class ChatStreamMixin:
+    async def chat_groups(self, room_name):
+        room_id = await self.get_room_id(room_name) if room_name else None
+        if not room_id:
+            return None
+        if not hasattr(self, 'chat_rooms'):
+            self.chat_rooms = {}
+        self.chat_rooms[room_name] = room_id
+        return [chat_group(room_name)]
+
+    @database_sync_to_async
+    def get_room_id(self, room_name):
+        """The room's id if the user is an active participant, else None"""
+        return ChatRoom.objects.filter(
+            name=room_name, participants=self.user, is_active=True
+        ).values_list('id', flat=True).first()
+
+    async def receive_chat(self, data, room_name):
+        if chat_group(room_name) not in self.subscriptions:
+            return
+        room_id = self.chat_rooms[room_name]
+        if data.get('type') == 'mark_read':
+            get_buffer().add_receipt(room_id, self.user.id)
+            return
+        message = str(data.get('message', '')).strip()[:MAX_CHAT_MESSAGE_LENGTH]
+        if not message:
+            return
+
+        # Sender identity comes from the session, not the payload
+        await publish(chat_group(room_name), {
+            'type': 'chat_message',
+            'room': room_name,
+            'message': message,
+            'user_id': self.user.id,
+            'username': self.user.get_full_name() or self.user.username,
+            'timestamp': timezone.now().isoformat(),
+        })
+        # Persisted with other messages in the next write-behind batch
+        await get_buffer().add_message(room_id, self.user.id, message)
+
+    async def disconnect(self, close_code):
+        await super().disconnect(close_code)
+        if getattr(self, 'chat_rooms', None):
+            await get_buffer().flush()
+
+    # Receive message from room group
+    async def chat_message(self, event):
+        await self.send_coalesced('chat', ('message', next(self.sequence)), {
+            'type': 'chat_message',
+            'room': event.get('room'),
+            'message': event['message'],
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'timestamp': event['timestamp'],
+        })
+
+
+class AppointmentConsumer(AppointmentStreamMixin, AuthenticatedConsumer):
+    async def get_groups(self):
+        return await self.appointment_groups(self.scope['url_route']['kwargs'].get('room_name'))
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        await super().connect()
+        # ws/appointments/org_<id>/?last_offset=<n> resumes after a reconnect
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if self.subscriptions and 'last_offset' in query:
+            await self.resume_appointments(query['last_offset'][0])
+
+    # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.parse(text_data, bytes_data)
+        if data:
+            await self.receive_appointments(data)
+
+
+class NotificationConsumer(NotificationStreamMixin, AuthenticatedConsumer):
+    async def get_groups(self):
+        return await self.notification_groups(self.scope['url_route']['kwargs'].get('user_id'))
+
+    # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.parse(text_data, bytes_data)
+        if data:
+            await self.receive_notifications(data)
+
+
+class ChatConsumer(ChatStreamMixin, AuthenticatedConsumer):
+    async def get_groups(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
+        return await self.chat_groups(self.room_name)
 
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+    # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.parse(text_data, bytes_data)
+        if data:
+            await self.receive_chat(data, self.room_name)
 
-        await self.accept()
 
-    async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+class MultiplexConsumer(AppointmentStreamMixin, NotificationStreamMixin, QueueStreamMixin,
+                        ChatStreamMixin, AuthenticatedConsumer):
+    """
+    One socket per browser tab carrying every stream. Clients send
+    {"action": "subscribe" | "unsubscribe", "stream": ..., "room": ...} to
+    manage streams and {"stream": ..., ...} frames for stream messages;
+    server events arrive as {"stream": ..., "payload": {...}}.
+    """
+
+    async def get_groups(self):
+        # Streams are joined on demand; the user was authenticated once in connect()
+        self.streams = {}
+        return []
+
+    @staticmethod
+    def stream_key(stream, room=None):
+        return f'chat:{room}' if stream == 'chat' else stream
+
+    async def stream_groups(self, stream, frame):
+        if stream == 'appointments':
+            return await self.appointment_groups(frame.get('room'))
+        if stream == 'notifications':
+            return await self.notification_groups()
+        if stream == 'queue':
+            return await self.queue_groups()
+        if stream == 'chat':
+            return await self.chat_groups(frame.get('room'))
+        return None
+
+    async def send_stream(self, stream, payload):
+        await self.send(**self.codec.dumps({'stream': stream, 'payload': self.codec.pack(payload)}))
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        user_id = text_data_json.get('user_id')
-        username = text_data_json.get('username', 'Anonymous')
-
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'user_id': user_id,
-                'username': username,
-                'timestamp': datetime.now().isoformat(),
-            }
-        )
+    async def receive(self, text_data=None, bytes_data=None):
+        frame = self.parse(text_data, bytes_data)
+        if not frame:
+            return
+        stream = frame.get('stream')
+        action = frame.get('action')
 
-    # Receive message from room group
-    async def chat_message(self, event):
-        message = event['message']
-        user_id = event['user_id']
-        username = event['username']
-        timestamp = event['timestamp']
+        if action == 'subscribe':
+            await self.subscribe_stream(stream, frame)
+        elif action == 'unsubscribe':
+            await self.unsubscribe_stream(stream, frame)
+        elif self.stream_key(stream, frame.get('room')) not in self.streams:
+            await self.send_stream(stream, {'type': 'error', 'error': 'not_subscribed'})
+        elif stream == 'appointments':
+            await self.receive_appointments(frame)
+        elif stream == 'notifications':
+            await self.receive_notifications(frame)
+        elif stream == 'chat':
+            await self.receive_chat(frame, frame.get('room'))
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': message,
-            'user_id': user_id,
-            'username': username,
-            'timestamp': timestamp,
-        })) 
+    async def subscribe_stream(self, stream, frame):
+        key = self.stream_key(stream, frame.get('room'))
+        if key not in self.streams:
+            groups = await self.stream_groups(stream, frame)
+            if groups is None:
+                await self.send_stream(stream, {'type': 'error', 'error': 'forbidden', 'room': frame.get('room')})
+                return
+            for group in groups:
+                await self.subscribe(group)
+            self.streams[key] = groups
+        ack = {'type': 'subscribed', 'room': frame.get('room')}
+        if stream == 'appointments':
+            # Joined before reading the log, so nothing falls between the two
+            ack['offset'] = await database_sync_to_async(eventlog.head)(self.organization_id)
+        await self.send_stream(stream, ack)
+        if stream == 'appointments' and frame.get('last_offset') is not None:
+            await self.resume_appointments(frame['last_offset'])
 
-    async def doctor_status_update(self, event):
-        doctor_id = event['doctor_id']
-        on_duty = event['on_duty']
-        timestamp = event['timestamp']
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'doctor_status_update',
-            'doctor_id': doctor_id,
-            'on_duty': on_duty,
-            'timestamp': timestamp,
-        })) 
\ No newline at end of file
+    async def unsubscribe_stream(self, stream, frame):
+        groups = self.streams.pop(self.stream_key(stream, frame.get('room')), [])
+        still_used = {group for other in self.streams.values() for group in other}
+        for group in groups:
+            if group not in still_used:
+                await self.unsubscribe(group)
+        await self.send_stream(stream, {'type': 'unsubscribed', 'room': frame.get('room')})
@@ -0,0 +1,58 @@
+"""
+Daily appointment summary for doctors. Tomorrow's confirmed appointments
+are read in one query, grouped by doctor in memory, and the emails go out
+together over the worker's pooled mail connection.
+"""
+from collections import defaultdict
+
+from . import emails
+from .models import Appointment
+
+
+def summary_appointments(day):
+    return Appointment.objects.filter(
+        appointment_date__date=day,
+        status='confirmed',
+        doctor__profile__role='doctor'
+    )
+
+
+def doctors_with_appointments(day):
+    """Ids of the doctors who get a summary for day"""
+    return sorted(set(summary_appointments(day).values_list('doctor_id', flat=True)))
+
+
+def schedules(day, doctor_ids=None):
+    """
+    {doctor: [appointments in time order]} for day, doctors and patients
+    joined into the same query
+    """
+    appointments = summary_appointments(day).select_related('doctor', 'patient').only(
+        'id', 'appointment_date', 'appointment_type', 'fee', 'doctor_id', 'patient_id',
+        'doctor__id', 'doctor__username', 'doctor__first_name', 'doctor__last_name', 'doctor__email',
+        'patient__id', 'patient__username', 'patient__first_name', 'patient__last_name'
+    ).order_by('doctor_id', 'appointment_date')
+    if doctor_ids is not None:
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+    grouped = defaultdict(list)
+    for appointment in appointments:
+        grouped[appointment.doctor].append(appointment)
+    return grouped
+
+
+def build_message(doctor, day, appointments):
+    subject = f"Tomorrow's Appointments - {day.strftime('%B %d, %Y')}"
+    return emails.build('daily_summary', subject, [doctor.email], {
+        'doctor': doctor,
+        'day': day,
+        'appointments': appointments,
+    })
+
+
+def send_summaries(day, doctor_ids=None):
+    """Send the summaries for day over the pooled connection; returns the number sent"""
+    return emails.send([
+        build_message(doctor, day, appointments)
+        for doctor, appointments in schedules(day, doctor_ids).items()
+        if doctor.email
+    ])
@@ -0,0 +1,90 @@
+"""
+Email rendering and sending for tasks. Templates are compiled once per
+process (templates/emails/<name>.txt and .html) and mail goes out over a
+pooled SMTP connection that each worker process opens once and reuses,
+reconnecting when the server drops it.
+"""
+import logging
+import os
+from functools import lru_cache
+from smtplib import SMTPConnectError, SMTPException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+# Failures worth retrying later: the server or the network, not the message
+TRANSIENT_ERRORS = (SMTPException, ConnectionError, TimeoutError)
+# The server itself cannot be reached: every other message would fail too
+UNAVAILABLE_ERRORS = (SMTPConnectError, SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+@lru_cache(maxsize=None)
+def templates(name):
+    """The compiled (text, html) templates for name"""
+    return get_template(f'emails/{name}.txt'), get_template(f'emails/{name}.html')
+
+
+def build(name, subject, to, context):
+    text, html = templates(name)
+    message = EmailMultiAlternatives(
+        subject=subject,
+        body=text.render(context).strip() + '\n',
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=to,
+    )
+    message.attach_alternative(html.render(context), 'text/html')
+    return message
+
+
+APPOINTMENT_SUBJECTS = {
+    'confirmation': 'Appointment Confirmed',
+    'cancellation': 'Appointment Cancelled',
+    'reminder': 'Appointment Reminder',
+}
+
+
+def appointment_message(appointment, kind):
+    """The patient's email of the given kind for appointment"""
+    when = appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')
+    return build(f'appointment_{kind}', f"{APPOINTMENT_SUBJECTS[kind]} - {when}", [appointment.patient.email], {
+        'appointment': appointment,
+        'patient': appointment.patient,
+        'doctor': appointment.doctor,
+    })
+
+
+# One open connection per process and backend; a forked worker opens its own
+_pool = {}
+
+
+def connection():
+    key = (os.getpid(), settings.EMAIL_BACKEND)
+    if key not in _pool:
+        conn = get_connection(fail_silently=False)
+        conn.open()
+        _pool[key] = conn
+    return _pool[key]
+
+
+def close():
+    while _pool:
+        _, conn = _pool.popitem()
+        try:
+            conn.close()
+        except Exception as e:
+            logger.error(f"Closing pooled mail connection failed: {e}")
+
+
+def send(messages):
+    """Send messages over the pooled connection; returns the number sent"""
+    if not messages:
+        return 0
+    try:
+        return connection().send_messages(messages) or 0
+    except SMTPServerDisconnected:
+        # The server closed an idle connection: reconnect once
+        close()
+        return connection().send_messages(messages) or 0
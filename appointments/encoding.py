@@ -0,0 +1,95 @@
+"""
+WebSocket frame encodings, negotiated per connection through the
+Sec-WebSocket-Protocol header. JSON frames keep the verbose dict shape;
+msgpack frames pack high-fanout events into positional arrays with epoch
+millisecond timestamps.
+"""
+import json
+import logging
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:  # installed with channels-redis; JSON still works without it
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_SUBPROTOCOL = 'pulsecal.json'
+MSGPACK_SUBPROTOCOL = 'pulsecal.msgpack'
+
+# Event type -> (type code, field order). Clients hold the same table.
+COMPACT_SCHEMAS = {
+    'batch': (0, ('updates',)),
+    'appointment_update': (1, ('appointment_id', 'status', 'patient_status', 'timestamp', 'offset')),
+    'doctor_status_update': (2, ('doctor_id', 'on_duty', 'timestamp', 'offset')),
+    'queue_update': (3, ('appointment_id', 'status', 'patient_status', 'timestamp')),
+    'notification': (4, ('notification_type', 'message', 'data', 'timestamp')),
+    'notification_read': (5, ('notification_id',)),
+    'notification_count': (6, ('count',)),
+}
+
+
+def epoch_ms(value):
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return value
+
+
+def compact(payload):
+    """
+    Pack a payload into [type code, *fields]; types without a schema
+    (chat, acks, errors) are left as dicts
+    """
+    schema = COMPACT_SCHEMAS.get(payload.get('type'))
+    if not schema:
+        return payload
+    code, fields = schema
+    values = []
+    for field in fields:
+        value = payload.get(field)
+        if field == 'timestamp':
+            value = epoch_ms(value)
+        elif field == 'updates':
+            value = [compact(update) for update in value]
+        values.append(value)
+    return [code, *values]
+
+
+class JSONCodec:
+    subprotocol = JSON_SUBPROTOCOL
+
+    def pack(self, payload):
+        return payload
+
+    def dumps(self, frame):
+        return {'text_data': json.dumps(frame)}
+
+    def loads(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def pack(self, payload):
+        return compact(payload)
+
+    def dumps(self, frame):
+        return {'bytes_data': msgpack.packb(frame, use_bin_type=True)}
+
+    def loads(self, text_data=None, bytes_data=None):
+        # Client frames are small and rare; accept JSON text as well
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data, raw=False)
+        return json.loads(text_data)
+
+
+def negotiate(subprotocols):
+    """
+    Pick the codec for the client's offered subprotocols (JSON by default)
+    """
+    if MSGPACK_SUBPROTOCOL in subprotocols and msgpack is not None:
+        return MsgpackCodec()
+    return JSONCodec()
@@ -0,0 +1,80 @@
+"""
+Bounded per-organization event log. Every org-wide realtime update is
+stored with a monotonically increasing offset (the row id) so a client
+that reconnects can replay just the updates it missed.
+"""
+import logging
+
+from django.conf import settings
+
+from .models import OrganizationEvent
+
+logger = logging.getLogger(__name__)
+
+
+def record(entries):
+    """
+    Append (organization_id, message) pairs to the log and stamp each
+    message with its 'offset'. Returns the stamped messages.
+    """
+    entries = [(org_id, message) for org_id, message in entries if org_id]
+    if not entries:
+        return []
+    try:
+        events = OrganizationEvent.objects.bulk_create([
+            OrganizationEvent(organization_id=org_id, message=message)
+            for org_id, message in entries
+        ])
+    except Exception as e:
+        logger.error(f"Recording {len(entries)} organization events failed: {e}")
+        return [message for _, message in entries]
+
+    for event, (_, message) in zip(events, entries):
+        message['offset'] = event.id
+    trim({org_id for org_id, _ in entries})
+    return [message for _, message in entries]
+
+
+def trim(organization_ids):
+    """
+    Keep only the newest EVENT_LOG_SIZE events of each organization
+    """
+    size = settings.EVENT_LOG_SIZE
+    for org_id in organization_ids:
+        cutoff = list(
+            OrganizationEvent.objects.filter(organization_id=org_id)
+            .order_by('-id').values_list('id', flat=True)[size:size + 1]
+        )
+        if cutoff:
+            OrganizationEvent.objects.filter(organization_id=org_id, id__lte=cutoff[0]).delete()
+
+
+def head(organization_id):
+    """
+    The latest offset of an organization, 0 when its log is empty
+    """
+    latest = (OrganizationEvent.objects.filter(organization_id=organization_id)
+              .order_by('-id').values_list('id', flat=True).first())
+    return latest or 0
+
+
+def replay(organization_id, last_offset):
+    """
+    Messages after last_offset in order, or None when the gap cannot be
+    replayed (trimmed out of the log or longer than EVENT_LOG_REPLAY_LIMIT)
+    """
+    events = OrganizationEvent.objects.filter(organization_id=organization_id)
+    if last_offset and not events.filter(id=last_offset).exists():
+        # Trimming drops the oldest events first: if the client's last
+        # event is gone, so may be some of the ones after it
+        return None
+    limit = settings.EVENT_LOG_REPLAY_LIMIT
+    rows = list(events.filter(id__gt=last_offset).values_list('id', 'message')[:limit + 1])
+    if len(rows) > limit:
+        return None
+    messages = []
+    for offset, message in rows:
+        message['offset'] = offset
+        messages.append(message)
+    return messages
+
@@ -0,0 +1,318 @@
+"""
+Domain event dispatcher: side effects are released on transaction commit,
+buffered per request by EventDispatchMiddleware and delivered in one batch
+(in-process, or by a Celery worker when EVENT_DELIVERY = 'celery'). With
+EVENT_DELIVERY = 'outbox' events are written to the transactional outbox
+instead and delivered by its relay (see outbox.py).
+"""
+import hashlib
+import logging
+import uuid
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+
+from . import audit, eventlog, outbox
+from .models import Appointment, UserProfile
+from .realtime import publish_many_sync, user_group
+from .utils import (
+    notification_messages, appointment_update_message,
+    appointment_broadcast_messages, queue_update_messages
+)
+
+logger = logging.getLogger(__name__)
+
+# Events committed during the current request, or None outside a request scope
+_pending_events = ContextVar('pending_events', default=None)
+
+# The request's Idempotency-Key header and the number of events dispatched so far
+_idempotency_scope = ContextVar('idempotency_scope', default=None)
+
+# Event type -> handler(list of payloads) returning (group, message) pairs to push
+EVENT_HANDLERS = {}
+
+
+def event_handler(event_type):
+    def register(func):
+        EVENT_HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def dispatch(event_type, payload, key=None):
+    """
+    Queue a domain event. The payload dict must be JSON serializable so it can
+    be handed to Celery. key makes the event idempotent in the outbox; it
+    defaults to one derived from the request's Idempotency-Key header, so a
+    retried request does not deliver its events twice.
+    """
+    if event_type not in EVENT_HANDLERS:
+        raise ValueError(f"Unknown event type: {event_type}")
+    if getattr(settings, 'EVENT_DELIVERY', 'sync') == 'outbox':
+        outbox.record(event_type, payload, key or next_event_key())
+        return
+    event = {'type': event_type, 'payload': payload}
+    transaction.on_commit(lambda: _release(event))
+
+
+def next_event_key():
+    scope = _idempotency_scope.get()
+    if scope is None:
+        return uuid.uuid4().hex
+    scope['count'] += 1
+    return hashlib.sha256(f"{scope['key']}:{scope['count']}".encode()).hexdigest()
+
+
+def _release(event):
+    pending = _pending_events.get()
+    if pending is None:
+        # Outside a request (tasks, shell): nothing to batch with
+        flush([event])
+    else:
+        pending.append(event)
+
+
+def start_collecting():
+    return _pending_events.set([])
+
+
+def stop_collecting(token):
+    events = _pending_events.get() or []
+    _pending_events.reset(token)
+    return events
+
+
+def flush(events):
+    """
+    Deliver a batch of committed events in-process or via Celery
+    """
+    if not events:
+        return
+    if getattr(settings, 'EVENT_DELIVERY', 'sync') == 'celery':
+        from .tasks import deliver_events_task
+        try:
+            deliver_events_task.delay(events)
+            return
+        except Exception as e:
+            logger.error(f"Queueing {len(events)} events failed, delivering in-process: {e}")
+    deliver(events)
+
+
+def deliver(events):
+    """
+    Run the handlers for a batch of events, then push every resulting
+    WebSocket message in a single channel-layer round
+    """
+    publish(handle(events))
+
+
+def handle(events, failed=None):
+    """
+    Run the handlers for a batch of events, grouped by type, and return the
+    (group, message) pairs to push. Each handler's database work runs in its
+    own savepoint so one failing handler does not undo the others. When a
+    group fails, its events are retried one by one so a single bad payload
+    fails alone; events that still fail are appended to `failed` as
+    (event, error) when a list is given, and only logged otherwise.
+    """
+    by_type = defaultdict(list)
+    for event in events:
+        by_type[event['type']].append(event)
+
+    messages = []
+    for event_type, group in by_type.items():
+        try:
+            messages.extend(run_handler(event_type, group))
+            continue
+        except Exception as e:
+            logger.error(f"Handling {len(group)} '{event_type}' events failed: {e}")
+            if len(group) == 1:
+                if failed is not None:
+                    failed.append((group[0], str(e)))
+                continue
+        for event in group:
+            try:
+                messages.extend(run_handler(event_type, [event]))
+            except Exception as e:
+                logger.error(f"Handling a '{event_type}' event failed: {e}")
+                if failed is not None:
+                    failed.append((event, str(e)))
+    return messages
+
+
+def run_handler(event_type, events):
+    with transaction.atomic():
+        return EVENT_HANDLERS[event_type]([event['payload'] for event in events]) or []
+
+
+def publish(messages):
+    try:
+        publish_many_sync(messages)
+    except Exception as e:
+        logger.error(f"WebSocket delivery of {len(messages)} messages failed: {e}")
+
+
+class EventDispatchMiddleware:
+    """
+    Collect events dispatched while handling a request and deliver them in
+    one batch once the view has finished
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = start_collecting()
+        # Keys are per user, so one client cannot suppress another's events
+        key = request.headers.get('Idempotency-Key')
+        user = getattr(request, 'user', None)
+        scoped = key and user is not None and user.is_authenticated
+        scope_token = _idempotency_scope.set({'key': f'{user.pk}:{key}', 'count': 0} if scoped else None)
+        try:
+            return self.get_response(request)
+        finally:
+            _idempotency_scope.reset(scope_token)
+            flush(stop_collecting(token))
+
+
+# Convenience wrappers used by views
+
+def dispatch_notification(user_id, notification_type, title, message, data=None):
+    dispatch('notification', {
+        'user_id': user_id,
+        'notification_type': notification_type,
+        'title': title,
+        'message': message,
+        'data': data or {}
+    })
+
+
+def dispatch_appointment_update(appointment):
+    dispatch('appointment_update', {
+        'organization_id': appointment.organization_id,
+        'appointment_id': appointment.id,
+        'doctor_id': appointment.doctor_id,
+        'patient_id': appointment.patient_id,
+        'status': appointment.status,
+        'patient_status': appointment.patient_status
+    })
+
+
+def dispatch_appointment_broadcast(appointment, event_type='update'):
+    dispatch('appointment_broadcast', {
+        'appointment_id': appointment.id,
+        'doctor_id': appointment.doctor_id,
+        'patient_id': appointment.patient_id,
+        'organization_id': appointment.organization_id,
+        'event_type': event_type
+    })
+
+
+def dispatch_appointment_email(appointment, kind):
+    """kind: 'confirmation' or 'cancellation'"""
+    dispatch('appointment_email', {'appointment_id': appointment.id, 'kind': kind})
+
+
+def dispatch_appointment_audit(request, action, appointment, details=''):
+    """
+    Buffer the audit row; it is written with the request's other audit rows
+    after commit (see audit.py)
+    """
+    audit.record(
+        action,
+        user=request.user if request else None,
+        details=details,
+        object_type='appointment',
+        object_id=appointment.id if appointment else None,
+        ip_address=audit.client_ip(request) if request else None,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request else None
+    )
+
+
+# Handlers
+
+@event_handler('notification')
+def handle_notifications(payloads):
+    return notification_messages(payloads)
+
+
+@event_handler('appointment_update')
+def handle_appointment_updates(payloads):
+    messages = []
+    logged = []
+    for payload in payloads:
+        if payload.get('organization_id'):
+            group, message = appointment_update_message(
+                payload['organization_id'],
+                payload['appointment_id'],
+                payload['status'],
+                payload['patient_status']
+            )
+            messages.append((group, message))
+            logged.append((payload['organization_id'], message))
+        messages.extend(queue_update_messages(
+            payload['appointment_id'],
+            payload.get('doctor_id'),
+            payload.get('patient_id'),
+            payload['status'],
+            payload['patient_status']
+        ))
+    # Stamps the org messages with their resume offsets before they go out
+    eventlog.record(logged)
+    return messages
+
+
+@event_handler('appointment_broadcast')
+def handle_appointment_broadcasts(payloads):
+    messages = []
+    for payload in payloads:
+        messages.extend(appointment_broadcast_messages(
+            payload['appointment_id'],
+            payload['doctor_id'],
+            payload['patient_id'],
+            payload['organization_id'],
+            payload['event_type']
+        ))
+    return messages
+
+
+@event_handler('appointment_email')
+def handle_appointment_emails(payloads):
+    from . import emails, mail_outbox
+
+    appointments = Appointment.objects.select_related('patient', 'doctor').in_bulk(
+        {payload['appointment_id'] for payload in payloads}
+    )
+    mail_outbox.enqueue([
+        emails.appointment_message(appointments[payload['appointment_id']], payload['kind'])
+        for payload in payloads
+        if payload['appointment_id'] in appointments and appointments[payload['appointment_id']].patient.email
+    ])
+
+
+@event_handler('audit')
+def handle_audit(payloads):
+    # Kept for 'audit' events already waiting in the outbox
+    for payload in payloads:
+        audit.record(
+            payload['action'],
+            user_id=payload['user_id'],
+            details=payload['details'],
+            object_type=payload['object_type'],
+            object_id=payload['object_id'],
+            ip_address=payload['ip_address'],
+            user_agent=payload['user_agent']
+        )
+
+
+@event_handler('notification_count')
+def handle_notification_counts(payloads):
+    # Read the committed counters once for every user touched in the batch
+    user_ids = {user_id for payload in payloads for user_id in payload['user_ids']}
+    counts = UserProfile.objects.filter(user_id__in=user_ids).values_list('user_id', 'unread_notifications')
+    return [
+        (user_group(user_id), {'type': 'notification_count', 'count': count})
+        for user_id, count in counts
+    ]
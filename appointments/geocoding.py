@@ -0,0 +1,229 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+# Marker for lookups that errored, as opposed to returning no match
+_FAILED = object()
+
+
+class GeocodingError(Exception):
+    """Raised when a provider fails (as opposed to finding no match)"""
+
+
+class BaseGeocodingProvider:
+    """
+    Interface for geocoding providers. geocode() returns a dict with
+    latitude, longitude and place_id, or None when the address has no match.
+    """
+    name = 'base'
+
+    def geocode(self, address):
+        raise NotImplementedError
+
+
+class GoogleGeocodingProvider(BaseGeocodingProvider):
+    """Google Maps Geocoding API provider"""
+    name = 'google'
+
+    def __init__(self, api_key=None, timeout=10):
+        self.api_key = api_key or settings.GOOGLE_MAPS_API_KEY
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def geocode(self, address):
+        if not self.api_key:
+            raise GeocodingError('GOOGLE_MAPS_API_KEY is not configured')
+        try:
+            response = self.session.get(
+                GOOGLE_GEOCODE_URL,
+                params={'address': address, 'key': self.api_key},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocodingError(f"Geocoding request failed: {e}")
+
+        status = payload.get('status')
+        if status == 'ZERO_RESULTS':
+            return None
+        if status != 'OK':
+            raise GeocodingError(f"Geocoding failed with status {status}")
+
+        result = payload['results'][0]
+        location = result['geometry']['location']
+        return {
+            'latitude': location['lat'],
+            'longitude': location['lng'],
+            'place_id': result.get('place_id'),
+        }
+
+
+class StubGeocodingProvider(BaseGeocodingProvider):
+    """
+    Offline provider for tests and development. Returns a stable pseudo-random
+    point derived from the address, and counts calls so tests can assert on cache hits.
+    """
+    name = 'stub'
+
+    def __init__(self, fixtures=None):
+        self.fixtures = {normalize_address(k): v for k, v in (fixtures or {}).items()}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def geocode(self, address):
+        with self._lock:
+            self.calls += 1
+        normalized = normalize_address(address)
+        if normalized in self.fixtures:
+            return self.fixtures[normalized]
+        digest = hashlib.sha256(normalized.encode('utf-8')).digest()
+        lat = int.from_bytes(digest[:4], 'big') / 2 ** 32 * 170 - 85
+        lng = int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 360 - 180
+        return {
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'place_id': f"stub-{digest[:8].hex()}",
+        }
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at most `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+def get_geocoding_provider():
+    """
+    Instantiate the provider configured in settings.GEOCODING_PROVIDER
+    """
+    provider_path = getattr(settings, 'GEOCODING_PROVIDER', 'appointments.geocoding.GoogleGeocodingProvider')
+    return import_string(provider_path)()
+
+
+def normalize_address(address):
+    """
+    Normalize an address so trivially different spellings share a cache entry
+    """
+    address = re.sub(r'\s+', ' ', (address or '').strip().lower())
+    return re.sub(r'\s*,\s*', ', ', address).strip(' ,.')
+
+
+def address_hash(address):
+    return hashlib.sha256(normalize_address(address).encode('utf-8')).hexdigest()
+
+
+def _cache_result(entry):
+    if entry.latitude is None or entry.longitude is None:
+        return None
+    return {
+        'latitude': entry.latitude,
+        'longitude': entry.longitude,
+        'place_id': entry.place_id,
+    }
+
+
+def _to_decimal(value, places):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-places))
+
+
+def geocode_many(addresses, provider=None, workers=4, rate_limit=None):
+    """
+    Geocode many addresses, returning {address: result or None}.
+
+    Cached addresses (including cached misses) are resolved with one query and
+    never reach the provider. Remaining addresses are looked up concurrently,
+    rate-limited, and written back to the cache in bulk.
+    """
+    addresses = [a for a in addresses if a and a.strip()]
+    if not addresses:
+        return {}
+
+    hashes = {address: address_hash(address) for address in addresses}
+    cached = {
+        entry.address_hash: entry
+        for entry in GeocodeCache.objects.filter(address_hash__in=set(hashes.values()))
+    }
+
+    # One provider call per distinct normalized address
+    pending = {}
+    for address, key in hashes.items():
+        if key not in cached and key not in pending:
+            pending[key] = address
+
+    lookups = {}
+    if pending:
+        provider = provider or get_geocoding_provider()
+        if rate_limit is None:
+            rate_limit = getattr(settings, 'GEOCODING_RATE_LIMIT', 10)
+        limiter = RateLimiter(rate_limit)
+
+        def lookup(address):
+            limiter.wait()
+            try:
+                return provider.geocode(address)
+            except GeocodingError as e:
+                logger.error(f"Geocoding failed for '{address}': {e}")
+                return _FAILED
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for key, result in zip(pending, executor.map(lookup, pending.values())):
+                lookups[key] = result
+
+        # Provider errors are not cached so they are retried on the next run
+        new_entries = [
+            GeocodeCache(
+                address_hash=key,
+                address=normalize_address(pending[key]),
+                latitude=_to_decimal(result['latitude'], 8) if result else None,
+                longitude=_to_decimal(result['longitude'], 8) if result else None,
+                place_id=result.get('place_id') if result else None,
+                provider=provider.name,
+            )
+            for key, result in lookups.items()
+            if result is not _FAILED
+        ]
+        GeocodeCache.objects.bulk_create(new_entries, ignore_conflicts=True)
+        for entry in new_entries:
+            cached[entry.address_hash] = entry
+
+    return {
+        address: _cache_result(cached[key]) if key in cached else None
+        for address, key in hashes.items()
+    }
+
+
+def geocode(address, provider=None):
+    """
+    Geocode a single address through the persistent cache
+    """
+    return geocode_many([address], provider=provider, workers=1).get(address)
@@ -0,0 +1,32 @@
+"""
+Notification inbox, keyset-paginated on (timestamp, id) newest first.
+"""
+from notifications.models import Notification
+
+from .pagination import keyset_page
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def get_page(user, cursor=None, limit=PAGE_SIZE):
+    """
+    One page of the user's notifications, newest first.
+    Returns (notifications, next_cursor); next_cursor is None on the last page.
+    """
+    notifications = Notification.objects.filter(recipient=user).only(
+        'id', 'verb', 'description', 'data', 'unread', 'timestamp'
+    )
+    return keyset_page(notifications, 'timestamp', cursor, limit, MAX_PAGE_SIZE)
+
+
+def serialize(notification):
+    data = notification.data or {}
+    return {
+        'id': notification.id,
+        'type': notification.verb,
+        'title': notification.description,
+        'message': data.get('message', ''),
+        'unread': notification.unread,
+        'timestamp': notification.timestamp.isoformat(),
+    }
@@ -0,0 +1,114 @@
+"""
+Email outbox. Tasks render their mail into OutboundEmail rows instead of
+talking to the mail server; a flush claims pending rows in batches (FOR
+UPDATE SKIP LOCKED, so concurrent flushes never send a row twice), sends
+them over the pooled connection and marks the batch sent with one UPDATE.
+Failed rows are retried on later flushes up to EMAIL_OUTBOX_MAX_ATTEMPTS.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import emails
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SCHEDULED_KEY = 'email_outbox:flush_scheduled'
+
+
+def enqueue(messages):
+    """Store rendered messages with one INSERT and schedule a flush after commit"""
+    rows = []
+    for message in messages:
+        html = next((content for content, mimetype in getattr(message, 'alternatives', []) if mimetype == 'text/html'), '')
+        rows.append(OutboundEmail(to=list(message.to), subject=message.subject, body=message.body, html_body=html))
+    OutboundEmail.objects.bulk_create(rows)
+    schedule_flush()
+    return rows
+
+
+def schedule_flush():
+    """Queue one flush for everything enqueued within EMAIL_OUTBOX_FLUSH_DELAY"""
+    from .tasks import flush_email_outbox
+
+    if getattr(settings, 'EMAIL_OUTBOX_DELIVERY', 'sync') == 'sync':
+        # No workers in this setup: send in-process once the rows are committed
+        transaction.on_commit(flush_now)
+        return
+    delay = settings.EMAIL_OUTBOX_FLUSH_DELAY
+    if cache.add(FLUSH_SCHEDULED_KEY, True, timeout=delay):
+        transaction.on_commit(lambda: flush_email_outbox.apply_async(countdown=delay))
+
+
+def flush_now():
+    try:
+        flush()
+    except Exception as e:
+        # The rows stay pending for the next flush
+        logger.error(f"Flushing the email outbox failed: {e}")
+
+
+def as_message(row):
+    message = EmailMultiAlternatives(
+        subject=row.subject, body=row.body, from_email=settings.DEFAULT_FROM_EMAIL, to=row.to
+    )
+    if row.html_body:
+        message.attach_alternative(row.html_body, 'text/html')
+    return message
+
+
+def flush_batch(batch_size):
+    """
+    Send one batch of pending mail; returns (sent, claimed). A transient
+    server or network failure stops the batch and is raised once the
+    progress so far is committed, so the caller can back off and retry.
+    """
+    transient = None
+    with transaction.atomic():
+        rows = list(
+            OutboundEmail.objects.filter(sent_at__isnull=True, attempts__lt=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+            .order_by('id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        sent, failed = [], []
+        for row in rows:
+            try:
+                emails.send([as_message(row)])
+                sent.append(row.id)
+            except Exception as e:
+                row.last_error = str(e)
+                failed.append(row)
+                if isinstance(e, emails.TRANSIENT_ERRORS):
+                    transient = e
+                    break
+        if sent:
+            OutboundEmail.objects.filter(id__in=sent).update(sent_at=timezone.now())
+        if failed:
+            OutboundEmail.objects.filter(id__in=[row.id for row in failed]).update(attempts=F('attempts') + 1)
+            OutboundEmail.objects.bulk_update(failed, ['last_error'])
+            logger.error(f"{len(failed)} outbound emails failed, last error: {failed[-1].last_error}")
+    if transient:
+        raise transient
+    return len(sent), len(rows)
+
+
+def flush(batch_size=None, max_batches=None):
+    """
+    Send pending mail batch by batch. Returns (sent, done); done is False
+    when max_batches ran out with mail still pending.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    max_batches = max_batches or settings.EMAIL_OUTBOX_MAX_BATCHES
+    total = 0
+    for _ in range(max_batches):
+        sent, claimed = flush_batch(batch_size)
+        total += sent
+        if claimed < batch_size or not sent:
+            return total, True
+    return total, False
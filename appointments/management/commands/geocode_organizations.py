@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from appointments.models import Organization
+from appointments.geocoding import geocode_many, get_geocoding_provider
+from appointments.tiles import invalidate_tiles
+
+
+class Command(BaseCommand):
+    help = 'Fill in missing organization coordinates using the cached geocoder'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Organizations geocoded and saved per batch'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Concurrent provider lookups'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Maximum provider requests per second (defaults to GEOCODING_RATE_LIMIT)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many organizations'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Geocode but do not update organizations'
+        )
+
+    @staticmethod
+    def full_address(org):
+        parts = [org.address, org.city, org.state, org.postal_code, org.country]
+        return ', '.join(p.strip() for p in parts if p and p.strip())
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        limit = options['limit']
+        provider = get_geocoding_provider()
+
+        missing = Organization.objects.filter(
+            Q(latitude__isnull=True) | Q(longitude__isnull=True)
+        ).only('id', 'address', 'city', 'state', 'postal_code', 'country').order_by('id')
+
+        processed = updated = not_found = 0
+        last_id = 0
+        while limit is None or processed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - processed)
+            batch = list(missing.filter(id__gt=last_id)[:size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            processed += len(batch)
+
+            addresses = {org.id: self.full_address(org) for org in batch}
+            results = geocode_many(
+                addresses.values(),
+                provider=provider,
+                workers=options['workers'],
+                rate_limit=options['rate']
+            )
+
+            to_update = []
+            for org in batch:
+                result = results.get(addresses[org.id])
+                if not result:
+                    not_found += 1
+                    continue
+                org.latitude = result['latitude']
+                org.longitude = result['longitude']
+                if result.get('place_id'):
+                    org.google_places_id = result['place_id']
+                to_update.append(org)
+
+            if to_update and not options['dry_run']:
+                Organization.objects.bulk_update(to_update, ['latitude', 'longitude', 'google_places_id'])
+            updated += len(to_update)
+
+            self.stdout.write(f'Processed {processed} organizations ({updated} geocoded)')
+
+        if updated and not options['dry_run']:
+            # bulk_update bypasses post_save, so drop cached map tiles explicitly
+            invalidate_tiles()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Geocoded {updated} of {processed} organizations '
+                f'({not_found} without a match){" [dry run]" if options["dry_run"] else ""}'
+            )
+        )
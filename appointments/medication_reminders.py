@@ -0,0 +1,150 @@
+"""
+Medication reminder engine. Each tick claims the active reminders whose
+next_reminder has passed (SELECT ... FOR UPDATE SKIP LOCKED over the
+(is_active, next_reminder) index), works out every row's following
+occurrence in memory, writes them back with one bulk_update and pushes
+the batch through the notifications pipeline. Reminders that were never
+scheduled get their first occurrence the same way.
+"""
+import calendar
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MedicationReminder
+
+logger = logging.getLogger(__name__)
+
+EVERY_DAY = {1, 2, 3, 4, 5, 6, 7}
+
+
+def weekdays(reminder):
+    """ISO weekdays the reminder fires on"""
+    days = {int(day) for day in reminder.days_of_week or []} & EVERY_DAY
+    if days:
+        return days
+    if reminder.reminder_type == 'weekly':
+        return {reminder.prescription.start_date.isoweekday()}
+    return EVERY_DAY
+
+
+def monthly_date(day_of_month, year, month):
+    """day_of_month in the given month, clamped to its last day"""
+    return datetime(year, month, min(day_of_month, calendar.monthrange(year, month)[1])).date()
+
+
+def next_occurrence(reminder, after):
+    """The first time strictly after `after` at which the reminder fires"""
+    tz = timezone.get_current_timezone()
+    local = timezone.localtime(after, tz)
+
+    def at(day):
+        return timezone.make_aware(datetime.combine(day, reminder.time_of_day), tz)
+
+    if reminder.reminder_type == 'monthly':
+        day_of_month = reminder.prescription.start_date.day
+        year, month = local.year, local.month
+        while True:
+            candidate = at(monthly_date(day_of_month, year, month))
+            if candidate > after:
+                return candidate
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    days = weekdays(reminder)
+    day = local.date()
+    for _ in range(8):
+        if day.isoweekday() in days:
+            candidate = at(day)
+            if candidate > after:
+                return candidate
+        day += timedelta(days=1)
+
+
+def ended(reminder, when):
+    end_date = reminder.prescription.end_date
+    return reminder.prescription.status != 'active' or (end_date and timezone.localtime(when).date() > end_date)
+
+
+def schedule(reminders, now, fired):
+    """
+    Move every reminder to its next occurrence (stamping last_sent for the
+    fired ones) and deactivate those past the prescription's end
+    """
+    for reminder in reminders:
+        if fired:
+            reminder.last_sent = now
+        reminder.next_reminder = next_occurrence(reminder, now)
+        if ended(reminder, reminder.next_reminder):
+            reminder.is_active = False
+    MedicationReminder.objects.bulk_update(reminders, ['next_reminder', 'last_sent', 'is_active'])
+
+
+def schedule_new(now=None):
+    """Give active reminders without a next_reminder their first occurrence"""
+    now = now or timezone.now()
+    reminders = list(
+        MedicationReminder.objects.filter(is_active=True, next_reminder__isnull=True).select_related('prescription')
+    )
+    if reminders:
+        schedule(reminders, now, fired=False)
+    return len(reminders)
+
+
+def claim(now, batch_size):
+    """
+    Claim up to batch_size due reminders and advance them. Reminders whose
+    prescription was stopped or ended before the due occurrence are
+    deactivated without firing. Returns (fired, claimed).
+    """
+    with transaction.atomic():
+        reminders = list(
+            MedicationReminder.objects.filter(is_active=True, next_reminder__lte=now)
+            .order_by('next_reminder')
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('prescription')[:batch_size]
+        )
+        fired, stopped = [], []
+        for reminder in reminders:
+            (stopped if ended(reminder, reminder.next_reminder) else fired).append(reminder)
+        if fired:
+            schedule(fired, now, fired=True)
+        if stopped:
+            MedicationReminder.objects.filter(id__in=[reminder.id for reminder in stopped]).update(is_active=False)
+    return fired, len(reminders)
+
+
+def notify(reminders):
+    from .utils import send_notifications
+
+    return send_notifications([
+        {
+            'user_id': reminder.patient_id,
+            'notification_type': 'medication_reminder',
+            'title': 'Medication Reminder',
+            'message': f"Time to take {reminder.prescription.medication_name} ({reminder.prescription.dosage})",
+            'data': {'reminder_id': reminder.id, 'prescription_id': reminder.prescription_id},
+        }
+        for reminder in reminders
+    ])
+
+
+def dispatch_due(now=None, batch_size=None, max_batches=None):
+    """
+    Fire due reminders batch by batch. Returns (sent, done); done is False
+    when max_batches ran out with reminders still due.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.MEDICATION_REMINDER_BATCH_SIZE
+    max_batches = max_batches or settings.MEDICATION_REMINDER_MAX_BATCHES
+    schedule_new(now)
+    sent = 0
+    for _ in range(max_batches):
+        reminders, claimed = claim(now, batch_size)
+        if reminders:
+            sent += notify(reminders)
+        if claimed < batch_size:
+            return sent, True
+    return sent, False
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_insurance_appointment_is_virtual_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address_hash', models.CharField(max_length=64, unique=True)),
+                ('address', models.TextField()),
+                ('latitude', models.DecimalField(blank=True, decimal_places=8, max_digits=10, null=True)),
+                ('longitude', models.DecimalField(blank=True, decimal_places=8, max_digits=11, null=True)),
+                ('place_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('provider', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Geocode Cache Entry',
+                'verbose_name_plural': 'Geocode Cache',
+            },
+        ),
+    ]
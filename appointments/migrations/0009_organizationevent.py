@@ -0,0 +1,29 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_geocodecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='appointments.organization')),
+            ],
+            options={
+                'verbose_name': 'Organization Event',
+                'verbose_name_plural': 'Organization Events',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['organization', 'id'], name='appointment_organiz_6efbc0_idx')],
+            },
+        ),
+    ]
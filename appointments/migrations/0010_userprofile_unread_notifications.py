@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    UserProfile = apps.get_model('appointments', 'UserProfile')
+    counts = (
+        Notification.objects.filter(unread=True).order_by()
+        .values_list('recipient_id').annotate(count=Count('id'))
+    )
+    for recipient_id, count in counts:
+        UserProfile.objects.filter(user_id=recipient_id).update(unread_notifications=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_organizationevent'),
+        ('notifications', '0009_alter_notification_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the keyset the notification inbox pages over. The table belongs to
+    django-notifications, so the index is created with plain SQL.
+    """
+
+    dependencies = [
+        ('appointments', '0010_userprofile_unread_notifications'),
+        ('notifications', '0009_alter_notification_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS notification_inbox_idx '
+            'ON notifications_notification (recipient_id, timestamp DESC, id DESC);',
+            'DROP INDEX IF EXISTS notification_inbox_idx;',
+        ),
+    ]
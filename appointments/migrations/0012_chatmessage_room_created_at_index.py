@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_notification_inbox_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'created_at'], name='appointment_room_id_e454ee_idx'),
+        ),
+    ]
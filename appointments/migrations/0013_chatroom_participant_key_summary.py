@@ -0,0 +1,95 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import hashlib
+
+
+def backfill_room_summaries(apps, schema_editor):
+    ChatRoom = apps.get_model('appointments', 'ChatRoom')
+    ChatMessage = apps.get_model('appointments', 'ChatMessage')
+    ChatRoomSummary = apps.get_model('appointments', 'ChatRoomSummary')
+    seen_keys = set()
+    for room in ChatRoom.objects.prefetch_related('participants').order_by('id'):
+        participants = list(room.participants.all())
+        ids = ','.join(str(i) for i in sorted({p.id for p in participants}))
+        key = hashlib.sha256(ids.encode()).hexdigest()
+        # Rooms run oldest first: the oldest room of a participant set takes the
+        # key, later duplicates keep a null key
+        room.participant_key = key if key not in seen_keys else None
+        seen_keys.add(key)
+        room.participant_names = ', '.join(
+            f'{p.first_name} {p.last_name}'.strip() or p.username for p in participants
+        )
+        last = ChatMessage.objects.filter(room=room).select_related('sender').order_by('-created_at', '-id').first()
+        if last:
+            room.last_message = last.message[:255]
+            room.last_message_sender = f'{last.sender.first_name} {last.sender.last_name}'.strip() or last.sender.username
+            room.last_message_at = last.created_at
+        room.save()
+        ChatRoomSummary.objects.bulk_create([
+            ChatRoomSummary(
+                room=room,
+                user=p,
+                unread_count=ChatMessage.objects.filter(room=room, is_read=False).exclude(sender=p).count()
+            )
+            for p in participants
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appointments', '0012_chatmessage_room_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_sender',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='participant_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='participant_names',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='chatroom',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='ChatRoomSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='appointments.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_room_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Chat Room Summary',
+                'verbose_name_plural': 'Chat Room Summaries',
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_room_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0013_chatroom_participant_key_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('reminder_sent_at__isnull', True), ('status', 'confirmed')), fields=['appointment_date'], name='appointment_reminder_due_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0014_appointment_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicationreminder',
+            index=models.Index(fields=['is_active', 'next_reminder'], name='appointment_is_acti_82a72b_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0017_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='ip_address',
+            field=models.GenericIPAddressField(blank=True, null=True),
+        ),
+    ]
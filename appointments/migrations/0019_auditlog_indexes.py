@@ -0,0 +1,41 @@
+# Generated by Django 4.2.11 on 2026-10-18 23:19
+
+from django.db import migrations, models
+
+
+def create_brin_index(apps, schema_editor):
+    # Rows arrive in timestamp order, so a BRIN index covers date ranges at a
+    # fraction of a B-tree's size. PostgreSQL only.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS auditlog_timestamp_brin '
+            'ON appointments_auditlog USING brin (timestamp);'
+        )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS auditlog_timestamp_brin;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0018_auditlog_ip_address'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['object_type', 'object_id', 'timestamp'], name='appointment_object__3676f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['user', 'timestamp'], name='appointment_user_id_37cfb9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'timestamp'], name='appointment_action_18ec9c_idx'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0019_auditlog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='appointment_timesta_80f80d_idx'),
+        ),
+    ]
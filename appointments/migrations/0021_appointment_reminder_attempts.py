@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0020_auditlog_timestamp_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0021_appointment_reminder_attempts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboxevent',
+            name='appointment_outbox_unsent_idx',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='dead_lettered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('dead_lettered_at__isnull', True), ('processed_at__isnull', True)), fields=['id'], name='appointment_outbox_unsent_idx'),
+        ),
+    ]
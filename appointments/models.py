@@ -57,6 +57,7 @@ class UserProfile(models.Model):
     certifications = models.JSONField(default=list, blank=True)
     next_available = models.DateTimeField(blank=True, null=True)
     total_appointments = models.PositiveIntegerField(default=0, blank=True, null=True)
+    unread_notifications = models.PositiveIntegerField(default=0)  # maintained by notification_counts
     
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.role} ({self.organization})"
@@ -112,12 +113,20 @@ class Appointment(models.Model):
     is_virtual = models.BooleanField(default=False)
     meeting_link = models.URLField(blank=True, null=True)
     meeting_password = models.CharField(max_length=50, blank=True, null=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)  # claimed by the reminder scheduler
+    reminder_attempts = models.PositiveSmallIntegerField(default=0)  # failed reminder sends
     
     def __str__(self):
         return f"{self.patient.get_full_name()} - {self.doctor.get_full_name()} - {self.appointment_date}"
     
     class Meta:
         ordering = ['-appointment_date']
+        indexes = [
+            models.Index(
+                fields=['appointment_date'], name='appointment_reminder_due_idx',
+                condition=models.Q(reminder_sent_at__isnull=True, status='confirmed')
+            )
+        ]
         verbose_name = "Appointment"
         verbose_name_plural = "Appointments"
     
@@ -340,6 +349,7 @@ class MedicationReminder(models.Model):
         return f"{self.patient.get_full_name()} - {self.prescription.medication_name}"
     
     class Meta:
+        indexes = [models.Index(fields=['is_active', 'next_reminder'])]
         verbose_name = "Medication Reminder"
         verbose_name_plural = "Medication Reminders"
 
@@ -372,8 +382,13 @@ class TelemedicineSession(models.Model):
         verbose_name_plural = "Telemedicine Sessions"
 
 class ChatRoom(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, db_index=True)
     participants = models.ManyToManyField(User, related_name='chat_rooms')
+    participant_key = models.CharField(max_length=64, unique=True, blank=True, null=True)  # sha256 of sorted participant ids
+    participant_names = models.TextField(blank=True)  # denormalized for the rooms list
+    last_message = models.CharField(max_length=255, blank=True)
+    last_message_sender = models.CharField(max_length=150, blank=True)
+    last_message_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     
@@ -396,9 +411,25 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [models.Index(fields=['room', 'created_at'])]
         verbose_name = "Chat Message"
         verbose_name_plural = "Chat Messages"
 
+class ChatRoomSummary(models.Model):
+    """Per-participant projection of a room, kept current on write so the rooms list is one query"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='summaries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_room_summaries')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.user} in {self.room} ({self.unread_count} unread)"
+    
+    class Meta:
+        unique_together = ('room', 'user')
+        verbose_name = "Chat Room Summary"
+        verbose_name_plural = "Chat Room Summaries"
+
 class AuditLog(models.Model):
     ACTION_CHOICES = [
         ('appointment_created', 'Appointment Created'),
@@ -424,6 +455,7 @@ class AuditLog(models.Model):
     details = models.TextField(blank=True)
     object_type = models.CharField(max_length=50, blank=True, null=True)  # e.g., 'appointment', 'user'
     object_id = models.PositiveIntegerField(blank=True, null=True)  # ID of the related object
+    ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True, null=True)
     
     def __str__(self):
@@ -431,6 +463,13 @@ class AuditLog(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'timestamp']),
+            models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['action', 'timestamp']),
+            # The unfiltered browse: ORDER BY timestamp DESC, id DESC LIMIT n
+            models.Index(fields=['timestamp', 'id']),
+        ]
         verbose_name = "Audit Log"
         verbose_name_plural = "Audit Logs"
 
@@ -454,3 +493,82 @@ class DoctorOrganizationJoinRequest(models.Model):
     
     def __str__(self):
         return f"{self.doctor.get_full_name()} - {self.organization.name} - {self.get_status_display()}"
+
+class GeocodeCache(models.Model):
+    """Persistent address -> coordinate cache so repeat lookups never hit the provider"""
+    address_hash = models.CharField(max_length=64, unique=True)  # sha256 of the normalized address
+    address = models.TextField()
+    latitude = models.DecimalField(max_digits=10, decimal_places=8, blank=True, null=True)  # null caches a miss
+    longitude = models.DecimalField(max_digits=11, decimal_places=8, blank=True, null=True)
+    place_id = models.CharField(max_length=255, blank=True, null=True)
+    provider = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.address} ({self.latitude}, {self.longitude})"
+    
+    class Meta:
+        verbose_name = "Geocode Cache Entry"
+        verbose_name_plural = "Geocode Cache"
+
+class OrganizationEvent(models.Model):
+    """Bounded per-organization log of realtime updates; the id is the client's resume offset"""
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='events')
+    message = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.organization_id} #{self.id} {self.message.get('type')}"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['organization', 'id'])]
+        verbose_name = "Organization Event"
+        verbose_name_plural = "Organization Events"
+
+class OutboundEmail(models.Model):
+    """Rendered email waiting in the outbox until the next bulk flush"""
+    to = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    def __str__(self):
+        return f"{', '.join(self.to)}: {self.subject}"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], name='appointment_outbox_pending_idx', condition=models.Q(sent_at__isnull=True))
+        ]
+        verbose_name = "Outbound Email"
+        verbose_name_plural = "Outbound Emails"
+
+class OutboxEvent(models.Model):
+    """
+    Domain event written in the same transaction as the change it describes;
+    the outbox relay delivers it after commit, in id order
+    """
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)  # failed deliveries
+    last_error = models.TextField(blank=True)
+    dead_lettered_at = models.DateTimeField(null=True, blank=True)  # gave up after OUTBOX_MAX_ATTEMPTS
+    
+    def __str__(self):
+        return f"#{self.id} {self.event_type}"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], name='appointment_outbox_unsent_idx', condition=models.Q(processed_at__isnull=True, dead_lettered_at__isnull=True))
+        ]
+        verbose_name = "Outbox Event"
+        verbose_name_plural = "Outbox Events"
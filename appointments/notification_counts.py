@@ -0,0 +1,102 @@
+"""
+Denormalized unread-notification counter kept on UserProfile, so badges
+never COUNT the notifications table. Every change is an atomic F()
+update and the new value is pushed to the user's notification socket.
+"""
+import logging
+from collections import Counter
+
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from notifications.models import Notification
+
+from .events import dispatch
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+def increment(user_ids):
+    """
+    Add one unread notification per occurrence of a user id
+    """
+    for amount, ids in _group_by_amount(Counter(user_ids)).items():
+        UserProfile.objects.filter(user_id__in=ids).update(
+            unread_notifications=F('unread_notifications') + amount
+        )
+    push(set(user_ids))
+
+
+def decrement(user_id, amount=1):
+    if amount:
+        UserProfile.objects.filter(user_id=user_id).update(
+            unread_notifications=Greatest(F('unread_notifications') - amount, Value(0))
+        )
+        push([user_id])
+
+
+def mark_read(user, notification_id):
+    """
+    Mark one of the user's notifications read. Returns False if it does
+    not exist; only an actual unread -> read change touches the counter.
+    """
+    try:
+        notification_id = int(notification_id)
+    except (TypeError, ValueError):
+        return False
+    updated = Notification.objects.filter(
+        id=notification_id, recipient=user, unread=True
+    ).update(unread=False)
+    if updated:
+        decrement(user.id, updated)
+        return True
+    return user.notifications.filter(id=notification_id).exists()
+
+
+def mark_all_read(user):
+    """
+    Mark every unread notification of the user read with a single UPDATE
+    """
+    updated = Notification.objects.filter(recipient=user, unread=True).update(unread=False)
+    decrement(user.id, updated)
+    return updated
+
+
+def get_unread_count(user):
+    try:
+        return user.profile.unread_notifications
+    except UserProfile.DoesNotExist:
+        return user.notifications.unread().count()
+
+
+def recount(user_ids=None):
+    """
+    Rebuild counters from the notifications table (repairs drift)
+    """
+    profiles = UserProfile.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+    counts = dict(
+        Notification.objects.filter(unread=True, recipient__profile__in=profiles)
+        .order_by().values_list('recipient_id').annotate(count=Count('id'))
+    )
+    profiles = list(profiles.only('id', 'user_id', 'unread_notifications'))
+    for profile in profiles:
+        profile.unread_notifications = counts.get(profile.user_id, 0)
+    UserProfile.objects.bulk_update(profiles, ['unread_notifications'], batch_size=500)
+    return len(profiles)
+
+
+def push(user_ids):
+    """
+    Send the new counts over the notification sockets once committed
+    """
+    if user_ids:
+        dispatch('notification_count', {'user_ids': sorted(user_ids)})
+
+
+def _group_by_amount(counts):
+    grouped = {}
+    for user_id, amount in counts.items():
+        grouped.setdefault(amount, []).append(user_id)
+    return grouped
@@ -0,0 +1,122 @@
+"""
+Transactional outbox for domain events. With EVENT_DELIVERY = 'outbox',
+dispatch() writes an OutboxEvent row inside the caller's transaction, so
+an event exists exactly when the change it describes was committed. The
+relay drains unprocessed rows in id order, one batch per transaction: the
+handlers' database work (notifications, audit rows, queued mail) commits
+together with the processed mark, and the resulting WebSocket messages
+are published once that commit has succeeded. An event whose handler
+fails stays unprocessed with its attempt count and last error, is retried
+by later relay runs and is dead-lettered after OUTBOX_MAX_ATTEMPTS.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+RELAY_SCHEDULED_KEY = 'outbox:relay_scheduled'
+
+
+def record(event_type, payload, key):
+    """Write the event in the current transaction; a repeated key is ignored"""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_type=event_type, payload=payload, idempotency_key=key)],
+        ignore_conflicts=True
+    )
+    transaction.on_commit(schedule_relay)
+
+
+def schedule_relay():
+    """
+    Start a relay run unless one is already scheduled or running; that run
+    releases the key and looks again before it finishes, so nothing
+    committed meanwhile is left for the periodic sweep
+    """
+    from .tasks import relay_outbox
+
+    if cache.add(RELAY_SCHEDULED_KEY, True, timeout=settings.OUTBOX_RELAY_DEBOUNCE):
+        try:
+            relay_outbox.delay()
+        except Exception as e:
+            # The periodic relay picks the events up
+            logger.error(f"Scheduling the outbox relay failed: {e}")
+
+
+def pending():
+    return OutboxEvent.objects.filter(processed_at__isnull=True, dead_lettered_at__isnull=True)
+
+
+def relay_batch(batch_size, after=0):
+    """
+    Deliver the oldest unprocessed events with ids above `after`.
+    Returns (claimed, last_id).
+    """
+    from .events import handle, publish
+
+    with transaction.atomic():
+        # Blocking lock (no SKIP LOCKED): concurrent relays queue up behind
+        # each other instead of delivering later events first
+        rows = list(pending().filter(id__gt=after).order_by('id').select_for_update()[:batch_size])
+        if not rows:
+            return 0, after
+        failed = []
+        messages = handle([
+            {'id': row.id, 'type': row.event_type, 'payload': row.payload, 'key': row.idempotency_key}
+            for row in rows
+        ], failed)
+        errors = {event['id']: error for event, error in failed}
+        now = timezone.now()
+        OutboxEvent.objects.filter(id__in=[row.id for row in rows if row.id not in errors]).update(processed_at=now)
+        for row in rows:
+            if row.id in errors:
+                row.attempts += 1
+                row.last_error = errors[row.id]
+                if row.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    row.dead_lettered_at = now
+                    logger.error(f"Outbox event {row} dead-lettered after {row.attempts} attempts: {row.last_error}")
+        if errors:
+            OutboxEvent.objects.bulk_update(
+                [row for row in rows if row.id in errors], ['attempts', 'last_error', 'dead_lettered_at']
+            )
+    publish(messages)
+    return len(rows), rows[-1].id
+
+
+def relay(batch_size=None, max_batches=None):
+    """
+    Drain the outbox batch by batch. Returns (processed, done); done is
+    False when max_batches ran out with events still waiting. Each run
+    tries an event once; failed events wait for a later run.
+    """
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    max_batches = max_batches or settings.OUTBOX_RELAY_MAX_BATCHES
+    processed = 0
+    last_id = 0
+    for _ in range(max_batches):
+        count, last_id = relay_batch(batch_size, last_id)
+        processed += count
+        if count < batch_size:
+            # Events committed while this run held the schedule key did not
+            # start a run of their own: release the key, then look once more
+            cache.delete(RELAY_SCHEDULED_KEY)
+            if not pending().filter(id__gt=last_id).exists():
+                return processed, True
+    return processed, False
+
+
+def purge(now=None, batch_size=None):
+    """Delete one batch of processed events older than OUTBOX_RETENTION_HOURS"""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    cutoff = now - timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+    ids = list(OutboxEvent.objects.filter(processed_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    return OutboxEvent.objects.filter(id__in=ids).delete()[0]
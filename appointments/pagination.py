@@ -0,0 +1,46 @@
+"""
+Keyset (seek) pagination over (timestamp field, id), newest first. Pages
+continue from an opaque cursor instead of an OFFSET, so every page costs
+the same no matter how far back the reader goes.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(timestamp, pk):
+    raw = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, pk), or None for a missing or malformed cursor
+    """
+    if not cursor:
+        return None
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, field, cursor=None, limit=20, max_limit=100):
+    """
+    One page of queryset ordered by (field, id) descending, starting after
+    cursor. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, max_limit))
+    queryset = queryset.order_by(f'-{field}', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk}))
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return rows[:limit], next_cursor
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+logger = logging.getLogger(__name__)
+
+# Channel group names. Consumers derive membership from the authenticated
+# user, so these are the only groups server code should publish to.
+
+def user_group(user_id):
+    return f'notifications_{user_id}'
+
+def org_group(organization_id):
+    return f'appointments_org_{organization_id}'
+
+def receptionist_group(organization_id):
+    return f'receptionists_org_{organization_id}'
+
+def chat_group(room_name):
+    return f'chat_{room_name}'
+
+def queue_group(user_id):
+    return f'queue_{user_id}'
+
+
+async def publish(group, message):
+    """
+    Push a message to a channel group from async code (consumers, async views)
+    """
+    await get_channel_layer().group_send(group, message)
+
+
+async def publish_many(messages):
+    """
+    Push several (group, message) pairs concurrently
+    """
+    if not messages:
+        return
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*(
+        channel_layer.group_send(group, message) for group, message in messages
+    ))
+
+
+def publish_many_sync(messages):
+    """
+    Entry point for sync callers (views, Celery tasks): one event loop hop
+    for the whole batch
+    """
+    if messages:
+        async_to_sync(publish_many)(messages)
+
+
+class TokenBucket:
+    """
+    Per-connection rate limiter: `rate` tokens per second, up to `burst` saved
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """Seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
@@ -0,0 +1,125 @@
+"""
+Appointment reminder scheduler. Every tick claims the confirmed
+appointments whose reminder window has opened with SELECT ... FOR UPDATE
+SKIP LOCKED, so concurrent workers never pick the same rows, stamps them
+reminder_sent_at and sends the batch over the pooled mail connection. Mail
+goes out one message at a time: a message that fails is released with
+its attempt counted, up to APPOINTMENT_REMINDER_MAX_ATTEMPTS, while the
+rest of the batch carries on. If the server cannot be reached at all, the
+reminders not yet sent are released without counting an attempt.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import emails
+from .models import Appointment
+
+logger = logging.getLogger(__name__)
+
+
+def due(now):
+    return Appointment.objects.filter(
+        status='confirmed',
+        reminder_sent_at__isnull=True,
+        reminder_attempts__lt=settings.APPOINTMENT_REMINDER_MAX_ATTEMPTS,
+        appointment_date__gt=now,
+        appointment_date__lte=now + timedelta(hours=settings.APPOINTMENT_REMINDER_LEAD_HOURS)
+    )
+
+
+def claim(now, batch_size):
+    """Claim up to batch_size due appointments; returns their ids"""
+    with transaction.atomic():
+        ids = list(
+            due(now).order_by('appointment_date')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            Appointment.objects.filter(id__in=ids).update(reminder_sent_at=now)
+    return ids
+
+
+def build_message(appointment):
+    return emails.appointment_message(appointment, 'reminder')
+
+
+def send_batch(ids):
+    """
+    Email and notify the patients of the claimed appointments.
+    Returns (sent, failed_ids, unsent_ids): failed rows could not be
+    mailed; unsent rows were not tried because the server is unreachable.
+    """
+    appointments = list(
+        Appointment.objects.filter(id__in=ids).select_related('patient', 'doctor').order_by('appointment_date')
+    )
+    sent, failed = [], []
+    for index, a in enumerate(appointments):
+        if a.patient.email:
+            try:
+                emails.send([build_message(a)])
+            except emails.UNAVAILABLE_ERRORS as e:
+                logger.error(f"Mail server unavailable while sending reminders: {e}")
+                return notify(sent), failed, [a.id for a in appointments[index:]]
+            except Exception as e:
+                logger.error(f"Sending the reminder for appointment {a.id} failed: {e}")
+                failed.append(a.id)
+                continue
+        sent.append(a)
+    return notify(sent), failed, []
+
+
+def notify(appointments):
+    from .utils import send_notifications
+
+    if not appointments:
+        return 0
+    try:
+        send_notifications([
+            {
+                'user_id': a.patient_id,
+                'notification_type': 'appointment_reminder',
+                'title': 'Appointment Reminder',
+                'message': f"Your appointment with Dr. {a.doctor.get_full_name()} is on "
+                           f"{a.appointment_date.strftime('%B %d, %Y at %I:%M %p')}",
+                'data': {'appointment_id': a.id},
+            }
+            for a in appointments
+        ])
+    except Exception as e:
+        # The mail already went out; never release these for a second send
+        logger.error(f"Notifying {len(appointments)} appointment reminders failed: {e}")
+    return len(appointments)
+
+
+def dispatch_due(now=None, batch_size=None, max_batches=None):
+    """
+    Claim and send due reminders batch by batch. Returns (sent, done);
+    done is False when max_batches ran out with reminders still due.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.APPOINTMENT_REMINDER_BATCH_SIZE
+    max_batches = max_batches or settings.APPOINTMENT_REMINDER_MAX_BATCHES
+    sent = 0
+    for _ in range(max_batches):
+        ids = claim(now, batch_size)
+        if not ids:
+            return sent, True
+        count, failed, unsent = send_batch(ids)
+        sent += count
+        if failed:
+            Appointment.objects.filter(id__in=failed, reminder_sent_at=now).update(
+                reminder_sent_at=None, reminder_attempts=F('reminder_attempts') + 1
+            )
+        if unsent:
+            # The server is down: release what was not tried and wait for the next tick
+            Appointment.objects.filter(id__in=unsent, reminder_sent_at=now).update(reminder_sent_at=None)
+            return sent, True
+        if len(ids) < batch_size:
+            return sent, True
+    return sent, False
@@ -0,0 +1,72 @@
+"""
+Retention engine for notifications. Old rows are removed in small
+id-bounded batches per policy, so cleanup never runs one long DELETE that
+locks and bloats the table.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from notifications.models import Notification
+
+from . import notification_counts
+
+logger = logging.getLogger(__name__)
+
+
+def get_policies():
+    """
+    NOTIFICATION_RETENTION maps a notification type (verb) to the number of
+    days read and unread notifications are kept; 'default' covers the rest
+    """
+    policies = dict(settings.NOTIFICATION_RETENTION)
+    default = policies.pop('default')
+    return default, policies
+
+
+def expired_querysets(now=None):
+    """
+    Yield (label, queryset, unread) for every policy
+    """
+    now = now or timezone.now()
+    default, policies = get_policies()
+    for verb, policy in list(policies.items()) + [(None, default)]:
+        for unread in (False, True):
+            days = policy.get('unread' if unread else 'read')
+            if days is None:
+                continue
+            notifications = Notification.objects.filter(
+                unread=unread, timestamp__lt=now - timedelta(days=days)
+            )
+            if verb is None:
+                notifications = notifications.exclude(verb__in=list(policies))
+            else:
+                notifications = notifications.filter(verb=verb)
+            yield verb or 'default', notifications, unread
+
+
+def purge_notifications(now=None, batch_size=None, max_batches=None):
+    """
+    Delete expired notifications batch by batch. Returns (deleted, done);
+    done is False when max_batches ran out before everything expired was gone.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_CLEANUP_BATCH_SIZE
+    max_batches = max_batches or settings.NOTIFICATION_CLEANUP_MAX_BATCHES
+    deleted = 0
+    batches = 0
+    for label, notifications, unread in expired_querysets(now):
+        while True:
+            if batches >= max_batches:
+                return deleted, False
+            batch = list(notifications.order_by('id').values_list('id', 'recipient_id')[:batch_size])
+            if not batch:
+                break
+            count = Notification.objects.filter(id__in=[row[0] for row in batch]).delete()[0]
+            if unread:
+                # Dropped unread notifications no longer count towards badges
+                notification_counts.recount({row[1] for row in batch})
+            deleted += count
+            batches += 1
+            logger.info(f"Retention deleted {count} {'unread' if unread else 'read'} '{label}' notifications")
+    return deleted, True
@@ -5,4 +5,5 @@ websocket_urlpatterns = [
     re_path(r'ws/appointments/(?P<room_name>\w+)/$', consumers.AppointmentConsumer.as_asgi()),
     re_path(r'ws/notifications/(?P<user_id>\d+)/$', consumers.NotificationConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/stream/$', consumers.MultiplexConsumer.as_asgi()),
 ] 
\ No newline at end of file
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from notifications.models import Notification
+
+from . import chat_summary, notification_counts
+from .models import Organization, UserProfile, ChatRoom
+from .tiles import invalidate_tiles
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def map_data_changed(sender, instance, **kwargs):
+    """Invalidate cached map tiles when clinics or doctor profiles change"""
+    if sender is UserProfile and instance.role != 'doctor':
+        return
+    invalidate_tiles()
+
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    """Count new unread notifications (notify.send) on the recipient's profile"""
+    if created and instance.unread:
+        notification_counts.increment([instance.recipient_id])
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def chat_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep room summaries in step with room membership"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        chat_summary.sync_participants(instance)
+    elif pk_set:
+        for room in ChatRoom.objects.filter(pk__in=pk_set):
+            chat_summary.sync_participants(room)
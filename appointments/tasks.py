@@ -1,144 +1,128 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.db.models import Max
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
 import logging
 
+from . import emails, mail_outbox
 from .models import Appointment, UserProfile
-from notifications.signals import notify
 # from .utils import send_sms  # Removed Twilio
 
 logger = logging.getLogger(__name__)
 
-@shared_task
+# Retry policy for tasks that talk to the mail server: transient SMTP and
+# network failures are retried with jittered exponential backoff
+TRANSIENT_EMAIL_ERRORS = emails.TRANSIENT_ERRORS
+EMAIL_RETRY = {
+    'autoretry_for': TRANSIENT_EMAIL_ERRORS,
+    'retry_backoff': True,
+    'retry_backoff_max': 600,
+    'retry_jitter': True,
+    'retry_kwargs': {'max_retries': 5},
+}
+
+@shared_task(**EMAIL_RETRY)
 def send_appointment_reminder(appointment_id):
     """Send appointment reminder to patient"""
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
-        patient = appointment.patient
-        doctor = appointment.doctor
-        
-        # Send email reminder
-        subject = f"Appointment Reminder - {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')}"
-        message = f"""
-        Dear {patient.get_full_name()},
-        
-        This is a reminder for your appointment with Dr. {doctor.get_full_name()} 
-        on {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')}.
-        
-        Please arrive 10 minutes before your scheduled time.
-        
-        If you need to reschedule or cancel, please contact the clinic.
-        
-        Best regards,
-        PulseCal Team
-        """
-        
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[patient.email],
-            fail_silently=False,
-        )
+        from .reminders import build_message
+        appointment = Appointment.objects.select_related('patient', 'doctor').get(id=appointment_id)
+        mail_outbox.enqueue([build_message(appointment)])
+        # Keep the scheduler from reminding the patient a second time
+        Appointment.objects.filter(id=appointment_id).update(reminder_sent_at=timezone.now())
         
         # SMS logic removed. Use notifications for all alerts.
-        logger.info(f"Appointment reminder sent for appointment {appointment_id}")
+        logger.info(f"Appointment reminder queued for appointment {appointment_id}")
+    except TRANSIENT_EMAIL_ERRORS:
+        raise  # retried with backoff
     except Exception as e:
         logger.error(f"Failed to send appointment reminder: {e}")
 
 @shared_task
+def dispatch_appointment_reminders():
+    """Claim and send every reminder whose window has opened (run by beat each minute)"""
+    try:
+        from .reminders import dispatch_due
+        sent, done = dispatch_due()
+        logger.info(f"Sent {sent} appointment reminders")
+        if not done:
+            dispatch_appointment_reminders.delay()
+        
+    except Exception as e:
+        logger.error(f"Error dispatching appointment reminders: {str(e)}")
+
+@shared_task
+def dispatch_medication_reminders():
+    """Fire every medication reminder that has come due (run by beat each minute)"""
+    try:
+        from .medication_reminders import dispatch_due
+        sent, done = dispatch_due()
+        logger.info(f"Sent {sent} medication reminders")
+        if not done:
+            dispatch_medication_reminders.delay()
+        
+    except Exception as e:
+        logger.error(f"Error dispatching medication reminders: {str(e)}")
+
+@shared_task(**EMAIL_RETRY)
 def send_appointment_confirmation(appointment_id):
     """Send appointment confirmation to patient"""
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
-        patient = appointment.patient
-        doctor = appointment.doctor
-        
-        subject = f"Appointment Confirmed - {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')}"
-        message = f"""
-        Dear {patient.get_full_name()},
-        
-        Your appointment with Dr. {doctor.get_full_name()} has been confirmed for 
-        {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')}.
-        
-        Appointment Details:
-        - Date: {appointment.appointment_date.strftime('%B %d, %Y')}
-        - Time: {appointment.appointment_date.strftime('%I:%M %p')}
-        - Doctor: Dr. {doctor.get_full_name()}
-        - Fee: ${appointment.fee}
-        
-        Please arrive 10 minutes before your scheduled time.
-        
-        Best regards,
-        PulseCal Team
-        """
-        
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[patient.email],
-            fail_silently=False,
-        )
+        appointment = Appointment.objects.select_related('patient', 'doctor').get(id=appointment_id)
+        
+        mail_outbox.enqueue([emails.appointment_message(appointment, 'confirmation')])
         
-        logger.info(f"Appointment confirmation sent for appointment {appointment_id}")
+        logger.info(f"Appointment confirmation queued for appointment {appointment_id}")
         
     except Appointment.DoesNotExist:
         logger.error(f"Appointment {appointment_id} not found")
+    except TRANSIENT_EMAIL_ERRORS:
+        raise  # retried with backoff
     except Exception as e:
         logger.error(f"Error sending appointment confirmation: {str(e)}")
 
-@shared_task
+@shared_task(**EMAIL_RETRY)
 def send_appointment_cancellation(appointment_id):
     """Send appointment cancellation notification"""
     try:
-        appointment = Appointment.objects.get(id=appointment_id)
-        patient = appointment.patient
-        doctor = appointment.doctor
-        
-        subject = f"Appointment Cancelled - {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')}"
-        message = f"""
-        Dear {patient.get_full_name()},
-        
-        Your appointment with Dr. {doctor.get_full_name()} scheduled for 
-        {appointment.appointment_date.strftime('%B %d, %Y at %I:%M %p')} has been cancelled.
+        appointment = Appointment.objects.select_related('patient', 'doctor').get(id=appointment_id)
         
-        If you have any questions, please contact the clinic.
-        
-        Best regards,
-        PulseCal Team
-        """
-        
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[patient.email],
-            fail_silently=False,
-        )
+        mail_outbox.enqueue([emails.appointment_message(appointment, 'cancellation')])
         
-        logger.info(f"Appointment cancellation sent for appointment {appointment_id}")
+        logger.info(f"Appointment cancellation queued for appointment {appointment_id}")
         
     except Appointment.DoesNotExist:
         logger.error(f"Appointment {appointment_id} not found")
+    except TRANSIENT_EMAIL_ERRORS:
+        raise  # retried with backoff
     except Exception as e:
         logger.error(f"Error sending appointment cancellation: {str(e)}")
 
+@shared_task(**EMAIL_RETRY)
+def flush_email_outbox():
+    """Send pending outbox mail in batches over the pooled connection"""
+    try:
+        sent, done = mail_outbox.flush()
+        logger.info(f"Sent {sent} outbound emails")
+        if not done:
+            flush_email_outbox.delay()
+        
+    except TRANSIENT_EMAIL_ERRORS:
+        raise  # retried with backoff
+    except Exception as e:
+        logger.error(f"Error flushing email outbox: {str(e)}")
+
 @shared_task
 def cleanup_old_notifications():
-    """Clean up notifications older than 30 days"""
+    """Delete notifications past their retention policy in bounded batches"""
     try:
-        from notifications.models import Notification
-        cutoff_date = timezone.now() - timedelta(days=30)
-        deleted_count = Notification.objects.filter(
-            timestamp__lt=cutoff_date,
-            unread=False
-        ).delete()[0]
-        
+        from .retention import purge_notifications
+        deleted_count, done = purge_notifications()
         logger.info(f"Cleaned up {deleted_count} old notifications")
+        if not done:
+            # Leave the table alone for a moment, then take the next slice
+            cleanup_old_notifications.apply_async(countdown=settings.NOTIFICATION_CLEANUP_PAUSE)
         
     except Exception as e:
         logger.error(f"Error cleaning up old notifications: {str(e)}")
@@ -147,83 +131,85 @@ def cleanup_old_notifications():
 def send_daily_appointment_summary():
     """Send daily appointment summary to doctors"""
     try:
-        today = timezone.now().date()
-        tomorrow = today + timedelta(days=1)
+        from .daily_summary import doctors_with_appointments, send_summaries
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        doctor_ids = doctors_with_appointments(tomorrow)
+        chunk_size = settings.DAILY_SUMMARY_CHUNK_SIZE
         
-        # Get all doctors
-        doctors = UserProfile.objects.filter(role='doctor')
+        if len(doctor_ids) <= chunk_size:
+            sent = send_summaries(tomorrow, doctor_ids)
+            logger.info(f"Daily appointment summaries sent to {sent} doctors")
+            return
         
-        for doctor_profile in doctors:
-            doctor = doctor_profile.user
-            appointments = Appointment.objects.filter(
-                doctor=doctor,
-                appointment_date__date=tomorrow,
-                status='confirmed'
-            ).order_by('appointment_date')
-            
-            if appointments.exists():
-                subject = f"Tomorrow's Appointments - {tomorrow.strftime('%B %d, %Y')}"
-                message = f"""
-                Dear Dr. {doctor.get_full_name()},
-                
-                Here are your appointments for tomorrow ({tomorrow.strftime('%B %d, %Y')}):
-                
-                """
-                
-                for appointment in appointments:
-                    message += f"""
-                - {appointment.appointment_date.strftime('%I:%M %p')} - {appointment.patient.get_full_name()}
-                  Type: {appointment.get_appointment_type_display()}
-                  Fee: ${appointment.fee}
-                """
-                
-                message += """
-                
-                Best regards,
-                PulseCal Team
-                """
-                
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[doctor.email],
-                    fail_silently=False,
-                )
-        
-        logger.info("Daily appointment summaries sent to doctors")
+        # Large tenants: each chunk is a subtask with its own query and connection
+        for i in range(0, len(doctor_ids), chunk_size):
+            send_daily_appointment_summary_chunk.delay(tomorrow.isoformat(), doctor_ids[i:i + chunk_size])
+        logger.info(f"Daily appointment summaries queued for {len(doctor_ids)} doctors")
         
     except Exception as e:
         logger.error(f"Error sending daily appointment summaries: {str(e)}")
 
+@shared_task(**EMAIL_RETRY)
+def send_daily_appointment_summary_chunk(day, doctor_ids):
+    """Send the daily summary to one chunk of doctors"""
+    try:
+        from .daily_summary import send_summaries
+        sent = send_summaries(date.fromisoformat(day), doctor_ids)
+        logger.info(f"Daily appointment summaries sent to {sent} doctors")
+        
+    except TRANSIENT_EMAIL_ERRORS:
+        raise  # retried with backoff
+    except Exception as e:
+        logger.error(f"Error sending daily appointment summaries: {str(e)}")
+
 @shared_task
 def update_doctor_availability():
     """Update doctor availability status based on current time"""
     try:
         now = timezone.now()
         
-        # Get doctors who are on duty
-        on_duty_doctors = UserProfile.objects.filter(role='doctor', on_duty=True)
-        
-        for doctor_profile in on_duty_doctors:
-            # Check if doctor has appointments within the next 2 hours
-            upcoming_appointments = Appointment.objects.filter(
-                doctor=doctor_profile.user,
+        # Last confirmed appointment within the next 2 hours, per on-duty doctor
+        last_appointments = dict(
+            Appointment.objects.filter(
+                doctor__profile__role='doctor',
+                doctor__profile__on_duty=True,
                 appointment_date__gte=now,
                 appointment_date__lte=now + timedelta(hours=2),
                 status='confirmed'
-            )
-            
-            # Update next available time
-            if upcoming_appointments.exists():
-                last_appointment = upcoming_appointments.order_by('-appointment_date').first()
-                doctor_profile.next_available = last_appointment.appointment_date + timedelta(minutes=30)
-            else:
-                doctor_profile.next_available = now
-            
-            doctor_profile.save()
-        
-        logger.info("Doctor availability updated")
+            ).order_by().values('doctor_id').annotate(last=Max('appointment_date')).values_list('doctor_id', 'last')
+        )
+        
+        on_duty_doctors = list(
+            UserProfile.objects.filter(role='doctor', on_duty=True).only('id', 'user_id', 'next_available')
+        )
+        for doctor_profile in on_duty_doctors:
+            last = last_appointments.get(doctor_profile.user_id)
+            doctor_profile.next_available = last + timedelta(minutes=30) if last else now
+        UserProfile.objects.bulk_update(on_duty_doctors, ['next_available'], batch_size=500)
+        
+        logger.info(f"Availability updated for {len(on_duty_doctors)} doctors")
+        
+    except Exception as e:
+        logger.error(f"Error updating doctor availability: {str(e)}") 
+
+@shared_task
+def relay_outbox():
+    """Deliver committed outbox events in order, then drop old processed rows"""
+    try:
+        from . import outbox
+        processed, done = outbox.relay()
+        logger.info(f"Relayed {processed} outbox events")
+        if not done:
+            relay_outbox.delay()
+        else:
+            outbox.purge()
         
     except Exception as e:
-        logger.error(f"Error updating doctor availability: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Error relaying outbox events: {str(e)}")
+
+@shared_task
+def deliver_events_task(events):
+    """Deliver a batch of committed domain events collected during a request"""
+    from .events import deliver
+    deliver(events)
+    logger.info(f"Delivered {len(events)} domain events")
@@ -0,0 +1,140 @@
+import pytest
+from datetime import timedelta
+from unittest import mock
+from django.http import QueryDict
+from django.utils import timezone
+from django.db import transaction
+from django.urls import reverse
+
+from . import audit, audit_browser
+from .factories import AppointmentFactory, UserProfileFactory
+from .models import AuditLog
+from .utils import log_audit_event
+
+
+@pytest.mark.django_db
+class TestBufferedAuditLog:
+    """Test buffered, bulk-written audit logging"""
+
+    def test_log_audit_event_stores_structured_fields(self, django_capture_on_commit_callbacks):
+        user = UserProfileFactory().user
+        with django_capture_on_commit_callbacks(execute=True):
+            log_audit_event(
+                user=user, action='data_exported', details='Export', object_type='appointment',
+                object_id=7, ip_address='10.0.0.1', user_agent='pytest'
+            )
+        entry = AuditLog.objects.get()
+        assert (entry.user, entry.object_type, entry.object_id) == (user, 'appointment', 7)
+        assert (entry.ip_address, entry.user_agent) == ('10.0.0.1', 'pytest')
+
+    def test_rows_wait_for_commit_and_are_dropped_on_rollback(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            audit.record('system_action', details='kept')
+            try:
+                with transaction.atomic():
+                    audit.record('system_action', details='rolled back')
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+            assert not AuditLog.objects.exists()
+        assert list(AuditLog.objects.values_list('details', flat=True)) == ['kept']
+
+    def test_a_scope_is_written_with_one_insert(self, django_capture_on_commit_callbacks, django_assert_num_queries):
+        tokens = audit.start_collecting()
+        with django_capture_on_commit_callbacks(execute=True):
+            for i in range(5):
+                audit.record('system_action', details=str(i), object_type='appointment', object_id=i)
+        entries = audit.stop_collecting(tokens)
+        assert not AuditLog.objects.exists()
+        with django_assert_num_queries(1):
+            audit.flush(entries)
+        assert AuditLog.objects.count() == 5
+
+    def test_middleware_fills_in_the_client(self, rf, django_capture_on_commit_callbacks):
+        request = rf.get('/', HTTP_X_FORWARDED_FOR='203.0.113.5, 10.0.0.1', HTTP_USER_AGENT='browser')
+
+        def view(request):
+            with django_capture_on_commit_callbacks(execute=True):
+                audit.record('user_login')
+            assert not AuditLog.objects.exists()
+            return mock.sentinel.response
+
+        assert audit.AuditLogMiddleware(view)(request) is mock.sentinel.response
+        entry = AuditLog.objects.get()
+        assert (entry.ip_address, entry.user_agent) == ('203.0.113.5', 'browser')
+
+    def test_status_update_is_audited(self, client, django_capture_on_commit_callbacks):
+        appointment = AppointmentFactory(status='pending')
+        UserProfileFactory(user=appointment.doctor, role='doctor')
+        client.force_login(appointment.doctor)
+        with mock.patch('appointments.events.publish_many_sync'):
+            with django_capture_on_commit_callbacks(execute=True):
+                response = client.post(
+                    reverse('appointments:update_status', args=[appointment.id]), {'status': 'confirmed'},
+                    HTTP_USER_AGENT='browser'
+                )
+        assert response.status_code == 200
+        entry = AuditLog.objects.get(action='appointment_updated')
+        assert (entry.user, entry.object_id) == (appointment.doctor, appointment.id)
+        assert (entry.ip_address, entry.user_agent) == ('127.0.0.1', 'browser')
+
+
+@pytest.mark.django_db
+class TestAuditBrowser:
+    """Test filtered, keyset-paginated audit browsing"""
+
+    def setup_method(self):
+        self.user = UserProfileFactory().user
+        self.other = UserProfileFactory().user
+        now = timezone.now()
+        self.entries = []
+        for i in range(6):
+            entry = AuditLog.objects.create(
+                user=self.user if i % 2 else self.other, action='appointment_updated',
+                object_type='appointment', object_id=1 if i < 4 else 2, details=str(i)
+            )
+            AuditLog.objects.filter(id=entry.id).update(timestamp=now - timedelta(days=5 - i))
+            self.entries.append(entry)
+
+    def test_object_history_pages_newest_first(self):
+        filters = audit_browser.parse_filters(QueryDict('object_type=appointment&object_id=1'))
+        first, cursor = audit_browser.get_page(filters, limit=3)
+        second, last_cursor = audit_browser.get_page(filters, cursor, limit=3)
+        assert [e.details for e in first] == ['3', '2', '1']
+        assert [e.details for e in second] == ['0']
+        assert last_cursor is None
+
+    def test_user_and_date_filters(self):
+        since = (timezone.now() - timedelta(days=3)).date().isoformat()
+        filters = audit_browser.parse_filters(QueryDict(f'user={self.user.id}&since={since}&object_id=bad'))
+        assert 'object_id' not in filters
+        entries, _ = audit_browser.get_page(filters)
+        assert [e.details for e in entries] == ['5', '3']
+
+    def test_api_is_staff_only_and_paginates(self, client):
+        url = reverse('appointments:api_audit_logs')
+        client.force_login(self.user)
+        assert client.get(url).status_code == 302
+
+        staff = UserProfileFactory(user__is_staff=True).user
+        client.force_login(staff)
+        data = client.get(url, {'action': 'appointment_updated', 'limit': 4}).json()
+        assert [entry['details'] for entry in data['results']] == ['5', '4', '3', '2']
+        data = client.get(url, {'action': 'appointment_updated', 'cursor': data['next_cursor']}).json()
+        assert [entry['details'] for entry in data['results']] == ['1', '0']
+        assert data['next_cursor'] is None
+
+    def test_browser_page_links_the_next_page_with_filters(self, client):
+        staff = UserProfileFactory(user__is_staff=True).user
+        client.force_login(staff)
+        with mock.patch.object(audit_browser, 'MAX_PAGE_SIZE', 2):
+            response = client.get(reverse('appointments:audit_logs'), {'object_type': 'appointment'})
+        assert response.status_code == 200
+        assert [e.details for e in response.context['logs']] == ['5', '4']
+        assert 'object_type=appointment&amp;cursor=' in response.content.decode()
+
+    def test_unfiltered_browse_reads_the_timestamp_index_in_order(self):
+        queryset = AuditLog.objects.order_by('-timestamp', '-id')[:audit_browser.PAGE_SIZE]
+        plan = queryset.explain()
+        assert 'TEMP B-TREE' not in plan.upper()
+        assert 'INDEX' in plan.upper()
@@ -1,13 +1,19 @@
 import asyncio
 import json
+import msgpack
+import pytest
+from asgiref.sync import async_to_sync
 from channels.testing import WebsocketCommunicator
 from channels.layers import get_channel_layer
 from channels.routing import URLRouter
 from channels.db import database_sync_to_async
 from channels.testing import ChannelsLiveServerTestCase
 from django.urls import path
-from appointments.consumers import AppointmentConsumer
-from appointments.models import Appointment, UserProfile, Organization
+from appointments.consumers import AppointmentConsumer, NotificationConsumer, ChatConsumer, MultiplexConsumer
+from appointments.utils import broadcast_appointment_ws_update, send_appointment_update
+from appointments.realtime import publish, org_group, queue_group, user_group
+from appointments.models import Appointment, UserProfile, Organization, ChatRoom
+from django.contrib.auth.models import AnonymousUser
 from appointments.factories import UserFactory, UserProfileFactory, OrganizationFactory
 from django.utils import timezone
 from datetime import timedelta
@@ -97,4 +103,271 @@ class TestAppointmentWebSocket(ChannelsLiveServerTestCase):
 
         # Clean up
         await communicator_doctor.disconnect()
-        await communicator_receptionist.disconnect() 
\ No newline at end of file
+        await communicator_receptionist.disconnect() 
+
+@pytest.mark.django_db(transaction=True)
+def test_broadcast_reaches_receptionists_through_org_group():
+    org = OrganizationFactory()
+    doctor = UserProfileFactory(role='doctor', organization=org).user
+    patient = UserProfileFactory(role='patient', organization=org).user
+    receptionists = [UserProfileFactory(role='receptionist', organization=org).user for _ in range(2)]
+    appointment = Appointment.objects.create(
+        patient=patient,
+        doctor=doctor,
+        organization=org,
+        appointment_date=timezone.now() + timedelta(days=1),
+    )
+
+    async def run():
+        communicators = []
+        for user in receptionists:
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/{user.id}/')
+            communicator.scope['user'] = user
+            communicator.scope['url_route'] = {'kwargs': {'user_id': str(user.id)}}
+            connected, _ = await communicator.connect()
+            assert connected
+            communicators.append(communicator)
+
+        await database_sync_to_async(broadcast_appointment_ws_update)(appointment, event_type='booked')
+
+        for communicator in communicators:
+            response = await communicator.receive_json_from(timeout=5)
+            assert response['data'] == {'appointment_id': appointment.id, 'event_type': 'booked'}
+            assert response['message'] == 'Appointment booked in your organization.'
+            await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+def connect_as(consumer, path, user, subprotocols=None, **kwargs):
+    communicator = WebsocketCommunicator(consumer.as_asgi(), path, subprotocols=subprotocols)
+    communicator.scope['user'] = user
+    communicator.scope['url_route'] = {'kwargs': kwargs}
+    return communicator
+
+
+@pytest.mark.django_db(transaction=True)
+def test_consumers_derive_groups_from_authenticated_user():
+    org = OrganizationFactory()
+    user = UserProfileFactory(role='doctor', organization=org).user
+    other = UserProfileFactory(role='patient').user
+    room = ChatRoom.objects.create(name='room_test')
+    room.participants.set([user])
+
+    async def run():
+        # Anonymous sockets are rejected
+        communicator = connect_as(NotificationConsumer, '/ws/notifications/1/', AnonymousUser(), user_id='1')
+        connected, _ = await communicator.connect()
+        assert not connected
+
+        # Another user's notification stream is rejected
+        communicator = connect_as(NotificationConsumer, f'/ws/notifications/{other.id}/', user, user_id=str(other.id))
+        connected, _ = await communicator.connect()
+        assert not connected
+
+        # Another organization's appointment stream is rejected
+        communicator = connect_as(AppointmentConsumer, '/ws/appointments/org_999999/', user, room_name='org_999999')
+        connected, _ = await communicator.connect()
+        assert not connected
+
+        # Only participants may join a chat room
+        communicator = connect_as(ChatConsumer, '/ws/chat/room_test/', other, room_name='room_test')
+        connected, _ = await communicator.connect()
+        assert not connected
+
+        # Chat sender identity comes from the session, not the payload
+        communicator = connect_as(ChatConsumer, '/ws/chat/room_test/', user, room_name='room_test')
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.send_json_to({'message': 'hello', 'user_id': other.id, 'username': 'spoofed'})
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['user_id'] == user.id
+        assert response['username'] != 'spoofed'
+        await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_multiplexed_socket_routes_streams():
+    org = OrganizationFactory()
+    user = UserProfileFactory(role='doctor', organization=org).user
+    room = ChatRoom.objects.create(name='room_mux')
+    room.participants.set([user])
+
+    async def run():
+        communicator = connect_as(MultiplexConsumer, '/ws/stream/', user)
+        connected, _ = await communicator.connect()
+        assert connected
+
+        for frame in ({'stream': 'appointments', 'room': f'org_{org.id}'},
+                      {'stream': 'queue'},
+                      {'stream': 'chat', 'room': 'room_mux'}):
+            await communicator.send_json_to({'action': 'subscribe', **frame})
+            response = await communicator.receive_json_from(timeout=5)
+            assert response['stream'] == frame['stream']
+            assert response['payload']['type'] == 'subscribed'
+            assert response['payload']['room'] == frame.get('room')
+
+        # Streams the user may not see are refused without closing the socket
+        await communicator.send_json_to({'action': 'subscribe', 'stream': 'chat', 'room': 'not_mine'})
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['payload']['error'] == 'forbidden'
+
+        await publish(queue_group(user.id), {
+            'type': 'queue_update', 'appointment_id': 1, 'status': 'confirmed',
+            'patient_status': 'waiting', 'timestamp': timezone.now().isoformat(),
+        })
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['stream'] == 'queue'
+        assert response['payload']['appointment_id'] == 1
+
+        await communicator.send_json_to({'stream': 'chat', 'room': 'room_mux', 'message': 'hi'})
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['stream'] == 'chat'
+        assert response['payload']['room'] == 'room_mux'
+        assert response['payload']['user_id'] == user.id
+
+        # Unsubscribed streams stop delivering
+        await communicator.send_json_to({'action': 'unsubscribe', 'stream': 'appointments'})
+        await communicator.receive_json_from(timeout=5)
+        await publish(org_group(org.id), {
+            'type': 'doctor_status_update', 'doctor_id': user.id, 'on_duty': True,
+            'timestamp': timezone.now().isoformat(),
+        })
+        assert await communicator.receive_nothing(timeout=0.2)
+        await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_org_updates_are_coalesced_and_client_frames_rate_limited(settings):
+    settings.WEBSOCKET_RECEIVE_BURST = 2
+    settings.WEBSOCKET_RECEIVE_RATE = 0.01
+    org = OrganizationFactory()
+    user = UserProfileFactory(role='receptionist', organization=org).user
+
+    def update(appointment_id, status):
+        return {
+            'type': 'appointment_update', 'appointment_id': appointment_id, 'status': status,
+            'patient_status': 'waiting', 'timestamp': timezone.now().isoformat(),
+        }
+
+    async def run():
+        communicator = connect_as(AppointmentConsumer, f'/ws/appointments/org_{org.id}/', user, room_name=f'org_{org.id}')
+        connected, _ = await communicator.connect()
+        assert connected
+
+        # A burst inside one window arrives as one frame, latest status per appointment
+        for appointment_id, status in ((1, 'scheduled'), (2, 'scheduled'), (1, 'confirmed')):
+            await publish(org_group(org.id), update(appointment_id, status))
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['type'] == 'batch'
+        assert [(u['appointment_id'], u['status']) for u in response['updates']] == [(2, 'scheduled'), (1, 'confirmed')]
+        assert await communicator.receive_nothing(timeout=0.3)
+
+        # Client frames beyond the budget are refused
+        for _ in range(3):
+            await communicator.send_json_to({'type': 'noop'})
+        response = await communicator.receive_json_from(timeout=5)
+        assert response == {'type': 'error', 'error': 'rate_limited'}
+        await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notification_traffic_shares_the_send_budget(settings):
+    settings.WEBSOCKET_MAX_PENDING = 3
+    user = UserProfileFactory(role='patient').user
+
+    def notification(text):
+        return {
+            'type': 'notification_message', 'notification_type': 'test', 'message': text,
+            'timestamp': timezone.now().isoformat(),
+        }
+
+    async def run():
+        communicator = connect_as(NotificationConsumer, f'/ws/notifications/{user.id}/', user, user_id=user.id)
+        connected, _ = await communicator.connect()
+        assert connected
+
+        # Counts collapse to the latest; distinct notifications are batched in order
+        for count in (1, 2):
+            await publish(user_group(user.id), {'type': 'notification_count', 'count': count})
+        for text in ('a', 'b'):
+            await publish(user_group(user.id), notification(text))
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['type'] == 'batch'
+        assert [(u['type'], u.get('count'), u.get('message')) for u in response['updates']] == [
+            ('notification_count', 2, None), ('notification', None, 'a'), ('notification', None, 'b')
+        ]
+
+        # A client that falls too far behind gets a resync instead of a growing buffer
+        for text in 'cdef':
+            await publish(user_group(user.id), notification(text))
+        assert await communicator.receive_json_from(timeout=5) == {'type': 'resync'}
+        assert await communicator.receive_nothing(timeout=0.3)
+        await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reconnecting_client_replays_missed_updates():
+    org = OrganizationFactory()
+    user = UserProfileFactory(role='receptionist', organization=org).user
+    send_appointment_update(org.id, 1, 'confirmed', 'waiting')
+    subscribe = {'action': 'subscribe', 'stream': 'appointments', 'room': f'org_{org.id}'}
+
+    async def run():
+        communicator = connect_as(MultiplexConsumer, '/ws/stream/', user)
+        await communicator.connect()
+        await communicator.send_json_to(subscribe)
+        response = await communicator.receive_json_from(timeout=5)
+        last_offset = response['payload']['offset']
+        assert last_offset
+        await communicator.disconnect()
+
+        # Updates sent while the client was away
+        await database_sync_to_async(send_appointment_update)(org.id, 2, 'confirmed', 'waiting')
+        await database_sync_to_async(send_appointment_update)(org.id, 3, 'cancelled', 'waiting')
+
+        communicator = connect_as(MultiplexConsumer, '/ws/stream/', user)
+        await communicator.connect()
+        await communicator.send_json_to({**subscribe, 'last_offset': last_offset})
+        await communicator.receive_json_from(timeout=5)
+        response = await communicator.receive_json_from(timeout=5)
+        assert response['payload']['type'] == 'batch'
+        assert [u['appointment_id'] for u in response['payload']['updates']] == [2, 3]
+        assert all(u['offset'] > last_offset for u in response['payload']['updates'])
+        await communicator.disconnect()
+
+    async_to_sync(run)()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_msgpack_subprotocol_sends_compact_frames():
+    org = OrganizationFactory()
+    user = UserProfileFactory(role='receptionist', organization=org).user
+
+    async def run():
+        communicator = connect_as(MultiplexConsumer, '/ws/stream/', user, subprotocols=['pulsecal.msgpack', 'pulsecal.json'])
+        connected, subprotocol = await communicator.connect()
+        assert connected
+        assert subprotocol == 'pulsecal.msgpack'
+
+        await communicator.send_to(bytes_data=msgpack.packb({'action': 'subscribe', 'stream': 'queue'}))
+        frame = msgpack.unpackb(await communicator.receive_from(timeout=5))
+        assert frame['payload'] == {'type': 'subscribed', 'room': None}
+
+        await publish(queue_group(user.id), {
+            'type': 'queue_update', 'appointment_id': 7, 'status': 'confirmed',
+            'patient_status': 'waiting', 'timestamp': '2025-01-01T09:00:00+00:00',
+        })
+        frame = msgpack.unpackb(await communicator.receive_from(timeout=5))
+        assert frame == {'stream': 'queue', 'payload': [3, 7, 'confirmed', 'waiting', 1735722000000]}
+        await communicator.disconnect()
+
+    async_to_sync(run)()
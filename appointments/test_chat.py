@@ -0,0 +1,203 @@
+import pytest
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from datetime import timedelta
+from unittest import mock
+from django.urls import reverse
+from django.utils import timezone
+
+from . import chat_buffer, chat_history, chat_summary
+from .factories import UserProfileFactory
+from .consumers import ChatConsumer
+from .models import ChatRoom, ChatMessage, ChatRoomSummary
+from .utils import create_or_get_chat_room, save_chat_message
+from .test_channels import connect_as
+
+
+@pytest.fixture
+def room():
+    room = ChatRoom.objects.create(name='room_history')
+    room.participants.set([UserProfileFactory().user, UserProfileFactory().user])
+    return room
+
+
+def add_messages(room, count):
+    sender = room.participants.first()
+    start = timezone.now() - timedelta(hours=1)
+    for i in range(count):
+        message = ChatMessage.objects.create(room=room, sender=sender, message=f'm{i}')
+        ChatMessage.objects.filter(id=message.id).update(created_at=start + timedelta(seconds=i))
+
+
+@pytest.mark.django_db
+class TestChatHistory:
+    """Test keyset-paginated chat history"""
+
+    def test_latest_page_then_older_pages(self, room):
+        add_messages(room, 5)
+        page, cursor = chat_history.get_page(room, limit=2)
+        assert [m.message for m in page] == ['m3', 'm4']
+        page, cursor = chat_history.get_page(room, cursor, limit=2)
+        assert [m.message for m in page] == ['m1', 'm2']
+        page, cursor = chat_history.get_page(room, cursor, limit=2)
+        assert [m.message for m in page] == ['m0']
+        assert cursor is None
+
+    def test_senders_are_loaded_in_the_same_query(self, room, django_assert_num_queries):
+        add_messages(room, 5)
+        with django_assert_num_queries(1):
+            page, _ = chat_history.get_page(room)
+            [chat_history.serialize(message) for message in page]
+
+    def test_api_is_limited_to_participants(self, room, client):
+        add_messages(room, 3)
+        url = reverse('appointments:api_chat_history', args=[room.name])
+        client.force_login(UserProfileFactory().user)
+        assert client.get(url).status_code == 404
+
+        client.force_login(room.participants.first())
+        data = client.get(url, {'limit': 2}).json()
+        assert [m['message'] for m in data['messages']] == ['m1', 'm2']
+        data = client.get(url, {'before': data['next_cursor']}).json()
+        assert [m['message'] for m in data['messages']] == ['m0']
+        assert data['next_cursor'] is None
+
+    def test_page_loads_history_from_the_routed_endpoint(self, room, client):
+        client.force_login(room.participants.first())
+        content = client.get(reverse('appointments:chat', args=[room.name])).content.decode()
+        assert f"fetch(`{reverse('appointments:api_chat_history', args=[room.name])}?before=" in content
+
+    def test_posting_a_message_skips_the_history_query(self, room, client):
+        client.force_login(room.participants.first())
+        with mock.patch.object(chat_history, 'get_page') as get_page, \
+                mock.patch('appointments.utils.send_chat_message'):
+            response = client.post(reverse('appointments:chat', args=[room.name]), {'message': 'hi'})
+        assert response.json() == {'success': True}
+        get_page.assert_not_called()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_socket_messages_are_written_behind_in_batches(settings):
+    settings.CHAT_WRITE_BATCH_SIZE = 2
+    settings.CHAT_WRITE_INTERVAL = 60
+    room = ChatRoom.objects.create(name='room_buffer')
+    author, reader = UserProfileFactory().user, UserProfileFactory().user
+    room.participants.set([author, reader])
+
+    async def run():
+        communicator = connect_as(ChatConsumer, '/ws/chat/room_buffer/', author, room_name='room_buffer')
+        await communicator.connect()
+        for text in ('one', 'two', 'three'):
+            await communicator.send_json_to({'message': text})
+            await communicator.receive_json_from(timeout=5)
+
+        # The batch of two was flushed, the third waits for the next batch
+        assert await count_messages() == 2
+        await communicator.disconnect()
+        assert await count_messages() == 3
+
+        communicator = connect_as(ChatConsumer, '/ws/chat/room_buffer/', reader, room_name='room_buffer')
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'mark_read'})
+        await communicator.disconnect()
+
+    count_messages = database_sync_to_async(lambda: ChatMessage.objects.filter(room=room).count())
+    async_to_sync(run)()
+    assert list(ChatMessage.objects.order_by('id').values_list('message', 'is_read')) == [
+        ('one', True), ('two', True), ('three', True)
+    ]
+
+
+@pytest.mark.django_db
+class TestChatWriteFailures:
+    """Test that unwritten socket messages are retried, not dropped"""
+
+    def test_failed_batch_falls_back_to_row_inserts(self, room):
+        sender = room.participants.first()
+        messages = [ChatMessage(room=room, sender=sender, message=text) for text in ('a', 'b')]
+        with mock.patch.object(chat_summary, 'record_messages', side_effect=[Exception('boom'), None, None]) as patched:
+            failed = chat_buffer.persist(messages, {(room.id, sender.id)})
+        assert failed == ([], set())
+        assert patched.call_count == 3
+        assert sorted(ChatMessage.objects.filter(room=room).values_list('message', flat=True)) == ['a', 'b']
+
+    def test_unwritten_rows_are_requeued_a_bounded_number_of_times(self, room, settings):
+        settings.CHAT_WRITE_MAX_RETRIES = 1
+        sender = room.participants.first()
+        buffer = chat_buffer.ChatWriteBuffer()
+        message = ChatMessage(room_id=room.id, sender_id=sender.id, message='kept')
+        buffer.messages = [message]
+
+        async def flush():
+            await buffer.flush()
+            if buffer.flush_task:
+                buffer.flush_task.cancel()
+                buffer.flush_task = None
+
+        with mock.patch.object(chat_buffer, 'persist', return_value=([message], set())):
+            async_to_sync(flush)()
+            assert buffer.messages == [message]
+            async_to_sync(flush)()
+            assert buffer.messages == []
+
+
+@pytest.mark.django_db
+class TestChatRoomSummaries:
+    """Test the participant key and the rooms-list projection"""
+
+    def test_room_is_found_by_participant_set(self):
+        a, b = UserProfileFactory().user, UserProfileFactory().user
+        room = create_or_get_chat_room([a, b])
+        assert create_or_get_chat_room([b, a]) == room
+        assert room.participant_key == chat_summary.participant_key([b.id, a.id])
+        assert ChatRoomSummary.objects.filter(room=room).count() == 2
+
+    def test_key_follows_membership_changes(self):
+        a, b, c = (UserProfileFactory().user for _ in range(3))
+        room = create_or_get_chat_room([a, b])
+        room.participants.add(c)
+        room.refresh_from_db()
+        assert room.participant_key == chat_summary.participant_key([a.id, b.id, c.id])
+        assert create_or_get_chat_room([a, b, c]) == room
+
+        # A fresh room for the old pair, not the one that now has three members
+        pair = create_or_get_chat_room([a, b])
+        assert pair != room
+        assert set(pair.participants.all()) == {a, b}
+
+        # Shrinking back onto the pair's participant set cannot steal its key
+        room.participants.remove(c)
+        room.refresh_from_db()
+        assert room.participant_key is None
+        assert create_or_get_chat_room([b, a]) == pair
+
+    def test_summary_follows_writes_and_reads(self):
+        a, b = UserProfileFactory().user, UserProfileFactory().user
+        room = create_or_get_chat_room([a, b])
+        save_chat_message(room, a, 'hello')
+        save_chat_message(room, a, 'again')
+
+        room.refresh_from_db()
+        assert room.last_message == 'again'
+        assert room.last_message_sender == (a.get_full_name() or a.username)
+        assert ChatRoomSummary.objects.get(room=room, user=b).unread_count == 2
+        assert ChatRoomSummary.objects.get(room=room, user=a).unread_count == 0
+
+        chat_summary.record_read(room.id, b.id)
+        assert ChatRoomSummary.objects.get(room=room, user=b).unread_count == 0
+
+    def test_rooms_list_is_one_query(self, client, django_assert_num_queries):
+        user = UserProfileFactory().user
+        for _ in range(3):
+            room = create_or_get_chat_room([user, UserProfileFactory().user])
+            save_chat_message(room, user, 'hi')
+        client.force_login(user)
+        response = client.get(reverse('appointments:chat_rooms'))
+        summaries = response.context['room_summaries']
+        with django_assert_num_queries(1):
+            rows = [
+                (s.room.name, s.room.participant_names, s.room.last_message, s.unread_count)
+                for s in summaries.all()
+            ]
+        assert len(rows) == 3
+        assert all(row[2] == 'hi' for row in rows)
@@ -0,0 +1,130 @@
+import pytest
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+from django.core import mail
+from django.db import transaction
+
+from . import emails, mail_outbox, tasks
+from .factories import AppointmentFactory
+from .models import OutboundEmail
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    emails.close()
+    yield
+    emails.close()
+
+
+def test_templates_are_compiled_once():
+    assert emails.templates('appointment_confirmation') is emails.templates('appointment_confirmation')
+
+
+@pytest.mark.django_db
+class TestEmailRendering:
+    """Test templated text + HTML task mail"""
+
+    def test_build_renders_text_and_html(self):
+        appointment = AppointmentFactory(fee='75.00')
+        message = emails.build('appointment_confirmation', 'Confirmed', [appointment.patient.email], {
+            'appointment': appointment, 'patient': appointment.patient, 'doctor': appointment.doctor,
+        })
+        assert message.to == [appointment.patient.email]
+        assert appointment.doctor.get_full_name() in message.body
+        assert '$75.00' in message.body
+        html, mimetype = message.alternatives[0]
+        assert mimetype == 'text/html'
+        assert '<table' in html and appointment.patient.get_full_name() in html
+
+
+class TestPooledConnection:
+    """Test that mail reuses one connection per process"""
+
+    def test_connection_is_opened_once(self):
+        with mock.patch.object(emails, 'get_connection') as get_connection:
+            emails.send([mail.EmailMessage('a', 'b', to=['x@example.com'])])
+            emails.send([mail.EmailMessage('c', 'd', to=['y@example.com'])])
+        get_connection.assert_called_once()
+        get_connection.return_value.open.assert_called_once()
+        assert get_connection.return_value.send_messages.call_count == 2
+
+    def test_reconnects_when_the_server_drops_the_connection(self):
+        stale, fresh = mock.Mock(), mock.Mock()
+        stale.send_messages.side_effect = SMTPServerDisconnected
+        fresh.send_messages.return_value = 1
+        with mock.patch.object(emails, 'get_connection', side_effect=[stale, fresh]):
+            assert emails.send([mail.EmailMessage('a', 'b', to=['x@example.com'])]) == 1
+        stale.close.assert_called_once()
+
+
+@pytest.mark.django_db
+class TestMailOutbox:
+    """Test the batched email outbox"""
+
+    def test_task_mail_waits_in_the_outbox_until_flushed(self):
+        appointments = [AppointmentFactory() for _ in range(3)]
+        for appointment in appointments:
+            tasks.send_appointment_confirmation(appointment.id)
+        tasks.send_appointment_cancellation(appointments[0].id)
+        assert not mail.outbox
+        assert OutboundEmail.objects.filter(sent_at__isnull=True).count() == 4
+
+        assert mail_outbox.flush(batch_size=3) == (4, True)
+        assert len(mail.outbox) == 4
+        assert mail.outbox[0].subject.startswith('Appointment Confirmed')
+        assert mail.outbox[3].subject.startswith('Appointment Cancelled')
+        assert mail.outbox[0].alternatives[0][1] == 'text/html'
+        assert not OutboundEmail.objects.filter(sent_at__isnull=True).exists()
+
+        assert mail_outbox.flush() == (0, True)
+        assert len(mail.outbox) == 4
+
+    def test_failed_mail_is_retried_up_to_max_attempts(self, settings):
+        settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 2
+        tasks.send_appointment_confirmation(AppointmentFactory().id)
+        with mock.patch.object(mail_outbox.emails, 'send', side_effect=ConnectionRefusedError('down')):
+            for _ in range(2):
+                with pytest.raises(ConnectionRefusedError):
+                    mail_outbox.flush()
+        row = OutboundEmail.objects.get()
+        assert row.attempts == 2 and 'down' in row.last_error
+        assert mail_outbox.flush() == (0, True)
+        assert not mail.outbox
+
+    def test_transient_failure_stops_the_batch_for_a_retry(self):
+        for _ in range(3):
+            tasks.send_appointment_confirmation(AppointmentFactory().id)
+        with mock.patch.object(mail_outbox.emails, 'send', side_effect=[1, SMTPServerDisconnected('gone')]) as send:
+            with pytest.raises(SMTPServerDisconnected):
+                tasks.flush_email_outbox()
+        assert send.call_count == 2
+        assert list(OutboundEmail.objects.order_by('id').values_list('attempts', flat=True)) == [0, 1, 0]
+        assert OutboundEmail.objects.filter(sent_at__isnull=False).count() == 1
+
+    def test_permanent_failures_do_not_stop_the_batch(self):
+        for _ in range(2):
+            tasks.send_appointment_confirmation(AppointmentFactory().id)
+        with mock.patch.object(mail_outbox.emails, 'send', side_effect=[ValueError('bad address'), 1]):
+            assert mail_outbox.flush() == (1, True)
+
+    def test_flush_through_the_file_backend(self, settings, tmp_path):
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+        settings.EMAIL_FILE_PATH = str(tmp_path)
+        tasks.send_appointment_confirmation(AppointmentFactory().id)
+        assert mail_outbox.flush() == (1, True)
+        emails.close()
+        written = ''.join(path.read_text() for path in tmp_path.iterdir())
+        assert 'Appointment Confirmed' in written
+
+    @pytest.mark.django_db(transaction=True)
+    def test_sync_delivery_sends_after_commit_without_a_worker(self, settings):
+        settings.EMAIL_OUTBOX_DELIVERY = 'sync'
+        settings.EVENT_DELIVERY = 'outbox'
+        appointment = AppointmentFactory()
+        with mock.patch.object(tasks.flush_email_outbox, 'apply_async') as apply_async:
+            with transaction.atomic():
+                tasks.send_appointment_confirmation(appointment.id)
+                assert not mail.outbox
+        assert not apply_async.called
+        assert len(mail.outbox) == 1
+        assert OutboundEmail.objects.get().sent_at is not None
@@ -0,0 +1,42 @@
+import pytest
+
+from . import eventlog
+from .factories import OrganizationFactory
+from .models import OrganizationEvent
+
+
+def update(appointment_id):
+    return {'type': 'appointment_update', 'appointment_id': appointment_id}
+
+
+@pytest.mark.django_db
+class TestOrganizationEventLog:
+    """Test the bounded resume log"""
+
+    def test_record_stamps_increasing_offsets(self):
+        org = OrganizationFactory()
+        messages = eventlog.record([(org.id, update(1)), (org.id, update(2)), (None, update(3))])
+        assert len(messages) == 2
+        assert messages[0]['offset'] < messages[1]['offset']
+        assert eventlog.head(org.id) == messages[1]['offset']
+
+    def test_replay_returns_only_the_gap(self):
+        org = OrganizationFactory()
+        first, second, third = eventlog.record([(org.id, update(i)) for i in range(3)])
+        replayed = eventlog.replay(org.id, first['offset'])
+        assert [m['offset'] for m in replayed] == [second['offset'], third['offset']]
+        assert eventlog.replay(org.id, third['offset']) == []
+
+    def test_trimmed_gap_requires_resync(self, settings):
+        settings.EVENT_LOG_SIZE = 2
+        org = OrganizationFactory()
+        first = eventlog.record([(org.id, update(1))])[0]
+        eventlog.record([(org.id, update(2)), (org.id, update(3))])
+        assert OrganizationEvent.objects.filter(organization=org).count() == 2
+        assert eventlog.replay(org.id, first['offset']) is None
+
+    def test_gap_over_replay_limit_requires_resync(self, settings):
+        settings.EVENT_LOG_REPLAY_LIMIT = 1
+        org = OrganizationFactory()
+        first = eventlog.record([(org.id, update(i)) for i in range(3)])[0]
+        assert eventlog.replay(org.id, first['offset']) is None
@@ -0,0 +1,216 @@
+import pytest
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from notifications.models import Notification
+
+from . import events, outbox, tasks
+from .factories import AppointmentFactory, OrganizationFactory, UserProfileFactory
+from .models import OutboundEmail, OutboxEvent
+
+
+def appointment_update(appointment_id):
+    return {
+        'organization_id': 1,
+        'appointment_id': appointment_id,
+        'status': 'confirmed',
+        'patient_status': 'waiting',
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+class TestEventDispatcher:
+    """Test domain event collection and delivery"""
+
+    def test_events_in_a_request_are_delivered_as_one_batch(self):
+        with mock.patch.object(events, 'deliver') as deliver:
+            token = events.start_collecting()
+            events.dispatch('appointment_update', appointment_update(1))
+            events.dispatch('appointment_update', appointment_update(2))
+            assert not deliver.called
+            events.flush(events.stop_collecting(token))
+
+        deliver.assert_called_once()
+        batch = deliver.call_args[0][0]
+        assert [e['payload']['appointment_id'] for e in batch] == [1, 2]
+
+    def test_events_wait_for_commit_and_are_dropped_on_rollback(self):
+        with mock.patch.object(events, 'deliver') as deliver:
+            token = events.start_collecting()
+            with transaction.atomic():
+                events.dispatch('appointment_update', appointment_update(1))
+            try:
+                with transaction.atomic():
+                    events.dispatch('appointment_update', appointment_update(2))
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+            events.flush(events.stop_collecting(token))
+
+        batch = deliver.call_args[0][0]
+        assert [e['payload']['appointment_id'] for e in batch] == [1]
+
+    def test_unknown_event_type_is_rejected(self):
+        with pytest.raises(ValueError):
+            events.dispatch('no_such_event', {})
+
+    def test_deliver_pushes_all_messages_in_one_round(self):
+        organization = OrganizationFactory()
+        with mock.patch.object(events, 'publish_many_sync') as publish_many_sync:
+            events.deliver([
+                {'type': 'appointment_update', 'payload': dict(appointment_update(1), organization_id=organization.id)},
+                {'type': 'appointment_broadcast', 'payload': {
+                    'appointment_id': 1, 'doctor_id': 2, 'patient_id': 3,
+                    'organization_id': 4, 'event_type': 'booked',
+                }},
+            ])
+        publish_many_sync.assert_called_once()
+        groups = [group for group, message in publish_many_sync.call_args[0][0]]
+        assert groups == [f'appointments_org_{organization.id}', 'notifications_2', 'notifications_3', 'receptionists_org_4']
+
+
+
+@pytest.mark.django_db(transaction=True)
+class TestTransactionalOutbox:
+    """Test outbox writes in the caller's transaction and the ordered relay"""
+
+    @pytest.fixture(autouse=True)
+    def outbox_delivery(self, settings):
+        settings.EVENT_DELIVERY = 'outbox'
+        cache.clear()
+        with mock.patch.object(tasks.relay_outbox, 'delay') as delay:
+            self.relay_delay = delay
+            yield
+
+    def test_events_are_written_with_the_transaction(self):
+        with transaction.atomic():
+            events.dispatch('appointment_update', appointment_update(1))
+            assert not self.relay_delay.called
+        try:
+            with transaction.atomic():
+                events.dispatch('appointment_update', appointment_update(2))
+                raise RuntimeError('rollback')
+        except RuntimeError:
+            pass
+        assert [e.payload['appointment_id'] for e in OutboxEvent.objects.all()] == [1]
+        self.relay_delay.assert_called_once_with()
+
+    def test_relay_delivers_in_order_and_once(self):
+        organization = OrganizationFactory()
+        for appointment_id in (1, 2, 3):
+            events.dispatch('appointment_update', dict(appointment_update(appointment_id), organization_id=organization.id))
+        with mock.patch.object(events, 'publish_many_sync') as publish_many_sync:
+            assert outbox.relay(batch_size=2) == (3, True)
+            assert outbox.relay() == (0, True)
+        assert publish_many_sync.call_count == 2
+        ids = [m['appointment_id'] for call in publish_many_sync.call_args_list for _, m in call[0][0]]
+        assert ids == [1, 2, 3]
+        assert not OutboxEvent.objects.filter(processed_at__isnull=True).exists()
+
+    def test_events_committed_during_a_run_are_relayed_by_it(self):
+        organization = OrganizationFactory()
+        events.dispatch('appointment_update', dict(appointment_update(1), organization_id=organization.id))
+        assert self.relay_delay.call_count == 1
+        relay_batch = outbox.relay_batch
+
+        def batch_then_commit_another(batch_size, after):
+            count = relay_batch(batch_size, after)
+            if not OutboxEvent.objects.filter(payload__appointment_id=2).exists():
+                # Arrives while the first run still holds the schedule key
+                events.dispatch('appointment_update', dict(appointment_update(2), organization_id=organization.id))
+            return count
+
+        with mock.patch.object(outbox, 'relay_batch', side_effect=batch_then_commit_another), \
+                mock.patch.object(events, 'publish_many_sync'):
+            assert outbox.relay() == (2, True)
+        assert self.relay_delay.call_count == 1
+        assert not OutboxEvent.objects.filter(processed_at__isnull=True).exists()
+
+    def test_repeated_idempotency_keys_are_ignored(self):
+        events.dispatch('appointment_update', appointment_update(1), key='booking-1')
+        events.dispatch('appointment_update', appointment_update(1), key='booking-1')
+        assert OutboxEvent.objects.count() == 1
+
+    def test_retried_request_derives_the_same_keys(self):
+        user = UserProfileFactory().user
+        request = RequestFactory().post('/', HTTP_IDEMPOTENCY_KEY='abc')
+        request.user = user
+
+        def view(request):
+            events.dispatch('appointment_update', appointment_update(1))
+            events.dispatch('appointment_update', appointment_update(2))
+
+        middleware = events.EventDispatchMiddleware(view)
+        middleware(request)
+        middleware(request)
+        assert OutboxEvent.objects.count() == 2
+
+    def test_failing_handler_does_not_block_the_batch(self):
+        user = UserProfileFactory().user
+        events.dispatch('appointment_broadcast', {'appointment_id': 1})  # missing fields
+        events.dispatch_notification(user.id, 'appointment_update', 'Title', 'Body')
+        with mock.patch.object(events, 'publish_many_sync'):
+            # The unread-count push the notification dispatched goes out in the same run
+            assert outbox.relay() == (3, True)
+        assert Notification.objects.filter(recipient=user).count() == 1
+        broken = OutboxEvent.objects.get(event_type='appointment_broadcast')
+        assert broken.processed_at is None and broken.attempts == 1
+        assert list(OutboxEvent.objects.filter(processed_at__isnull=True)) == [broken]
+
+    def test_failed_events_are_retried_then_dead_lettered(self, settings):
+        settings.OUTBOX_MAX_ATTEMPTS = 2
+        user = UserProfileFactory().user
+        events.dispatch_notification(user.id, 'appointment_update', 'First', 'Body')
+        events.dispatch_notification(user.id, 'appointment_update', 'Second', 'Body')
+        handler = events.EVENT_HANDLERS['notification']
+
+        def fail_first(payloads):
+            if any(p['title'] == 'First' for p in payloads):
+                raise ConnectionError('redis down')
+            return handler(payloads)
+
+        with mock.patch.dict(events.EVENT_HANDLERS, {'notification': fail_first}), \
+                mock.patch.object(events, 'publish_many_sync'):
+            outbox.relay()
+            first = OutboxEvent.objects.get(payload__title='First')
+            assert first.processed_at is None
+            assert (first.attempts, first.last_error) == (1, 'redis down')
+            assert OutboxEvent.objects.get(payload__title='Second').processed_at is not None
+
+            # A later run tries again; the last allowed failure dead-letters it
+            outbox.relay()
+        first.refresh_from_db()
+        assert first.attempts == 2 and first.dead_lettered_at is not None
+        with mock.patch.object(events, 'publish_many_sync'):
+            assert outbox.relay() == (0, True)
+        assert [n.description for n in Notification.objects.filter(recipient=user)] == ['Second']
+
+    def test_transient_failure_is_delivered_on_the_next_run(self):
+        user = UserProfileFactory().user
+        events.dispatch_notification(user.id, 'appointment_update', 'Title', 'Body')
+        with mock.patch.dict(events.EVENT_HANDLERS, {'notification': mock.Mock(side_effect=TimeoutError)}):
+            outbox.relay()
+        assert not Notification.objects.filter(recipient=user).exists()
+        with mock.patch.object(events, 'publish_many_sync'):
+            outbox.relay()
+        assert Notification.objects.filter(recipient=user).count() == 1
+        assert not OutboxEvent.objects.filter(processed_at__isnull=True).exists()
+
+    def test_appointment_email_goes_to_the_mail_outbox(self):
+        appointment = AppointmentFactory(status='confirmed')
+        events.dispatch_appointment_email(appointment, 'confirmation')
+        with mock.patch.object(tasks.flush_email_outbox, 'apply_async'):
+            outbox.relay()
+        assert OutboundEmail.objects.get().subject.startswith('Appointment Confirmed')
+
+    def test_purge_keeps_recent_and_unprocessed_events(self):
+        for appointment_id in (1, 2, 3):
+            events.dispatch('appointment_update', appointment_update(appointment_id))
+        now = timezone.now()
+        OutboxEvent.objects.filter(payload__appointment_id=1).update(processed_at=now - timedelta(days=2))
+        OutboxEvent.objects.filter(payload__appointment_id=2).update(processed_at=now)
+        assert outbox.purge(now) == 1
+        assert OutboxEvent.objects.count() == 2
@@ -0,0 +1,52 @@
+import pytest
+from io import StringIO
+from decimal import Decimal
+from django.core.management import call_command
+
+from .models import GeocodeCache
+from .factories import OrganizationFactory
+from .geocoding import StubGeocodingProvider, geocode, geocode_many, normalize_address
+
+
+def test_normalize_address():
+    assert normalize_address('  123 Broadway ,New York,  NY. ') == '123 broadway, new york, ny'
+
+
+@pytest.mark.django_db
+class TestGeocodingCache:
+    """Test the persistent geocoding cache"""
+
+    def test_repeat_lookups_do_not_hit_provider(self):
+        provider = StubGeocodingProvider()
+        first = geocode('123 Broadway, New York, NY', provider=provider)
+        second = geocode('123 broadway,  new york, ny', provider=provider)
+        assert provider.calls == 1
+        assert first['latitude'] == second['latitude']
+        assert GeocodeCache.objects.count() == 1
+
+    def test_misses_are_cached(self):
+        provider = StubGeocodingProvider(fixtures={'nowhere': None})
+        assert geocode('Nowhere', provider=provider) is None
+        assert geocode('Nowhere', provider=provider) is None
+        assert provider.calls == 1
+
+    def test_geocode_many_deduplicates(self):
+        provider = StubGeocodingProvider()
+        results = geocode_many(['1 Main St', '1 MAIN ST', '2 Main St'], provider=provider, rate_limit=0)
+        assert provider.calls == 2
+        assert results['1 Main St'] == results['1 MAIN ST']
+
+
+@pytest.mark.django_db
+def test_geocode_organizations_command():
+    located = OrganizationFactory(latitude=Decimal('1.0'), longitude=Decimal('2.0'))
+    missing = OrganizationFactory(latitude=None, longitude=None, address='123 Broadway', city='New York')
+    out = StringIO()
+    call_command('geocode_organizations', '--rate', '0', stdout=out)
+
+    missing.refresh_from_db()
+    located.refresh_from_db()
+    assert missing.latitude is not None
+    assert missing.google_places_id.startswith('stub-')
+    assert located.latitude == Decimal('1.0')
+    assert 'Geocoded 1 of 1' in out.getvalue()
@@ -0,0 +1,220 @@
+import pytest
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from django.urls import reverse
+from notifications.models import Notification
+from notifications.signals import notify
+
+from . import events, inbox, notification_counts, retention
+from .factories import OrganizationFactory, UserProfileFactory
+from .utils import send_notification, send_notifications
+
+
+def unread(user):
+    user.profile.refresh_from_db()
+    return user.profile.unread_notifications
+
+
+@pytest.mark.django_db
+class TestUnreadNotificationCounter:
+    """Test the denormalized unread-notification counter"""
+
+    def test_notify_send_increments(self):
+        user = UserProfileFactory().user
+        notify.send(user, recipient=user, verb='test', description='One')
+        notify.send(user, recipient=user, verb='test', description='Two')
+        assert unread(user) == 2
+
+    def test_mark_read_only_counts_real_changes(self):
+        user = UserProfileFactory().user
+        notify.send(user, recipient=user, verb='test', description='One')
+        notification = user.notifications.get()
+        assert notification_counts.mark_read(user, notification.id)
+        assert notification_counts.mark_read(user, notification.id)
+        assert unread(user) == 0
+
+    def test_mark_read_rejects_other_users_notifications(self):
+        user = UserProfileFactory().user
+        other = UserProfileFactory().user
+        notify.send(other, recipient=other, verb='test', description='One')
+        assert not notification_counts.mark_read(user, other.notifications.get().id)
+        assert unread(other) == 1
+
+    def test_mark_all_read_and_recount(self):
+        user = UserProfileFactory().user
+        for _ in range(3):
+            notify.send(user, recipient=user, verb='test', description='N')
+        assert notification_counts.mark_all_read(user) == 3
+        assert unread(user) == 0
+
+        user.profile.__class__.objects.filter(pk=user.profile.pk).update(unread_notifications=9)
+        notification_counts.recount([user.id])
+        assert unread(user) == 0
+
+    def test_count_api_reads_the_counter(self, client):
+        user = UserProfileFactory().user
+        notify.send(user, recipient=user, verb='test', description='One')
+        client.force_login(user)
+        response = client.get(reverse('appointments:unread_notifications_count'))
+        assert response.json() == {'count': 1}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_counter_changes_are_pushed_to_the_user():
+    user = UserProfileFactory().user
+    with mock.patch.object(events, 'publish_many_sync') as publish_many_sync:
+        notify.send(user, recipient=user, verb='test', description='One')
+    messages = publish_many_sync.call_args[0][0]
+    assert (f'notifications_{user.id}', {'type': 'notification_count', 'count': 1}) in messages
+
+
+@pytest.mark.django_db
+class TestNotificationInbox:
+    """Test the keyset-paginated inbox"""
+
+    def test_pages_cover_every_notification_once(self, client):
+        user = UserProfileFactory().user
+        for i in range(5):
+            notify.send(user, recipient=user, verb='test', description=f'N{i}')
+        client.force_login(user)
+
+        seen = []
+        cursor = ''
+        while True:
+            data = client.get(reverse('appointments:api_notifications'), {'cursor': cursor, 'limit': 2}).json()
+            seen.extend(n['title'] for n in data['notifications'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        assert seen == [f'N{i}' for i in reversed(range(5))]
+
+    def test_bad_cursor_starts_from_the_top(self):
+        user = UserProfileFactory().user
+        notify.send(user, recipient=user, verb='test', description='N')
+        notifications, next_cursor = inbox.get_page(user, cursor='garbage')
+        assert len(notifications) == 1
+        assert next_cursor is None
+
+    def test_mark_all_read_endpoint(self, client):
+        user = UserProfileFactory().user
+        for _ in range(3):
+            notify.send(user, recipient=user, verb='test', description='N')
+        client.force_login(user)
+        response = client.post(reverse('appointments:mark_all_notifications_read'))
+        assert response.json() == {'success': True, 'updated': 3}
+        assert not user.notifications.unread().exists()
+        assert unread(user) == 0
+
+    def test_page_scripts_call_the_routed_endpoints(self, client):
+        user = UserProfileFactory().user
+        client.force_login(user)
+        content = client.get(reverse('appointments:notifications')).content.decode()
+        assert f"fetch('{reverse('appointments:mark_all_notifications_read')}'" in content
+        assert f"fetch(`{reverse('appointments:api_notifications')}?cursor=" in content
+        assert '/appointments/api/' not in content
+
+
+@pytest.mark.django_db
+class TestBulkNotifications:
+    """Test multi-recipient notification creation"""
+
+    def test_send_notifications_batches_queries(self, django_assert_max_num_queries):
+        users = [UserProfileFactory().user for _ in range(5)]
+        with mock.patch('appointments.utils.publish_many_sync') as publish_many_sync:
+            with django_assert_max_num_queries(5):
+                sent = send_notifications([{
+                    'user_id': user.id,
+                    'notification_type': 'test',
+                    'title': 'Hello',
+                    'message': 'World',
+                } for user in users])
+        assert sent == 5
+        publish_many_sync.assert_called_once()
+        assert len(publish_many_sync.call_args[0][0]) == 5
+        assert all(unread(user) == 1 for user in users)
+        assert users[0].notifications.get().data == {'message': 'World'}
+
+    def test_unknown_recipients_are_skipped(self):
+        user = UserProfileFactory().user
+        with mock.patch('appointments.utils.publish_many_sync'):
+            assert send_notification(user.id, 'test', 'Hello', 'World')
+            assert not send_notification(999999, 'test', 'Hello', 'World')
+        assert user.notifications.count() == 1
+
+    def test_send_notification_api_accepts_many_recipients(self, client):
+        organization = OrganizationFactory()
+        sender = UserProfileFactory(organization=organization).user
+        recipients = [UserProfileFactory(organization=organization).user for _ in range(2)]
+        client.force_login(sender)
+        with mock.patch('appointments.utils.publish_many_sync'):
+            response = client.post(
+                reverse('appointments:send_notification_api'),
+                data={'recipient_ids': [r.id for r in recipients], 'notification_type': 'note',
+                      'title': 'Hi', 'message': 'There'},
+                content_type='application/json'
+            )
+        assert response.json() == {'success': True, 'sent': 2}
+        assert recipients[1].notifications.get().actor == sender
+
+    def test_send_notification_api_is_limited_to_the_senders_organization(self, client):
+        organization = OrganizationFactory()
+        sender = UserProfileFactory(organization=organization).user
+        outsider = UserProfileFactory(organization=OrganizationFactory()).user
+        client.force_login(sender)
+        response = client.post(
+            reverse('appointments:send_notification_api'),
+            data={'recipient_ids': [outsider.id], 'notification_type': 'note', 'title': 'Hi', 'message': 'There'},
+            content_type='application/json'
+        )
+        assert response.status_code == 403
+        assert not outsider.notifications.exists()
+
+    def test_send_notification_api_caps_recipients(self, client, settings):
+        settings.NOTIFICATION_API_MAX_RECIPIENTS = 2
+        client.force_login(UserProfileFactory(user__is_staff=True).user)
+        response = client.post(
+            reverse('appointments:send_notification_api'),
+            data={'recipient_ids': [1, 2, 3], 'notification_type': 'note', 'title': 'Hi', 'message': 'There'},
+            content_type='application/json'
+        )
+        assert response.status_code == 400
+        assert not Notification.objects.exists()
+
+
+@pytest.mark.django_db
+class TestNotificationRetention:
+    """Test the batched retention engine"""
+
+    def make(self, user, verb, days_old, unread=False):
+        notify.send(user, recipient=user, verb=verb, description='N')
+        notification = user.notifications.latest('id')
+        Notification.objects.filter(id=notification.id).update(
+            timestamp=timezone.now() - timedelta(days=days_old), unread=unread
+        )
+        return notification.id
+
+    def test_policies_per_type_in_bounded_batches(self, settings):
+        settings.NOTIFICATION_RETENTION = {
+            'default': {'read': 30, 'unread': None},
+            'appointment_reminder': {'read': 7, 'unread': 10},
+        }
+        user = UserProfileFactory().user
+        expired = [self.make(user, 'appointment_reminder', 8) for _ in range(3)]
+        expired.append(self.make(user, 'appointment_reminder', 11, unread=True))
+        expired.append(self.make(user, 'appointment_update', 31))
+        kept = [
+            self.make(user, 'appointment_update', 8),
+            self.make(user, 'appointment_update', 400, unread=True),
+            self.make(user, 'appointment_reminder', 1, unread=True),
+        ]
+
+        deleted, done = retention.purge_notifications(batch_size=2, max_batches=1)
+        assert (deleted, done) == (2, False)
+        while not done:
+            count, done = retention.purge_notifications(batch_size=2, max_batches=1)
+            deleted += count
+
+        assert deleted == len(expired)
+        assert sorted(Notification.objects.values_list('id', flat=True)) == sorted(kept)
+        assert unread(user) == 2
@@ -0,0 +1,306 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from smtplib import SMTPRecipientsRefused
+from unittest import mock
+from django.core import mail
+from django.urls import reverse
+from django.utils import timezone
+
+from notifications.models import Notification
+
+from . import daily_summary, medication_reminders, reminders, tasks
+from .models import Appointment, MedicationReminder, Prescription
+from .factories import AppointmentFactory, UserProfileFactory
+
+
+def tomorrow_at(hour):
+    day = timezone.localdate() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+@pytest.mark.django_db
+class TestDailyAppointmentSummary:
+    """Test the set-based daily summary for doctors"""
+
+    def setup_method(self):
+        self.doctor = UserProfileFactory(role='doctor').user
+        self.other_doctor = UserProfileFactory(role='doctor').user
+        patient = UserProfileFactory(role='patient').user
+        AppointmentFactory(doctor=self.doctor, patient=patient, status='confirmed', appointment_date=tomorrow_at(14))
+        AppointmentFactory(doctor=self.doctor, patient=patient, status='confirmed', appointment_date=tomorrow_at(9))
+        AppointmentFactory(doctor=self.doctor, patient=patient, status='pending', appointment_date=tomorrow_at(11))
+        AppointmentFactory(doctor=self.other_doctor, patient=patient, status='confirmed', appointment_date=tomorrow_at(10))
+        AppointmentFactory(
+            doctor=self.other_doctor, patient=patient, status='confirmed',
+            appointment_date=tomorrow_at(10) + timedelta(days=1)
+        )
+
+    def test_schedules_are_grouped_in_one_query(self, django_assert_num_queries):
+        day = timezone.localdate() + timedelta(days=1)
+        with django_assert_num_queries(1):
+            grouped = daily_summary.schedules(day)
+            names = [a.patient.get_full_name() for appointments in grouped.values() for a in appointments]
+        assert len(names) == 3
+        assert [a.appointment_date.hour for a in grouped[self.doctor]] == [9, 14]
+        assert len(grouped[self.other_doctor]) == 1
+
+    def test_task_sends_one_email_per_doctor(self):
+        tasks.send_daily_appointment_summary()
+        assert sorted(m.to[0] for m in mail.outbox) == sorted([self.doctor.email, self.other_doctor.email])
+        body = next(m.body for m in mail.outbox if m.to == [self.doctor.email])
+        assert body.index('09:00 AM') < body.index('02:00 PM')
+        assert '11:00 AM' not in body
+
+    def test_large_tenants_are_chunked_across_subtasks(self, settings):
+        settings.DAILY_SUMMARY_CHUNK_SIZE = 1
+        with mock.patch.object(tasks.send_daily_appointment_summary_chunk, 'delay') as delay:
+            tasks.send_daily_appointment_summary()
+        assert len(delay.call_args_list) == 2
+        assert not mail.outbox
+        for call in delay.call_args_list:
+            tasks.send_daily_appointment_summary_chunk(*call.args)
+        assert len(mail.outbox) == 2
+
+
+@pytest.mark.django_db
+class TestReminderScheduler:
+    """Test the batched, claim-based appointment reminder scheduler"""
+
+    def setup_method(self):
+        now = timezone.now()
+        patient = UserProfileFactory(role='patient').user
+        self.due = [
+            AppointmentFactory(patient=patient, status='confirmed', appointment_date=now + timedelta(hours=h))
+            for h in (1, 2, 3)
+        ]
+        AppointmentFactory(patient=patient, status='pending', appointment_date=now + timedelta(hours=1))
+        AppointmentFactory(patient=patient, status='confirmed', appointment_date=now + timedelta(days=3))
+        AppointmentFactory(patient=patient, status='confirmed', appointment_date=now - timedelta(hours=1))
+
+    def test_due_reminders_are_sent_once(self):
+        sent, done = reminders.dispatch_due(batch_size=2)
+        assert (sent, done) == (3, True)
+        assert len(mail.outbox) == 3
+        assert Notification.objects.filter(verb='appointment_reminder').count() == 3
+        assert not Appointment.objects.filter(id__in=[a.id for a in self.due], reminder_sent_at__isnull=True).exists()
+
+        assert reminders.dispatch_due() == (0, True)
+        assert len(mail.outbox) == 3
+
+    def test_max_batches_leaves_the_rest_for_the_next_run(self):
+        assert reminders.dispatch_due(batch_size=1, max_batches=2) == (2, False)
+        assert reminders.dispatch_due(batch_size=1, max_batches=2) == (1, True)
+
+    def test_failed_batch_is_released(self):
+        with mock.patch.object(reminders.emails, 'send', side_effect=OSError('smtp down')):
+            assert reminders.dispatch_due() == (0, True)
+        assert Appointment.objects.filter(reminder_sent_at__isnull=False).count() == 0
+        assert reminders.dispatch_due() == (3, True)
+
+    def test_a_failing_recipient_does_not_block_the_batch(self, settings):
+        settings.APPOINTMENT_REMINDER_MAX_ATTEMPTS = 2
+        first, *rest = self.due
+        refused = SMTPRecipientsRefused({first.patient.email: (550, b'no such user')})
+        real_send = reminders.emails.send
+
+        def send(messages):
+            # Every row has the same patient; the subject names the appointment time
+            if messages[0].subject.endswith(first.appointment_date.strftime('%B %d, %Y at %I:%M %p')):
+                raise refused
+            return real_send(messages)
+
+        with mock.patch.object(reminders.emails, 'send', side_effect=send):
+            assert reminders.dispatch_due() == (2, True)
+            assert not Appointment.objects.filter(id__in=[a.id for a in rest], reminder_sent_at__isnull=True).exists()
+            first.refresh_from_db()
+            assert (first.reminder_sent_at, first.reminder_attempts) == (None, 1)
+
+            # Retried until the attempts run out, then left alone
+            assert reminders.dispatch_due() == (0, True)
+            assert reminders.dispatch_due() == (0, True)
+        first.refresh_from_db()
+        assert first.reminder_attempts == 2
+        assert len(mail.outbox) == 2
+
+    def test_unreachable_server_releases_the_untried_rest(self):
+        with mock.patch.object(reminders.emails, 'send', side_effect=[1, ConnectionRefusedError('down')]) as send:
+            assert reminders.dispatch_due() == (1, True)
+        assert send.call_count == 2
+        assert Appointment.objects.filter(reminder_sent_at__isnull=False).count() == 1
+        assert not Appointment.objects.filter(reminder_attempts__gt=0).exists()
+        assert reminders.dispatch_due() == (2, True)
+
+    def test_rescheduling_rearms_the_reminder(self, client):
+        reminders.dispatch_due()
+        appointment = self.due[2]
+        UserProfileFactory(user=appointment.doctor, role='doctor')
+        new_date = timezone.localtime(appointment.appointment_date + timedelta(days=2))
+        client.force_login(appointment.patient)
+        response = client.post(reverse('appointments:reschedule', args=[appointment.id]), {
+            'appointment_type': 'followup', 'status': 'confirmed', 'doctor': appointment.doctor_id,
+            'patient': appointment.patient_id, 'appointment_date': new_date.strftime('%Y-%m-%dT%H:%M'),
+            'notes': '', 'fee': '0',
+        })
+        assert response.status_code == 302
+        appointment.refresh_from_db()
+        assert appointment.reminder_sent_at is None
+
+    def test_task_requeues_when_batches_run_out(self, settings):
+        settings.APPOINTMENT_REMINDER_BATCH_SIZE = 1
+        settings.APPOINTMENT_REMINDER_MAX_BATCHES = 1
+        with mock.patch.object(tasks.dispatch_appointment_reminders, 'delay') as delay:
+            tasks.dispatch_appointment_reminders()
+        delay.assert_called_once_with()
+        assert len(mail.outbox) == 1
+
+
+def local(year, month, day, hour=0, minute=0):
+    return timezone.make_aware(datetime(year, month, day, hour, minute))
+
+
+@pytest.mark.django_db
+class TestMedicationReminderEngine:
+    """Test next-occurrence rules and the batched medication reminder engine"""
+
+    def setup_method(self):
+        appointment = AppointmentFactory()
+        self.patient = UserProfileFactory(role='patient').user
+        self.prescription = Prescription.objects.create(
+            appointment=appointment, patient=self.patient, doctor=appointment.doctor,
+            medication_name='Amoxicillin', dosage='500mg', frequency='3x daily', duration='30 days',
+            instructions='With food', quantity=30, start_date=date(2026, 1, 31)
+        )
+
+    def reminder(self, reminder_type, days_of_week=(), **kwargs):
+        return MedicationReminder.objects.create(
+            prescription=self.prescription, patient=self.patient, reminder_type=reminder_type,
+            time_of_day=time(8, 30), days_of_week=list(days_of_week), **kwargs
+        )
+
+    def test_daily(self):
+        reminder = self.reminder('daily')
+        # Thursday 2026-03-05
+        assert medication_reminders.next_occurrence(reminder, local(2026, 3, 5, 7)) == local(2026, 3, 5, 8, 30)
+        assert medication_reminders.next_occurrence(reminder, local(2026, 3, 5, 8, 30)) == local(2026, 3, 6, 8, 30)
+
+    def test_weekly_and_custom_days(self):
+        # Form input arrives as strings; Monday and Friday
+        custom = self.reminder('custom', ['1', '5'])
+        assert medication_reminders.next_occurrence(custom, local(2026, 3, 5, 9)) == local(2026, 3, 6, 8, 30)
+        assert medication_reminders.next_occurrence(custom, local(2026, 3, 6, 9)) == local(2026, 3, 9, 8, 30)
+        # Without days a weekly reminder keeps the prescription's weekday (Saturday)
+        weekly = self.reminder('weekly')
+        assert medication_reminders.next_occurrence(weekly, local(2026, 3, 5, 9)) == local(2026, 3, 7, 8, 30)
+
+    def test_monthly_clamps_to_month_end(self):
+        reminder = self.reminder('monthly')
+        assert medication_reminders.next_occurrence(reminder, local(2026, 2, 1)) == local(2026, 2, 28, 8, 30)
+        assert medication_reminders.next_occurrence(reminder, local(2026, 12, 31, 9)) == local(2027, 1, 31, 8, 30)
+
+    def test_due_reminders_fire_once_and_advance(self, django_assert_max_num_queries):
+        now = timezone.now()
+        due = [self.reminder('daily', next_reminder=now - timedelta(minutes=1)) for _ in range(3)]
+        later = self.reminder('daily', next_reminder=now + timedelta(hours=1))
+        unscheduled = self.reminder('daily')
+        self.reminder('daily', next_reminder=now - timedelta(minutes=1), is_active=False)
+
+        with django_assert_max_num_queries(15):
+            assert medication_reminders.dispatch_due(now) == (3, True)
+        assert Notification.objects.filter(verb='medication_reminder', recipient=self.patient).count() == 3
+        for reminder in due:
+            reminder.refresh_from_db()
+            assert reminder.last_sent == now
+            assert now < reminder.next_reminder <= now + timedelta(days=1)
+        later.refresh_from_db()
+        assert later.last_sent is None
+        unscheduled.refresh_from_db()
+        assert unscheduled.next_reminder > now and unscheduled.last_sent is None
+
+        assert medication_reminders.dispatch_due(now) == (0, True)
+
+    def test_reminders_stop_after_the_prescription_ends(self):
+        now = timezone.now()
+        # Two days back, so the due occurrence is past the end date even just after midnight
+        self.prescription.end_date = timezone.localdate() - timedelta(days=2)
+        self.prescription.save()
+        reminder = self.reminder('daily', next_reminder=now - timedelta(minutes=1))
+        assert medication_reminders.dispatch_due(now) == (0, True)
+        reminder.refresh_from_db()
+        assert reminder.is_active is False
+        assert reminder.last_sent is None
+        assert not Notification.objects.filter(verb='medication_reminder').exists()
+
+    def test_stopped_prescriptions_do_not_fire(self):
+        now = timezone.now()
+        self.prescription.status = 'discontinued'
+        self.prescription.save()
+        reminder = self.reminder('daily', next_reminder=now - timedelta(minutes=1))
+        assert medication_reminders.dispatch_due(now) == (0, True)
+        reminder.refresh_from_db()
+        assert reminder.is_active is False
+        assert not Notification.objects.filter(verb='medication_reminder').exists()
+
+
+@pytest.mark.django_db
+class TestDoctorAvailability:
+    """Test the constant-query doctor availability update"""
+
+    def test_next_available_for_all_doctors(self, django_assert_max_num_queries):
+        now = timezone.now()
+        busy = UserProfileFactory(role='doctor', on_duty=True)
+        free = [UserProfileFactory(role='doctor', on_duty=True) for _ in range(5)]
+        off_duty = UserProfileFactory(role='doctor', on_duty=False)
+        AppointmentFactory(doctor=busy.user, status='confirmed', appointment_date=now + timedelta(minutes=30))
+        last = AppointmentFactory(doctor=busy.user, status='confirmed', appointment_date=now + timedelta(minutes=90))
+        AppointmentFactory(doctor=busy.user, status='confirmed', appointment_date=now + timedelta(hours=3))
+        AppointmentFactory(doctor=free[0].user, status='pending', appointment_date=now + timedelta(minutes=30))
+
+        with django_assert_max_num_queries(5):
+            tasks.update_doctor_availability()
+
+        busy.refresh_from_db()
+        assert busy.next_available == last.appointment_date + timedelta(minutes=30)
+        for profile in free:
+            profile.refresh_from_db()
+            assert abs(profile.next_available - now) < timedelta(seconds=5)
+        off_duty.refresh_from_db()
+        assert off_duty.next_available is None
+
+
+class TestTaskRouting:
+    """Test that each task lands on its own lane"""
+
+    @pytest.mark.parametrize('task, queue', [
+        (tasks.deliver_events_task, 'realtime'),
+        (tasks.send_appointment_confirmation, 'email'),
+        (tasks.send_appointment_reminder, 'email'),
+        (tasks.flush_email_outbox, 'email'),
+        (tasks.send_daily_appointment_summary, 'bulk'),
+        (tasks.send_daily_appointment_summary_chunk, 'bulk'),
+        (tasks.cleanup_old_notifications, 'maintenance'),
+        (tasks.update_doctor_availability, 'maintenance'),
+    ])
+    def test_routes(self, task, queue):
+        from pulsecal_system.celery import app
+        assert app.amqp.router.route({}, task.name)['queue'].name == queue
+
+    @pytest.mark.parametrize('task', [
+        tasks.send_appointment_confirmation, tasks.send_appointment_cancellation,
+        tasks.send_appointment_reminder, tasks.flush_email_outbox, tasks.send_daily_appointment_summary_chunk,
+    ])
+    def test_mail_tasks_retry_transient_failures(self, task):
+        assert task.autoretry_for == tasks.TRANSIENT_EMAIL_ERRORS
+        assert task.retry_backoff and task.retry_jitter
+
+    @pytest.mark.django_db
+    def test_enqueueing_tasks_raise_transient_failures_for_retry(self):
+        appointment = AppointmentFactory()
+        with mock.patch.object(tasks.mail_outbox, 'enqueue', side_effect=TimeoutError):
+            with pytest.raises(TimeoutError):
+                tasks.send_appointment_confirmation(appointment.id)
+
+    @pytest.mark.django_db
+    def test_transient_mail_failures_are_raised_for_retry(self):
+        with mock.patch.object(daily_summary.emails, 'send', side_effect=ConnectionRefusedError):
+            with pytest.raises(ConnectionRefusedError):
+                tasks.send_daily_appointment_summary_chunk(timezone.localdate().isoformat(), [1])
@@ -0,0 +1,72 @@
+import pytest
+from decimal import Decimal
+from django.core.cache import cache
+from django.test import Client
+from django.urls import reverse
+
+from .factories import UserFactory, UserProfileFactory, OrganizationFactory
+from .tiles import tile_bounds, get_tile, is_valid_tile
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_tile_bounds_world():
+    south, west, north, east = tile_bounds(0, 0, 0)
+    assert west == -180.0
+    assert east == 180.0
+    assert north == pytest.approx(85.0511, abs=1e-4)
+    assert south == pytest.approx(-85.0511, abs=1e-4)
+
+
+def test_is_valid_tile():
+    assert is_valid_tile(2, 3, 3)
+    assert not is_valid_tile(2, 4, 0)
+    assert not is_valid_tile(-1, 0, 0)
+    assert not is_valid_tile(30, 0, 0)
+
+
+@pytest.mark.django_db
+class TestMapTiles:
+    """Test per-tile map features"""
+
+    def make_clinic(self, lat, lng):
+        org = OrganizationFactory(latitude=Decimal(lat), longitude=Decimal(lng))
+        doctor = UserProfileFactory(user=UserFactory(), role='doctor', organization=org)
+        return org, doctor
+
+    def test_tile_contains_only_its_features(self):
+        # New York is in the north-west quadrant at z=1, Sydney in the south-east one
+        nyc, nyc_doctor = self.make_clinic('40.7128', '-74.0060')
+        sydney, _ = self.make_clinic('-33.8688', '151.2093')
+
+        tile = get_tile(1, 0, 0)
+        org_ids = [row[0] for row in tile['organizations']]
+        assert org_ids == [nyc.id]
+        assert [row[0] for row in tile['doctors']] == [nyc_doctor.user.id]
+        assert tile['doctors'][0][1] == nyc.id
+
+        assert [row[0] for row in get_tile(1, 1, 1)['organizations']] == [sydney.id]
+        assert get_tile(1, 1, 0)['organizations'] == []
+
+    def test_tile_is_invalidated_on_organization_change(self):
+        nyc, _ = self.make_clinic('40.7128', '-74.0060')
+        assert len(get_tile(1, 0, 0)['organizations']) == 1
+
+        other = OrganizationFactory(latitude=Decimal('34.0522'), longitude=Decimal('-118.2437'))
+        assert {row[0] for row in get_tile(1, 0, 0)['organizations']} == {nyc.id, other.id}
+
+    def test_tile_endpoint(self):
+        self.make_clinic('40.7128', '-74.0060')
+        client = Client()
+        response = client.get(reverse('appointments:api_map_tile', args=[1, 0, 0]))
+        assert response.status_code == 200
+        assert len(response.json()['organizations']) == 1
+        assert 'max-age=60' in response['Cache-Control']
+
+        response = client.get(reverse('appointments:api_map_tile', args=[1, 5, 0]))
+        assert response.status_code == 400
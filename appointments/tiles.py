@@ -0,0 +1,144 @@
+import math
+import logging
+from django.core.cache import cache
+
+from .models import Organization, UserProfile
+
+logger = logging.getLogger(__name__)
+
+MIN_TILE_ZOOM = 0
+MAX_TILE_ZOOM = 18
+TILE_CACHE_TIMEOUT = 60 * 60  # 1 hour; entries are also invalidated on org/profile changes
+TILE_VERSION_KEY = 'map_tiles_version'
+
+# Column order of the compact per-tile payload. Rows are sent as arrays so
+# repeated keys are not serialized once per feature.
+ORGANIZATION_FIELDS = ['id', 'name', 'type', 'address', 'phone', 'email', 'latitude', 'longitude', 'is_24_hours']
+DOCTOR_FIELDS = ['id', 'organization_id', 'name', 'specialization', 'phone', 'email', 'on_duty']
+
+
+def is_valid_tile(z, x, y):
+    """
+    Check that z/x/y address an existing Web Mercator tile
+    """
+    if z < MIN_TILE_ZOOM or z > MAX_TILE_ZOOM:
+        return False
+    size = 2 ** z
+    return 0 <= x < size and 0 <= y < size
+
+
+def tile_bounds(z, x, y):
+    """
+    Return (south, west, north, east) in degrees for a Web Mercator tile
+    """
+    size = 2 ** z
+    west = x / size * 360.0 - 180.0
+    east = (x + 1) / size * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / size))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / size))))
+    return south, west, north, east
+
+
+def get_tile_version():
+    """
+    Current generation of the tile cache; bumped whenever map data changes
+    """
+    return cache.get_or_set(TILE_VERSION_KEY, 0, None)
+
+
+def invalidate_tiles():
+    """
+    Invalidate every cached tile by bumping the cache generation
+    """
+    try:
+        cache.incr(TILE_VERSION_KEY)
+    except ValueError:
+        cache.set(TILE_VERSION_KEY, 1, None)
+
+
+def build_tile(z, x, y):
+    """
+    Build the compact payload for a single tile from the database
+    """
+    south, west, north, east = tile_bounds(z, x, y)
+
+    last = 2 ** z - 1
+
+    # Half-open ranges so a location on a tile edge belongs to exactly one tile;
+    # the outermost tiles also pick up anything beyond the Mercator limits.
+    bounds = {'latitude__isnull': False, 'longitude__isnull': False}
+    if y > 0:
+        bounds['latitude__lt'] = north
+    if y < last:
+        bounds['latitude__gte'] = south
+    if x > 0:
+        bounds['longitude__gte'] = west
+    if x < last:
+        bounds['longitude__lt'] = east
+
+    organizations = Organization.objects.filter(**bounds).exclude(latitude=0, longitude=0).only(
+        'id', 'name', 'org_type', 'address', 'phone', 'email', 'latitude', 'longitude', 'is_24_hours'
+    ).order_by('id')
+
+    org_rows = [
+        [
+            org.id,
+            org.name,
+            org.get_org_type_display(),
+            org.address or '',
+            org.phone or '',
+            org.email or '',
+            float(org.latitude),
+            float(org.longitude),
+            org.is_24_hours,
+        ]
+        for org in organizations
+    ]
+    org_ids = [row[0] for row in org_rows]
+
+    doctor_rows = []
+    if org_ids:
+        doctors = UserProfile.objects.filter(
+            role='doctor',
+            organization_id__in=org_ids
+        ).select_related('user').only(
+            'organization', 'specialization', 'phone', 'on_duty',
+            'user__first_name', 'user__last_name', 'user__email'
+        ).order_by('user_id')
+        doctor_rows = [
+            [
+                doctor.user.id,
+                doctor.organization_id,
+                f"Dr. {doctor.user.get_full_name()}",
+                doctor.specialization or 'General Medicine',
+                doctor.phone or '',
+                doctor.user.email,
+                doctor.on_duty,
+            ]
+            for doctor in doctors
+        ]
+
+    return {
+        'z': z,
+        'x': x,
+        'y': y,
+        'organization_fields': ORGANIZATION_FIELDS,
+        'organizations': org_rows,
+        'doctor_fields': DOCTOR_FIELDS,
+        'doctors': doctor_rows,
+    }
+
+
+def get_tile(z, x, y):
+    """
+    Return the payload for a tile, served from cache when possible
+    """
+    version = get_tile_version()
+    cache_key = f"map_tile_{version}_{z}_{x}_{y}"
+    tile = cache.get(cache_key)
+    if tile is None:
+        tile = build_tile(z, x, y)
+        tile['version'] = version
+        cache.set(cache_key, tile, TILE_CACHE_TIMEOUT)
+        logger.debug(f"Built map tile {z}/{x}/{y} (version {version})")
+    return tile
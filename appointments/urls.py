@@ -49,12 +49,16 @@ urlpatterns = [
     path('api/send-notification/', views.send_notification_api, name='send_notification_api'),
     path('api/mark-notification-read/<int:notification_id>/', views.mark_notification_read, name='mark_notification_read'),
     path('api/unread-notifications-count/', views.get_unread_notifications_count, name='unread_notifications_count'),
+    path('api/notifications/', views.api_notifications, name='api_notifications'),
+    path('api/notifications/mark-all-read/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('api/chat/<str:room_name>/messages/', views.api_chat_history, name='api_chat_history'),
     path('manage-analytics/', views.admin_analytics, name='admin_analytics'),
     path('export-appointments/', views.export_appointments, name='export_appointments'),
     path('export-users/', views.export_users, name='export_users'),
     path('import-patients/', views.import_patients, name='import_patients'),
     path('manage-roles/', views.manage_roles, name='manage_roles'),
     path('audit-logs/', views.audit_logs, name='audit_logs'),
+    path('api/audit-logs/', views.api_audit_logs, name='api_audit_logs'),
     
     # Enhanced import/export functionality
     path('export/appointments/enhanced/', views.export_appointments_enhanced, name='export_appointments_enhanced'),
@@ -73,6 +77,7 @@ urlpatterns = [
     path('maps/', views.maps_view, name='maps'),
     path('organization/<int:org_id>/map/', views.organization_detail_map, name='organization_map'),
     path('api/locations/', views.api_locations, name='api_locations'),
+    path('api/tiles/<int:z>/<int:x>/<int:y>/', views.api_map_tile, name='api_map_tile'),
     
     # Enhanced doctors map features
     path('doctors-map/', views.doctors_map, name='doctors_map'),
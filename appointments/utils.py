@@ -2,71 +2,133 @@ import os
 import logging
 from django.conf import settings
 import json
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
 from django.utils import timezone
-from notifications.signals import notify
 from .models import ChatMessage, ChatRoom
+from . import chat_summary, eventlog
+from .realtime import publish_many_sync, user_group, org_group, receptionist_group, chat_group, queue_group
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 # Twilio SMS logic removed. Use notifications for all alerts.
 
-def send_notification(user_id, notification_type, title, message, data=None):
+def notification_messages(notifications):
     """
-    Send a notification to a specific user via WebSocket and django-notifications-hq
+    Store notifications for many recipients at once and return the
+    (group, message) pairs to push. Each entry is a dict with user_id,
+    notification_type, title, message and optional data and actor_id. Users are resolved
+    in one query and the rows written with one bulk INSERT.
+    """
+    from notifications.models import Notification
+    from django.contrib.contenttypes.models import ContentType
+    from . import notification_counts
+
+    users = User.objects.in_bulk({entry['user_id'] for entry in notifications})
+    missing = {entry['user_id'] for entry in notifications} - set(users)
+    if missing:
+        logger.error(f"Users {sorted(missing)} not found for notification")
+
+    # django-notifications requires an actor; system notifications without
+    # an actor_id use the recipient
+    user_type = ContentType.objects.get_for_model(User)
+    now = timezone.now()
+    rows = []
+    messages = []
+    for entry in notifications:
+        if entry['user_id'] not in users:
+            continue
+        data = entry.get('data') or {}
+        rows.append(Notification(
+            recipient_id=entry['user_id'],
+            actor_content_type=user_type,
+            actor_object_id=entry.get('actor_id') or entry['user_id'],
+            verb=entry['notification_type'],
+            description=entry['title'],
+            data={'message': entry['message'], **data},
+            timestamp=now,
+        ))
+        messages.append((
+            user_group(entry['user_id']),
+            {
+                'type': 'notification_message',
+                'notification_type': entry['notification_type'],
+                'message': entry['message'],
+                'data': data,
+                'timestamp': now.isoformat(),
+            }
+        ))
+    if rows:
+        Notification.objects.bulk_create(rows, batch_size=500)
+        notification_counts.increment([row.recipient_id for row in rows])
+    return messages
+
+def send_notifications(notifications):
+    """
+    Bulk counterpart of send_notification: one user query, one INSERT and
+    one channel-layer round for all recipients. Returns the number sent.
     """
     try:
-        user = User.objects.get(id=user_id)
-        notify.send(
-            sender=None,
-            recipient=user,
-            verb=notification_type,
-            description=title,
-            data={'message': message, **(data or {})}
-        )
-        # Send via WebSocket
-        try:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f'notifications_{user_id}',
-                {
-                    'type': 'notification_message',
-                    'notification_type': notification_type,
-                    'message': message,
-                    'data': data or {},
-                    'timestamp': timezone.now().isoformat(),
-                }
-            )
-            logger.info(f"Notification sent to user {user_id}: {title}")
-        except Exception as e:
-            logger.error(f"WebSocket notification failed for user {user_id}: {e}")
-        return True
-    except User.DoesNotExist:
-        logger.error(f"User {user_id} not found for notification")
-        return False
+        messages = notification_messages(notifications)
     except Exception as e:
         logger.error(f"Notification creation failed: {e}")
-        return False
+        return 0
+    try:
+        publish_many_sync(messages)
+        logger.info(f"{len(messages)} notifications sent")
+    except Exception as e:
+        logger.error(f"WebSocket delivery of {len(messages)} notifications failed: {e}")
+    return len(messages)
+
+def send_notification(user_id, notification_type, title, message, data=None):
+    """
+    Send a notification to a specific user via WebSocket and django-notifications-hq
+    """
+    return send_notifications([{
+        'user_id': user_id,
+        'notification_type': notification_type,
+        'title': title,
+        'message': message,
+        'data': data
+    }]) == 1
+
+def appointment_update_message(organization_id, appointment_id, status, patient_status=None):
+    """
+    Build the (group, message) pair for an org-wide appointment update
+    """
+    return (
+        org_group(organization_id),
+        {
+            'type': 'appointment_update',
+            'appointment_id': appointment_id,
+            'status': status,
+            'patient_status': patient_status,
+            'timestamp': timezone.now().isoformat(),
+        }
+    )
+
+def queue_update_messages(appointment_id, doctor_id, patient_id, status, patient_status=None):
+    """
+    Build the (group, message) pairs telling the doctor and the patient that
+    one of their appointments moved in the queue
+    """
+    message = {
+        'type': 'queue_update',
+        'appointment_id': appointment_id,
+        'status': status,
+        'patient_status': patient_status,
+        'timestamp': timezone.now().isoformat(),
+    }
+    return [(queue_group(user_id), message) for user_id in (doctor_id, patient_id) if user_id]
 
 def send_appointment_update(organization_id, appointment_id, status, patient_status=None):
     """
     Send appointment update to all users in an organization with error handling
     """
     try:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'appointments_org_{organization_id}',
-            {
-                'type': 'appointment_update',
-                'appointment_id': appointment_id,
-                'status': status,
-                'patient_status': patient_status,
-                'timestamp': timezone.now().isoformat(),
-            }
-        )
+        group, message = appointment_update_message(organization_id, appointment_id, status, patient_status)
+        eventlog.record([(organization_id, message)])
+        publish_many_sync([(group, message)])
         logger.info(f"Appointment update sent for org {organization_id}, appointment {appointment_id}")
     except Exception as e:
         logger.error(f"Appointment update WebSocket failed: {e}")
@@ -80,17 +142,17 @@ def send_chat_message(room_name, user_id, username, message):
         return False
     
     try:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'chat_{room_name}',
+        publish_many_sync([(
+            chat_group(room_name),
             {
                 'type': 'chat_message',
+                'room': room_name,
                 'message': message.strip(),
                 'user_id': user_id,
                 'username': username,
                 'timestamp': timezone.now().isoformat(),
             }
-        )
+        )])
         logger.info(f"Chat message sent to room {room_name} by {username}")
         return True
     except Exception as e:
@@ -107,12 +169,13 @@ def create_or_get_chat_room(participants):
     
     try:
         # Sort participant IDs for consistent room naming
-        participant_ids = sorted([p.id if hasattr(p, 'id') else p for p in participants])
+        participant_ids = sorted({p.id if hasattr(p, 'id') else p for p in participants})
         room_name = f"room_{'_'.join(map(str, participant_ids))}"
 
+        # The participant set, not the name, identifies the room (unique index)
         room, created = ChatRoom.objects.get_or_create(
-            name=room_name,
-            defaults={'is_active': True}
+            participant_key=chat_summary.participant_key(participant_ids),
+            defaults={'name': room_name, 'is_active': True}
         )
 
         if created:
@@ -138,6 +201,7 @@ def save_chat_message(room, sender, message):
             sender=sender,
             message=message.strip()
         )
+        chat_summary.record_messages([chat_message])
         logger.info(f"Chat message saved: {chat_message.id}")
         return chat_message
     except Exception as e:
@@ -146,13 +210,14 @@ def save_chat_message(room, sender, message):
 
 def log_audit_event(user, action, details='', object_type=None, object_id=None, ip_address=None, user_agent=None, level='info'):
     """
-    Log audit events with enhanced tracking
+    Log audit events with enhanced tracking. The row is buffered and written
+    in bulk after commit (see audit.py).
     """
     try:
-        from .models import AuditLog
-        AuditLog.objects.create(
+        from . import audit
+        audit.record(
+            action,
             user=user,
-            action=action,
             details=details,
             object_type=object_type,
             object_id=object_id,
@@ -224,48 +289,51 @@ def get_user_display_name(user):
         return full_name if full_name else user.username
     return "Anonymous" 
 
+def appointment_broadcast_messages(appointment_id, doctor_id, patient_id, organization_id, event_type='update'):
+    """
+    Build the (group, message) pairs notifying the doctor, the patient and the
+    organization's receptionists about an appointment event
+    """
+    timestamp = timezone.now().isoformat()
+    data = {'appointment_id': appointment_id, 'event_type': event_type}
+
+    def message(text):
+        return {
+            'type': 'notification_message',
+            'notification_type': 'appointment_update',
+            'message': text,
+            'data': data,
+            'timestamp': timestamp,
+        }
+
+    messages = []
+    # Doctor
+    if doctor_id:
+        messages.append((user_group(doctor_id), message(f'Appointment {event_type} for you.')))
+    # Patient
+    if patient_id:
+        messages.append((user_group(patient_id), message(f'Appointment {event_type} for you.')))
+    # Receptionists in the org, reached through one org-level group
+    if organization_id:
+        messages.append((
+            receptionist_group(organization_id),
+            message(f'Appointment {event_type} in your organization.')
+        ))
+    return messages
+
 def broadcast_appointment_ws_update(appointment, event_type='update'):
     """
     Broadcast appointment update to doctor, patient, and all receptionists in the organization via WebSocket.
     event_type: 'update', 'booked', 'cancelled', etc.
     """
-    from .models import UserProfile
-    channel_layer = get_channel_layer()
-    # Doctor
-    if appointment.doctor:
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{appointment.doctor.id}',
-            {
-                'type': 'notification_message',
-                'notification_type': 'appointment_update',
-                'message': f'Appointment {event_type} for you.',
-                'data': {'appointment_id': appointment.id, 'event_type': event_type},
-                'timestamp': timezone.now().isoformat(),
-            }
-        )
-    # Patient
-    if appointment.patient:
-        async_to_sync(channel_layer.group_send)(
-            f'notifications_{appointment.patient.id}',
-            {
-                'type': 'notification_message',
-                'notification_type': 'appointment_update',
-                'message': f'Appointment {event_type} for you.',
-                'data': {'appointment_id': appointment.id, 'event_type': event_type},
-                'timestamp': timezone.now().isoformat(),
-            }
-        )
-    # Receptionists in the org
-    if appointment.organization:
-        receptionists = UserProfile.objects.filter(organization=appointment.organization, role='receptionist')
-        for rec in receptionists:
-            async_to_sync(channel_layer.group_send)(
-                f'notifications_{rec.user.id}',
-                {
-                    'type': 'notification_message',
-                    'notification_type': 'appointment_update',
-                    'message': f'Appointment {event_type} in your organization.',
-                    'data': {'appointment_id': appointment.id, 'event_type': event_type},
-                    'timestamp': timezone.now().isoformat(),
-                }
-            ) 
\ No newline at end of file
+    messages = appointment_broadcast_messages(
+        appointment.id,
+        appointment.doctor_id,
+        appointment.patient_id,
+        appointment.organization_id,
+        event_type
+    )
+    try:
+        publish_many_sync(messages)
+    except Exception as e:
+        logger.error(f"Appointment broadcast WebSocket failed: {e}")
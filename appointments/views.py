@@ -27,20 +27,20 @@ from google.oauth2.credentials import Credentials
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Count, Q
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.decorators import user_passes_test
 from django.utils.html import escape
-from notifications.signals import notify
 
 from .models import (
-    Appointment, Organization, ChatRoom, ChatMessage, UserProfile, AuditLog, 
+    Appointment, Organization, ChatRoom, UserProfile, AuditLog, 
     DoctorOrganizationJoinRequest, MedicalRecord, Prescription, Insurance, 
-    Payment, EmergencyContact, MedicationReminder, TelemedicineSession
+    Payment, EmergencyContact, MedicationReminder, TelemedicineSession, ChatRoomSummary
 )
 from .forms import (
     AppointmentForm, MinimalPatientCreationForm, DoctorDutyForm, OrganizationForm, 
@@ -48,7 +48,14 @@ from .forms import (
     AppointmentImportForm, PatientImportForm, MedicalRecordForm, PrescriptionForm,
     InsuranceForm, PaymentForm, EmergencyContactForm, MedicationReminderForm, TelemedicineSessionForm
 )
-from .utils import send_notification, send_appointment_update, create_or_get_chat_room, save_chat_message, broadcast_appointment_ws_update
+from .utils import send_notifications, create_or_get_chat_room, save_chat_message
+from .tiles import get_tile, is_valid_tile
+from . import audit, audit_browser, chat_history, inbox, notification_counts
+from .notification_counts import get_unread_count
+from .events import (
+    dispatch_notification, dispatch_appointment_update, dispatch_appointment_broadcast,
+    dispatch_appointment_audit, dispatch_appointment_email
+)
 
 User = get_user_model()
 
@@ -188,7 +195,7 @@ def dashboard(request):
     # Get unread notifications count
     if request.user.is_authenticated:
         try:
-            unread_notifications = request.user.notifications.unread().count()
+            unread_notifications = get_unread_count(request.user)
         except Exception:
             unread_notifications = 0
 
@@ -207,12 +214,12 @@ def dashboard(request):
                     appt.patient_status = new_status
                     appt.save()
                     # Send notification to patient
-                    send_notification(
-                        appt.patient,
-                        title='Appointment Status Updated',
-                        message=f'Your appointment status is now: {appt.get_patient_status_display()}',
-                        notification_type='appointment_update',
-                        data={'appointment_id': appt.id}
+                    dispatch_notification(
+                        appt.patient_id,
+                        'appointment_update',
+                        'Appointment Status Updated',
+                        f'Your appointment status is now: {appt.get_patient_status_display()}',
+                        {'appointment_id': appt.id}
                     )
                     messages.success(request, 'Patient status updated.')
             except Appointment.DoesNotExist:
@@ -398,6 +405,7 @@ def doctor_detail(request, doctor_id):
     }
     return render(request, 'appointments/doctor_detail.html', context)
 
+@transaction.atomic
 def schedule_appointment(request):
     """Schedule a new appointment"""
     from django.contrib.auth.models import User
@@ -426,7 +434,7 @@ def schedule_appointment(request):
                 appointment.organization = selected_org
             appointment.save()
             # Send notification to doctor
-            send_notification(
+            dispatch_notification(
                 appointment.doctor.id,
                 'appointment_update',
                 'New Appointment Request',
@@ -434,15 +442,14 @@ def schedule_appointment(request):
                 {'appointment_id': appointment.id}
             )
             # Log audit event for appointment creation
-            from .utils import log_appointment_audit, broadcast_appointment_ws_update
-            log_appointment_audit(
+            dispatch_appointment_audit(
                 request=request,
                 action='appointment_created',
                 appointment=appointment,
                 details=f'Appointment created by {request.user.get_full_name()} with Dr. {appointment.doctor.get_full_name()} for {appointment.appointment_date.strftime("%Y-%m-%d %H:%M")}'
             )
             # WebSocket broadcast
-            broadcast_appointment_ws_update(appointment, event_type='booked')
+            dispatch_appointment_broadcast(appointment, event_type='booked')
             messages.success(request, 'Appointment scheduled successfully!')
             return redirect('appointments:patient_dashboard')
     else:
@@ -457,6 +464,7 @@ def schedule_appointment(request):
         'selected_org': selected_org,
     })
 
+@transaction.atomic
 def reschedule_appointment(request, appointment_id):
     """Reschedule an existing appointment with enhanced functionality"""
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -478,13 +486,18 @@ def reschedule_appointment(request, appointment_id):
         return redirect('appointments:patient_dashboard')
     
     if request.method == 'POST':
+        # Read before validation, which copies the submitted values onto the instance
+        old_date = appointment.appointment_date
         form = AppointmentForm(request.POST, instance=appointment)
         if form.is_valid():
-            old_date = appointment.appointment_date
+            if appointment.appointment_date != old_date:
+                # The reminder went out for the old time; send one for the new time
+                appointment.reminder_sent_at = None
+                appointment.reminder_attempts = 0
             appointment = form.save()
             
             # Send notification to doctor about reschedule
-            send_notification(
+            dispatch_notification(
                 appointment.doctor.id,
                 'appointment_update',
                 'Appointment Rescheduled',
@@ -499,8 +512,7 @@ def reschedule_appointment(request, appointment_id):
             cache.delete(cache_key_api)
             
             # Log the reschedule action
-            from .utils import log_appointment_audit
-            log_appointment_audit(
+            dispatch_appointment_audit(
                 request=request,
                 action='appointment_updated',
                 appointment=appointment,
@@ -508,8 +520,7 @@ def reschedule_appointment(request, appointment_id):
             )
             
             # WebSocket broadcast
-            from .utils import broadcast_appointment_ws_update
-            broadcast_appointment_ws_update(appointment, event_type='rescheduled')
+            dispatch_appointment_broadcast(appointment, event_type='rescheduled')
             
             messages.success(request, 'Appointment rescheduled successfully!')
             return redirect('appointments:patient_dashboard')
@@ -522,6 +533,7 @@ def reschedule_appointment(request, appointment_id):
     })
 
 @login_required
+@transaction.atomic
 def cancel_appointment(request, appointment_id):
     """Cancel an appointment with proper validation and notifications"""
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -557,7 +569,7 @@ def cancel_appointment(request, appointment_id):
         # Send notifications
         if request.user.profile.role == 'patient':
             # Notify doctor
-            send_notification(
+            dispatch_notification(
                 appointment.doctor.id,
                 'appointment_update',
                 'Appointment Cancelled',
@@ -566,7 +578,7 @@ def cancel_appointment(request, appointment_id):
             )
         else:
             # Notify patient
-            send_notification(
+            dispatch_notification(
                 appointment.patient.id,
                 'appointment_update',
                 'Appointment Cancelled',
@@ -581,8 +593,7 @@ def cancel_appointment(request, appointment_id):
         cache.delete(cache_key_api)
         
         # Log the cancellation
-        from .utils import log_appointment_audit
-        log_appointment_audit(
+        dispatch_appointment_audit(
             request=request,
             action='appointment_cancelled',
             appointment=appointment,
@@ -590,8 +601,8 @@ def cancel_appointment(request, appointment_id):
         )
         
         # WebSocket broadcast
-        from .utils import broadcast_appointment_ws_update
-        broadcast_appointment_ws_update(appointment, event_type='cancelled')
+        dispatch_appointment_broadcast(appointment, event_type='cancelled')
+        dispatch_appointment_email(appointment, 'cancellation')
         
         messages.success(request, 'Appointment cancelled successfully!')
         return redirect('appointments:patient_dashboard' if request.user.profile.role == 'patient' else 'appointments:dashboard')
@@ -792,6 +803,7 @@ def calendar_view(request):
         'calendar_data': json.dumps(calendar_data)
     })
 
+@transaction.atomic
 def update_appointment_status(request, appointment_id):
     """Update appointment status (AJAX)"""
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -816,8 +828,7 @@ def update_appointment_status(request, appointment_id):
         appointment.save()
         
         # Log audit event for appointment status update
-        from .utils import log_appointment_audit
-        log_appointment_audit(
+        dispatch_appointment_audit(
             request=request,
             action='appointment_updated',
             appointment=appointment,
@@ -825,17 +836,13 @@ def update_appointment_status(request, appointment_id):
         )
         
         # Send WebSocket notification
-        if appointment.organization:
-            send_appointment_update(
-                appointment.organization.id,
-                appointment.id,
-                appointment.status,
-                appointment.patient_status
-            )
+        dispatch_appointment_update(appointment)
         
         # Send notifications for status changes
+        if status_changed and appointment.status in ('confirmed', 'cancelled'):
+            dispatch_appointment_email(appointment, 'confirmation' if appointment.status == 'confirmed' else 'cancellation')
         if status_changed:
-            send_notification(
+            dispatch_notification(
                 appointment.patient.id,
                 'appointment_update',
                 'Appointment Status Updated',
@@ -845,14 +852,14 @@ def update_appointment_status(request, appointment_id):
         if patient_status_changed:
             # Notify both patient and doctor for workflow changes
             if appointment.patient_status == 'waiting':
-                send_notification(
+                dispatch_notification(
                     appointment.patient.id,
                     'appointment_update',
                     'You are now waiting for your appointment',
                     f'Your appointment is now marked as waiting.',
                     {'appointment_id': appointment.id, 'patient_status': 'waiting'}
                 )
-                send_notification(
+                dispatch_notification(
                     appointment.doctor.id,
                     'appointment_update',
                     'Patient is waiting',
@@ -860,14 +867,14 @@ def update_appointment_status(request, appointment_id):
                     {'appointment_id': appointment.id, 'patient_status': 'waiting'}
                 )
             elif appointment.patient_status == 'in_consultation':
-                send_notification(
+                dispatch_notification(
                     appointment.patient.id,
                     'appointment_update',
                     'You are now in consultation',
                     f'Your appointment is now in consultation.',
                     {'appointment_id': appointment.id, 'patient_status': 'in_consultation'}
                 )
-                send_notification(
+                dispatch_notification(
                     appointment.doctor.id,
                     'appointment_update',
                     'Patient in consultation',
@@ -875,14 +882,14 @@ def update_appointment_status(request, appointment_id):
                     {'appointment_id': appointment.id, 'patient_status': 'in_consultation'}
                 )
             elif appointment.patient_status == 'done':
-                send_notification(
+                dispatch_notification(
                     appointment.patient.id,
                     'appointment_update',
                     'Appointment Completed',
                     f'Your appointment has been marked as done.',
                     {'appointment_id': appointment.id, 'patient_status': 'done'}
                 )
-                send_notification(
+                dispatch_notification(
                     appointment.doctor.id,
                     'appointment_update',
                     'Appointment Completed',
@@ -1110,22 +1117,39 @@ def export_patients(request):
 @login_required
 def notifications_view(request):
     """View for displaying user notifications"""
-    notifications = request.user.notifications.unread() | request.user.notifications.read()
-    notifications = notifications.order_by('-timestamp')
     if request.method == 'POST':
         notification_id = request.POST.get('notification_id')
         if notification_id:
-            try:
-                notification = request.user.notifications.get(id=notification_id)
-                notification.mark_as_read()
+            if notification_counts.mark_read(request.user, notification_id):
                 return JsonResponse({'success': True})
-            except Exception:
-                return JsonResponse({'success': False, 'error': 'Notification not found'})
+            return JsonResponse({'success': False, 'error': 'Notification not found'})
+    notifications, next_cursor = inbox.get_page(request.user)
     return render(request, 'appointments/notifications.html', {
         'notifications': notifications,
-        'unread_count': request.user.notifications.unread().count()
+        'next_cursor': next_cursor,
+        'unread_count': get_unread_count(request.user)
+    })
+
+@login_required
+def api_notifications(request):
+    """Next page of the notification inbox for infinite scroll"""
+    try:
+        limit = int(request.GET.get('limit', inbox.PAGE_SIZE))
+    except ValueError:
+        limit = inbox.PAGE_SIZE
+    notifications, next_cursor = inbox.get_page(request.user, request.GET.get('cursor'), limit)
+    return JsonResponse({
+        'notifications': [inbox.serialize(notification) for notification in notifications],
+        'next_cursor': next_cursor
     })
 
+@login_required
+@require_http_methods(["POST"])
+def mark_all_notifications_read(request):
+    """Mark every unread notification read with a single UPDATE"""
+    updated = notification_counts.mark_all_read(request.user)
+    return JsonResponse({'success': True, 'updated': updated})
+
 @login_required
 def chat_view(request, room_name=None):
     """View for chat functionality"""
@@ -1135,7 +1159,6 @@ def chat_view(request, room_name=None):
         room_name = room.name
     
     room = get_object_or_404(ChatRoom, name=room_name)
-    messages = ChatMessage.objects.filter(room=room).order_by('created_at')
     
     if request.method == 'POST':
         message_text = request.POST.get('message')
@@ -1146,16 +1169,36 @@ def chat_view(request, room_name=None):
             send_chat_message(room_name, request.user.id, request.user.get_full_name(), message_text)
             return JsonResponse({'success': True})
     
+    # Only the latest page; older messages load as the user scrolls up
+    messages, older_cursor = chat_history.get_page(room)
     return render(request, 'appointments/chat.html', {
         'room': room,
         'messages': messages,
+        'older_cursor': older_cursor,
         'room_name': room_name
     })
 
+@login_required
+def api_chat_history(request, room_name):
+    """Older chat messages of a room, one keyset page at a time"""
+    room = get_object_or_404(ChatRoom, name=room_name, participants=request.user)
+    try:
+        limit = int(request.GET.get('limit', chat_history.PAGE_SIZE))
+    except ValueError:
+        limit = chat_history.PAGE_SIZE
+    messages, older_cursor = chat_history.get_page(room, request.GET.get('before'), limit)
+    return JsonResponse({
+        'messages': [chat_history.serialize(message) for message in messages],
+        'next_cursor': older_cursor
+    })
+
 @login_required
 def chat_rooms_view(request):
     """View for listing available chat rooms"""
-    user_rooms = ChatRoom.objects.filter(participants=request.user, is_active=True)
+    # One query: the per-user summary carries the room, its last message and the unread count
+    room_summaries = ChatRoomSummary.objects.filter(
+        user=request.user, room__is_active=True
+    ).select_related('room').order_by(F('room__last_message_at').desc(nulls_last=True), '-room__created_at')
     
     if request.method == 'POST':
         room_name = request.POST.get('room_name')
@@ -1170,16 +1213,17 @@ def chat_rooms_view(request):
     if hasattr(request.user, 'profile') and request.user.profile.organization:
         available_users = User.objects.filter(
             profile__organization=request.user.profile.organization
-        ).exclude(id=request.user.id)
+        ).exclude(id=request.user.id).select_related('profile')
     else:
-        available_users = User.objects.exclude(id=request.user.id)
+        available_users = User.objects.exclude(id=request.user.id).select_related('profile')
     
     return render(request, 'appointments/chat_rooms.html', {
-        'user_rooms': user_rooms,
+        'room_summaries': room_summaries,
         'available_users': available_users
     })
 
 @login_required
+@transaction.atomic
 def update_appointment_status_websocket(request, appointment_id):
     """Update appointment status with WebSocket notification"""
     if request.method == 'POST':
@@ -1195,16 +1239,10 @@ def update_appointment_status_websocket(request, appointment_id):
         appointment.save()
         
         # Send WebSocket notification
-        if appointment.organization:
-            send_appointment_update(
-                appointment.organization.id,
-                appointment.id,
-                appointment.status,
-                appointment.patient_status
-            )
+        dispatch_appointment_update(appointment)
         
         # Send notification to patient
-        send_notification(
+        dispatch_notification(
             appointment.patient.id,
             'appointment_update',
             'Appointment Status Updated',
@@ -1220,40 +1258,57 @@ def update_appointment_status_websocket(request, appointment_id):
     
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
+def can_notify(user, recipient_ids):
+    """Staff may notify anyone; other users only members of their own organization"""
+    if user.is_staff:
+        return True
+    organization_id = UserProfile.objects.filter(user=user).values_list('organization_id', flat=True).first()
+    if not organization_id:
+        return False
+    members = UserProfile.objects.filter(organization_id=organization_id, user_id__in=recipient_ids).count()
+    return members == len(recipient_ids)
+
 @login_required
 def send_notification_api(request):
     """API endpoint for sending notifications"""
     if request.method == 'POST':
         data = json.loads(request.body)
-        recipient_id = data.get('recipient_id')
+        try:
+            recipient_ids = list(dict.fromkeys(int(r) for r in data.get('recipient_ids') or [data.get('recipient_id')]))
+        except (TypeError, ValueError):
+            recipient_ids = []
+        if len(recipient_ids) > settings.NOTIFICATION_API_MAX_RECIPIENTS:
+            return JsonResponse({'success': False, 'error': 'Too many recipients'}, status=400)
+        if recipient_ids and not can_notify(request.user, recipient_ids):
+            return JsonResponse({'success': False, 'error': 'Access denied'}, status=403)
         notification_type = data.get('notification_type')
         title = data.get('title')
         message = data.get('message')
-        if recipient_id and notification_type and title and message:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            try:
-                recipient = User.objects.get(id=recipient_id)
-                notify.send(request.user, recipient=recipient, verb=notification_type, description=title, data={'message': message, **(data.get('data') or {})})
-                return JsonResponse({'success': True})
-            except User.DoesNotExist:
-                return JsonResponse({'success': False, 'error': 'User not found'})
+        if recipient_ids and notification_type and title and message:
+            sent = send_notifications([{
+                'user_id': recipient_id,
+                'actor_id': request.user.id,
+                'notification_type': notification_type,
+                'title': title,
+                'message': message,
+                'data': data.get('data')
+            } for recipient_id in recipient_ids])
+            if sent:
+                return JsonResponse({'success': True, 'sent': sent})
+            return JsonResponse({'success': False, 'error': 'User not found'})
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
 @login_required
 def mark_notification_read(request, notification_id):
     """Mark a notification as read"""
-    try:
-        notification = request.user.notifications.get(id=notification_id)
-        notification.mark_as_read()
+    if notification_counts.mark_read(request.user, notification_id):
         return JsonResponse({'success': True})
-    except Exception:
-        return JsonResponse({'success': False, 'error': 'Notification not found'})
+    return JsonResponse({'success': False, 'error': 'Notification not found'})
 
 @login_required
 def get_unread_notifications_count(request):
     """Get count of unread notifications"""
-    count = request.user.notifications.unread().count()
+    count = get_unread_count(request.user)
     return JsonResponse({'count': count})
 
 @login_required
@@ -1461,12 +1516,35 @@ def manage_roles(request):
     return render(request, 'appointments/manage_roles.html', {'users': users, 'roles': ['doctor', 'patient', 'receptionist']})
 
 def log_audit(user, action, details=''):
-    AuditLog.objects.create(user=user if user.is_authenticated else None, action=action, details=details)
+    audit.record(action, user=user, details=details)
 
 @staff_member_required
 def audit_logs(request):
-    logs = AuditLog.objects.select_related('user').order_by('-timestamp')[:200]
-    return render(request, 'appointments/audit_logs.html', {'logs': logs})
+    filters = audit_browser.parse_filters(request.GET)
+    logs, next_cursor = audit_browser.get_page(filters, request.GET.get('cursor'))
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    return render(request, 'appointments/audit_logs.html', {
+        'logs': logs,
+        'next_cursor': next_cursor,
+        'filters': request.GET,
+        'filter_query': params.urlencode(),
+        'actions': AuditLog.ACTION_CHOICES,
+    })
+
+@staff_member_required
+def api_audit_logs(request):
+    """Filtered, keyset-paginated audit entries"""
+    try:
+        limit = int(request.GET.get('limit', audit_browser.PAGE_SIZE))
+    except ValueError:
+        limit = audit_browser.PAGE_SIZE
+    filters = audit_browser.parse_filters(request.GET)
+    logs, next_cursor = audit_browser.get_page(filters, request.GET.get('cursor'), limit)
+    return JsonResponse({
+        'results': [audit_browser.serialize(log) for log in logs],
+        'next_cursor': next_cursor
+    })
 
 @login_required
 def maps_view(request):
@@ -1643,6 +1721,16 @@ def api_locations(request):
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+def api_map_tile(request, z, x, y):
+    """API endpoint returning compact doctor/clinic features for one map tile"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not is_valid_tile(z, x, y):
+        return JsonResponse({'error': 'Invalid tile'}, status=400)
+    response = JsonResponse(get_tile(z, x, y))
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
 @login_required
 def doctors_map(request):
     """Enhanced interactive doctors map with filtering and search"""
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pulsecal_system.settings')
@@ -15,4 +16,28 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}') 
\ No newline at end of file
+    print(f'Request: {self.request!r}') 
+
+@worker_process_shutdown.connect
+def close_mail_connection(**kwargs):
+    """Close the worker process's pooled SMTP connection"""
+    from appointments.emails import close
+    close()
+
+
+# Audit rows written while a task runs are collected and flushed together
+_audit_scopes = {}
+
+
+@task_prerun.connect
+def start_audit_buffer(task_id=None, **kwargs):
+    from appointments.audit import start_collecting
+    _audit_scopes[task_id] = start_collecting()
+
+
+@task_postrun.connect
+def flush_audit_buffer(task_id=None, **kwargs):
+    from appointments.audit import flush, stop_collecting
+    tokens = _audit_scopes.pop(task_id, None)
+    if tokens:
+        flush(stop_collecting(tokens))
@@ -76,6 +76,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'appointments.events.EventDispatchMiddleware',
+    'appointments.audit.AuditLogMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'axes.middleware.AxesMiddleware',
 ]
@@ -247,6 +249,14 @@ EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True').lower() == 'true'
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@pulsecal.com')
+EMAIL_TIMEOUT = int(os.environ.get('EMAIL_TIMEOUT', 30))  # seconds, for the pooled SMTP connection
+# Outbox for task mail (see appointments/mail_outbox.py)
+# 'sync' sends queued mail in-process after commit; 'celery' leaves it to the email workers
+EMAIL_OUTBOX_DELIVERY = os.environ.get('EMAIL_OUTBOX_DELIVERY', 'celery' if IS_PRODUCTION else 'sync')
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 100))
+EMAIL_OUTBOX_MAX_BATCHES = int(os.environ.get('EMAIL_OUTBOX_MAX_BATCHES', 20))  # per flush
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_FLUSH_DELAY = int(os.environ.get('EMAIL_OUTBOX_FLUSH_DELAY', 2))  # seconds mail may wait for company
 
 # Google OAuth Settings
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', '')
@@ -257,6 +267,52 @@ GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', 'http://localhost:80
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
 GOOGLE_PLACES_API_KEY = os.environ.get('GOOGLE_PLACES_API_KEY', '')
 
+# Geocoding (see appointments/geocoding.py)
+GEOCODING_PROVIDER = os.environ.get(
+    'GEOCODING_PROVIDER',
+    'appointments.geocoding.StubGeocodingProvider' if TESTING else 'appointments.geocoding.GoogleGeocodingProvider'
+)
+GEOCODING_RATE_LIMIT = float(os.environ.get('GEOCODING_RATE_LIMIT', 10))  # provider requests per second
+
+# WebSocket delivery: updates for the same group are coalesced into one frame
+# per window, and each connection is rate limited in both directions
+WEBSOCKET_COALESCE_WINDOW = float(os.environ.get('WEBSOCKET_COALESCE_WINDOW', 0.15))  # seconds
+WEBSOCKET_SEND_RATE = float(os.environ.get('WEBSOCKET_SEND_RATE', 10))  # frames per second
+WEBSOCKET_SEND_BURST = int(os.environ.get('WEBSOCKET_SEND_BURST', 20))
+WEBSOCKET_MAX_PENDING = int(os.environ.get('WEBSOCKET_MAX_PENDING', 500))  # buffered updates before resync
+WEBSOCKET_RECEIVE_RATE = float(os.environ.get('WEBSOCKET_RECEIVE_RATE', 5))  # client frames per second
+WEBSOCKET_RECEIVE_BURST = int(os.environ.get('WEBSOCKET_RECEIVE_BURST', 20))
+CHAT_WRITE_BATCH_SIZE = int(os.environ.get('CHAT_WRITE_BATCH_SIZE', 50))  # socket chat messages per INSERT
+CHAT_WRITE_INTERVAL = float(os.environ.get('CHAT_WRITE_INTERVAL', 0.25))  # seconds a message may wait
+CHAT_WRITE_MAX_RETRIES = int(os.environ.get('CHAT_WRITE_MAX_RETRIES', 5))  # failed flushes before a batch is dropped
+EVENT_LOG_SIZE = int(os.environ.get('EVENT_LOG_SIZE', 1000))  # org events kept for reconnecting clients
+EVENT_LOG_REPLAY_LIMIT = int(os.environ.get('EVENT_LOG_REPLAY_LIMIT', 200))  # larger gaps resync instead
+
+# django-notifications: store the data payload passed to notify.send
+DJANGO_NOTIFICATIONS_CONFIG = {'USE_JSONFIELD': True}
+
+# Notification retention in days per notification type (verb); None keeps forever
+NOTIFICATION_RETENTION = {
+    'default': {'read': 30, 'unread': 180},
+    'appointment_reminder': {'read': 7, 'unread': 30},
+    'medication_reminder': {'read': 7, 'unread': 30},
+}
+NOTIFICATION_API_MAX_RECIPIENTS = int(os.environ.get('NOTIFICATION_API_MAX_RECIPIENTS', 100))  # per send-notification request
+NOTIFICATION_CLEANUP_BATCH_SIZE = int(os.environ.get('NOTIFICATION_CLEANUP_BATCH_SIZE', 1000))
+NOTIFICATION_CLEANUP_MAX_BATCHES = int(os.environ.get('NOTIFICATION_CLEANUP_MAX_BATCHES', 50))  # per task run
+NOTIFICATION_CLEANUP_PAUSE = int(os.environ.get('NOTIFICATION_CLEANUP_PAUSE', 60))  # seconds between runs
+
+# Doctors per daily-summary subtask (one query and one SMTP connection each)
+DAILY_SUMMARY_CHUNK_SIZE = int(os.environ.get('DAILY_SUMMARY_CHUNK_SIZE', 200))
+
+# Appointment reminders (see appointments/reminders.py)
+APPOINTMENT_REMINDER_LEAD_HOURS = int(os.environ.get('APPOINTMENT_REMINDER_LEAD_HOURS', 24))
+APPOINTMENT_REMINDER_BATCH_SIZE = int(os.environ.get('APPOINTMENT_REMINDER_BATCH_SIZE', 500))
+APPOINTMENT_REMINDER_MAX_BATCHES = int(os.environ.get('APPOINTMENT_REMINDER_MAX_BATCHES', 20))  # per task run
+APPOINTMENT_REMINDER_MAX_ATTEMPTS = int(os.environ.get('APPOINTMENT_REMINDER_MAX_ATTEMPTS', 3))  # failed sends before giving up
+MEDICATION_REMINDER_BATCH_SIZE = int(os.environ.get('MEDICATION_REMINDER_BATCH_SIZE', 500))
+MEDICATION_REMINDER_MAX_BATCHES = int(os.environ.get('MEDICATION_REMINDER_MAX_BATCHES', 20))  # per task run
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
@@ -265,6 +321,69 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Task lanes, each consumed by its own worker pool (see docker-compose.yml) so
+# a nightly digest or cleanup never sits in front of a booking confirmation:
+#   realtime    - short, latency-sensitive pushes
+#   email       - transactional mail
+#   bulk        - digests and other fan-out jobs
+#   maintenance - periodic housekeeping
+CELERY_TASK_DEFAULT_QUEUE = 'realtime'
+CELERY_TASK_ROUTES = {
+    'appointments.tasks.deliver_events_task': {'queue': 'realtime'},
+    'appointments.tasks.relay_outbox': {'queue': 'realtime'},
+    'appointments.tasks.dispatch_medication_reminders': {'queue': 'realtime'},
+    'appointments.tasks.send_appointment_confirmation': {'queue': 'email'},
+    'appointments.tasks.send_appointment_cancellation': {'queue': 'email'},
+    'appointments.tasks.send_appointment_reminder': {'queue': 'email'},
+    'appointments.tasks.flush_email_outbox': {'queue': 'email'},
+    'appointments.tasks.dispatch_appointment_reminders': {'queue': 'email'},
+    'appointments.tasks.send_daily_appointment_summary': {'queue': 'bulk'},
+    'appointments.tasks.send_daily_appointment_summary_chunk': {'queue': 'bulk'},
+    'appointments.tasks.cleanup_old_notifications': {'queue': 'maintenance'},
+    'appointments.tasks.update_doctor_availability': {'queue': 'maintenance'},
+}
+# Acknowledge after the task finishes, so a lost worker's task is redelivered,
+# and reserve one task at a time so long jobs don't hoard queued work
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1))
+CELERY_TASK_ANNOTATIONS = {
+    'appointments.tasks.flush_email_outbox': {'rate_limit': os.environ.get('EMAIL_FLUSH_RATE_LIMIT', '2/s')},
+    'appointments.tasks.send_daily_appointment_summary_chunk': {'rate_limit': os.environ.get('BULK_RATE_LIMIT', '30/m')},
+}
+CELERY_BEAT_SCHEDULE = {
+    'relay-outbox': {
+        'task': 'appointments.tasks.relay_outbox',
+        'schedule': 10.0,  # catches events whose relay run was never queued
+        'options': {'expires': 9},
+    },
+    'dispatch-appointment-reminders': {
+        'task': 'appointments.tasks.dispatch_appointment_reminders',
+        'schedule': 60.0,
+        'options': {'expires': 55},  # a missed tick is covered by the next one
+    },
+    'flush-email-outbox': {
+        'task': 'appointments.tasks.flush_email_outbox',
+        'schedule': 30.0,  # catches mail whose scheduled flush was lost
+        'options': {'expires': 25},
+    },
+    'dispatch-medication-reminders': {
+        'task': 'appointments.tasks.dispatch_medication_reminders',
+        'schedule': 60.0,
+        'options': {'expires': 55},
+    },
+}
+
+# Delivery of request side effects (see appointments/events.py): 'sync' runs
+# them in-process after the view, 'celery' hands each request's batch to a worker,
+# 'outbox' writes them to the transactional outbox for the relay to deliver
+EVENT_DELIVERY = os.environ.get('EVENT_DELIVERY', 'outbox' if IS_PRODUCTION else 'sync')
+OUTBOX_RELAY_BATCH_SIZE = int(os.environ.get('OUTBOX_RELAY_BATCH_SIZE', 200))
+OUTBOX_RELAY_MAX_BATCHES = int(os.environ.get('OUTBOX_RELAY_MAX_BATCHES', 50))  # per relay run
+OUTBOX_RELAY_DEBOUNCE = int(os.environ.get('OUTBOX_RELAY_DEBOUNCE', 1))  # seconds a relay run stays scheduled
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))  # failed deliveries before an event is dead-lettered
+OUTBOX_RETENTION_HOURS = int(os.environ.get('OUTBOX_RETENTION_HOURS', 24))  # processed events kept for dedup
+
 # Django Axes Configuration
 AXES_ENABLED = True
 AXES_FAILURE_LIMIT = 5
@@ -11,6 +11,10 @@ class PulseCalMaps {
             organizations: [],
             doctors: []
         };
+        // Tiles already merged into mapData, keyed by "z/x/y"
+        this.loadedTiles = new Set();
+        this.organizationsById = new Map();
+        this.doctorsById = new Map();
     }
 
     async init() {
@@ -22,8 +26,8 @@ class PulseCalMaps {
         try {
             await this.loadGoogleMapsAPI();
             this.initMap();
-            await this.loadLocationData();
-            this.addMarkers();
+            // Only fetch the tiles that cover the visible viewport
+            this.map.addListener('idle', () => this.loadVisibleTiles());
         } catch (error) {
             console.error('Error initializing maps:', error);
             this.showError('Failed to load maps');
@@ -90,30 +94,112 @@ class PulseCalMaps {
         });
     }
 
-    async loadLocationData() {
+    tileZoom() {
+        // Clamp so a world view doesn't request thousands of tiles and street level
+        // doesn't fragment a single clinic block over many requests
+        return Math.max(3, Math.min(14, Math.floor(this.map.getZoom())));
+    }
+
+    lngToTileX(lng, z) {
+        return Math.floor((lng + 180) / 360 * Math.pow(2, z));
+    }
+
+    latToTileY(lat, z) {
+        const rad = lat * Math.PI / 180;
+        return Math.floor((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2 * Math.pow(2, z));
+    }
+
+    visibleTiles() {
+        const bounds = this.map.getBounds();
+        if (!bounds) {
+            return [];
+        }
+        const z = this.tileZoom();
+        const max = Math.pow(2, z) - 1;
+        const clamp = (v) => Math.max(0, Math.min(max, v));
+        const ne = bounds.getNorthEast();
+        const sw = bounds.getSouthWest();
+        const minY = clamp(this.latToTileY(Math.min(ne.lat(), 85.0511), z));
+        const maxY = clamp(this.latToTileY(Math.max(sw.lat(), -85.0511), z));
+        let minX = clamp(this.lngToTileX(sw.lng(), z));
+        const maxX = clamp(this.lngToTileX(ne.lng(), z));
+        // Viewport crossing the antimeridian
+        if (minX > maxX) {
+            minX = 0;
+        }
+
+        const tiles = [];
+        for (let x = minX; x <= maxX; x++) {
+            for (let y = minY; y <= maxY; y++) {
+                tiles.push({ z, x, y });
+            }
+        }
+        return tiles;
+    }
+
+    async loadVisibleTiles() {
+        const pending = this.visibleTiles().filter(t => !this.loadedTiles.has(`${t.z}/${t.x}/${t.y}`));
+        if (!pending.length) {
+            return;
+        }
+
+        const results = await Promise.all(pending.map(t => this.loadTile(t)));
+        if (results.some(Boolean)) {
+            this.mapData.organizations = Array.from(this.organizationsById.values());
+            this.mapData.doctors = Array.from(this.doctorsById.values());
+            this.addMarkers();
+        }
+    }
+
+    async loadTile({ z, x, y }) {
+        const key = `${z}/${x}/${y}`;
         try {
-            const response = await fetch('/api/locations/');
+            const response = await fetch(`/api/tiles/${key}/`);
             if (!response.ok) {
-                throw new Error('Failed to load location data');
-            }
-            
-            this.mapData = await response.json();
-            
-            // Update center to first location if available
-            const firstLocation = this.mapData.organizations[0] || this.mapData.doctors[0];
-            if (firstLocation) {
-                this.map.setCenter({ lat: firstLocation.latitude, lng: firstLocation.longitude });
+                throw new Error(`Failed to load tile ${key}`);
             }
+            const tile = await response.json();
+            this.loadedTiles.add(key);
+            this.mergeTile(tile);
+            return tile.organizations.length > 0;
         } catch (error) {
             console.error('Error loading location data:', error);
-            // Use fallback data if API fails
-            this.mapData = {
-                organizations: [],
-                doctors: []
-            };
+            return false;
         }
     }
 
+    mergeTile(tile) {
+        const toObject = (fields, row) => {
+            const item = {};
+            fields.forEach((field, i) => { item[field] = row[i]; });
+            return item;
+        };
+
+        tile.organizations.forEach(row => {
+            const org = toObject(tile.organization_fields, row);
+            org.specialization = org.type === 'Clinic' ? 'General Clinic' : 'Hospital';
+            this.organizationsById.set(org.id, org);
+        });
+
+        tile.doctors.forEach(row => {
+            const doctor = toObject(tile.doctor_fields, row);
+            const org = this.organizationsById.get(doctor.organization_id);
+            if (!org) {
+                return;
+            }
+            // Doctors are placed at their organization's location
+            Object.assign(doctor, {
+                organization: org.name,
+                address: org.address,
+                phone: doctor.phone || org.phone,
+                latitude: org.latitude,
+                longitude: org.longitude,
+                org_type: org.type
+            });
+            this.doctorsById.set(doctor.id, doctor);
+        });
+    }
+
     addMarkers() {
         this.clearMarkers();
 
@@ -1,12 +1,43 @@
 // WebSocket functionality for real-time updates
+
+// Field order of the compact msgpack frames, keyed by type code (appointments/encoding.py)
+const COMPACT_SCHEMAS = {
+    0: ['batch', ['updates']],
+    1: ['appointment_update', ['appointment_id', 'status', 'patient_status', 'timestamp', 'offset']],
+    2: ['doctor_status_update', ['doctor_id', 'on_duty', 'timestamp', 'offset']],
+    3: ['queue_update', ['appointment_id', 'status', 'patient_status', 'timestamp']],
+    4: ['notification', ['notification_type', 'message', 'data', 'timestamp']],
+    5: ['notification_read', ['notification_id']],
+    6: ['notification_count', ['count']],
+};
+
+function expandCompact(payload) {
+    if (!Array.isArray(payload)) return payload;
+    const [type, fields] = COMPACT_SCHEMAS[payload[0]];
+    const data = {type: type};
+    fields.forEach((field, i) => {
+        let value = payload[i + 1];
+        if (field === 'timestamp' && typeof value === 'number') value = new Date(value).toISOString();
+        if (field === 'updates') value = value.map(expandCompact);
+        data[field] = value;
+    });
+    return data;
+}
 class WebSocketManager {
     constructor() {
+        // One multiplexed socket per tab carries every stream
         this.socket = null;
+        this.streams = new Map();
+        // Last org event offset seen per stream, sent back to resume after a reconnect
+        this.offsets = new Map();
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 1000;
         this.userId = this.getUserId();
         this.organizationId = this.getOrganizationId();
+        this.chatRoom = null;
+        // msgpack frames are opt-in: pages that load @msgpack/msgpack get them
+        this.useMsgpack = typeof window.MessagePack !== 'undefined';
     }
 
     getUserId() {
@@ -21,27 +52,44 @@ class WebSocketManager {
         return orgIdElement ? orgIdElement.getAttribute('content') : null;
     }
 
-    connectAppointments() {
-        if (!this.organizationId) return;
+    connect() {
+        if (!this.userId) return;
+        if (this.socket && this.socket.readyState <= WebSocket.OPEN) return;
 
         const wsScheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${wsScheme}://${window.location.host}/ws/appointments/org_${this.organizationId}/`;
-        
-        this.socket = new WebSocket(wsUrl);
-        
+        const wsUrl = `${wsScheme}://${window.location.host}/ws/stream/`;
+
+        if (this.useMsgpack) {
+            this.socket = new WebSocket(wsUrl, ['pulsecal.msgpack', 'pulsecal.json']);
+            this.socket.binaryType = 'arraybuffer';
+        } else {
+            this.socket = new WebSocket(wsUrl);
+        }
+
         this.socket.onopen = () => {
-            console.log('Appointment WebSocket connected');
+            console.log('WebSocket connected');
             this.reconnectAttempts = 0;
+            // (Re)subscribe every stream this page asked for
+            this.streams.forEach((frame) => this.sendFrame(this.resumeFrame(frame)));
         };
 
         this.socket.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            this.handleAppointmentUpdate(data);
+            const frame = typeof event.data === 'string'
+                ? JSON.parse(event.data)
+                : window.MessagePack.decode(new Uint8Array(event.data));
+            const payload = expandCompact(frame.payload) || {};
+            if (frame.stream === 'appointments') {
+                this.trackOffset('appointments', payload.offset);
+            }
+            this.handleFrame(frame.stream, payload);
         };
 
-        this.socket.onclose = () => {
-            console.log('Appointment WebSocket disconnected');
-            this.scheduleReconnect();
+        this.socket.onclose = (event) => {
+            console.log('WebSocket disconnected');
+            // 4401/4403: not logged in or not allowed, retrying will not help
+            if (event.code !== 4401 && event.code !== 4403) {
+                this.scheduleReconnect();
+            }
         };
 
         this.socket.onerror = (error) => {
@@ -49,54 +97,95 @@ class WebSocketManager {
         };
     }
 
-    connectNotifications() {
-        if (!this.userId) return;
-
-        const wsScheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${wsScheme}://${window.location.host}/ws/notifications/${this.userId}/`;
-        
-        this.notificationSocket = new WebSocket(wsUrl);
-        
-        this.notificationSocket.onopen = () => {
-            console.log('Notification WebSocket connected');
-        };
+    sendFrame(frame) {
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify(frame));
+        }
+    }
 
-        this.notificationSocket.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            this.handleNotification(data);
-        };
+    resumeFrame(frame) {
+        const offset = this.offsets.get(frame.stream);
+        return offset !== undefined ? {...frame, last_offset: offset} : frame;
+    }
 
-        this.notificationSocket.onclose = () => {
-            console.log('Notification WebSocket disconnected');
-        };
+    trackOffset(key, offset) {
+        if (offset && offset > (this.offsets.get(key) || 0)) {
+            this.offsets.set(key, offset);
+        }
+    }
 
-        this.notificationSocket.onerror = (error) => {
-            console.error('Notification WebSocket error:', error);
-        };
+    subscribe(stream, room = null) {
+        const frame = {action: 'subscribe', stream: stream, room: room};
+        this.streams.set(room ? `${stream}:${room}` : stream, frame);
+        this.connect();
+        this.sendFrame(frame);
     }
 
-    connectChat(roomName) {
-        const wsScheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${wsScheme}://${window.location.host}/ws/chat/${roomName}/`;
-        
-        this.chatSocket = new WebSocket(wsUrl);
-        
-        this.chatSocket.onopen = () => {
-            console.log('Chat WebSocket connected');
-        };
+    unsubscribe(stream, room = null) {
+        this.streams.delete(room ? `${stream}:${room}` : stream);
+        this.sendFrame({action: 'unsubscribe', stream: stream, room: room});
+    }
 
-        this.chatSocket.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+    handleFrame(stream, data) {
+        if (data.type === 'error') {
+            console.error(`WebSocket stream ${stream} error:`, data.error);
+            return;
+        }
+        if (data.type === 'subscribed' && stream === 'appointments' && !this.offsets.has('appointments')) {
+            // Fresh page: everything up to here is already rendered
+            this.offsets.set('appointments', data.offset || 0);
+            return;
+        }
+        if (data.type === 'batch') {
+            if (stream === 'appointments') {
+                data.updates.forEach((update) => this.trackOffset('appointments', update.offset));
+            }
+            // Coalesced updates: apply them all, announce them once
+            data.updates.forEach((update) => this.handleFrame(stream, {...update, batched: true}));
+            if (stream === 'appointments') {
+                this.showNotification('Appointment Update', `${data.updates.length} appointments updated`);
+            }
+            return;
+        }
+        if (data.type === 'resync') {
+            // The server dropped updates this tab could not keep up with
+            this.resync(stream);
+            return;
+        }
+        if (stream === 'appointments') {
+            this.handleAppointmentUpdate(data);
+        } else if (stream === 'notifications') {
+            this.handleNotification(data);
+        } else if (stream === 'queue') {
+            this.handleQueueUpdate(data);
+        } else if (stream === 'chat') {
             this.handleChatMessage(data);
-        };
+        }
+    }
 
-        this.chatSocket.onclose = () => {
-            console.log('Chat WebSocket disconnected');
-        };
+    resync(stream) {
+        // Every stream's page state is rendered server side; reload it
+        window.location.reload();
+    }
 
-        this.chatSocket.onerror = (error) => {
-            console.error('Chat WebSocket error:', error);
-        };
+    connectAppointments() {
+        if (!this.organizationId) return;
+        this.subscribe('appointments', `org_${this.organizationId}`);
+    }
+
+    connectNotifications() {
+        if (!this.userId) return;
+        this.subscribe('notifications');
+        this.subscribe('queue');
+    }
+
+    connectChat(roomName) {
+        if (this.chatRoom === roomName) return;
+        if (this.chatRoom) {
+            this.unsubscribe('chat', this.chatRoom);
+        }
+        this.chatRoom = roomName;
+        this.subscribe('chat', roomName);
     }
 
     handleAppointmentUpdate(data) {
@@ -105,27 +194,55 @@ class WebSocketManager {
             this.updateAppointmentStatus(data.appointment_id, data.status, data.patient_status);
             
             // Show notification
-            this.showNotification('Appointment Update', `Appointment status changed to ${data.status}`);
+            if (!data.batched) {
+                this.showNotification('Appointment Update', `Appointment status changed to ${data.status}`);
+            }
         }
         if (data.type === 'doctor_status_update') {
             this.updateDoctorStatus(data.doctor_id, data.on_duty);
-            this.showNotification('Doctor Availability', `Doctor availability updated.`);
+            if (!data.batched) {
+                this.showNotification('Doctor Availability', `Doctor availability updated.`);
+            }
         }
     }
 
     handleNotification(data) {
         if (data.type === 'notification') {
             this.showNotification(data.notification_type, data.message);
-            this.updateNotificationBadge();
+        }
+        if (data.type === 'notification_count') {
+            this.updateNotificationBadge(data.count);
+        }
+    }
+
+    handleQueueUpdate(data) {
+        if (data.type === 'queue_update') {
+            this.updateAppointmentStatus(data.appointment_id, data.status, data.patient_status);
         }
     }
 
     handleChatMessage(data) {
+        if (data.type === 'subscribed') {
+            this.markChatRead();
+        }
         if (data.type === 'chat_message') {
             this.displayChatMessage(data);
+            if (data.user_id != this.userId) {
+                this.markChatRead();
+            }
         }
     }
 
+    markChatRead() {
+        // Debounced: a burst of incoming messages sends one read receipt
+        clearTimeout(this.readReceiptTimer);
+        this.readReceiptTimer = setTimeout(() => {
+            if (this.chatRoom && document.visibilityState === 'visible') {
+                this.sendFrame({stream: 'chat', room: this.chatRoom, type: 'mark_read'});
+            }
+        }, 1000);
+    }
+
     updateAppointmentStatus(appointmentId, status, patientStatus) {
         // Find appointment element and update its status
         const appointmentElement = document.querySelector(`[data-appointment-id="${appointmentId}"]`);
@@ -183,12 +300,12 @@ class WebSocketManager {
         }, 5000);
     }
 
-    updateNotificationBadge() {
+    updateNotificationBadge(count) {
+        // The server pushes the exact unread count whenever it changes
         const badge = document.getElementById('notification-badge');
         if (badge) {
-            const currentCount = parseInt(badge.textContent || '0');
-            badge.textContent = currentCount + 1;
-            badge.style.display = 'block';
+            badge.textContent = count;
+            badge.style.display = count > 0 ? '' : 'none';
         }
     }
 
@@ -211,13 +328,13 @@ class WebSocketManager {
     }
 
     sendChatMessage(message) {
-        if (this.chatSocket && this.chatSocket.readyState === WebSocket.OPEN) {
-            this.chatSocket.send(JSON.stringify({
-                message: message,
-                user_id: this.userId,
-                username: this.getCurrentUsername()
-            }));
-        }
+        if (!this.chatRoom) return;
+        // The server attaches the sender from the session
+        this.sendFrame({
+            stream: 'chat',
+            room: this.chatRoom,
+            message: message
+        });
     }
 
     getCurrentUsername() {
@@ -230,21 +347,17 @@ class WebSocketManager {
             this.reconnectAttempts++;
             setTimeout(() => {
                 console.log(`Attempting to reconnect... (${this.reconnectAttempts}/${this.maxReconnectAttempts})`);
-                this.connectAppointments();
+                this.connect();
             }, this.reconnectDelay * this.reconnectAttempts);
         }
     }
 
     disconnect() {
+        this.streams.clear();
         if (this.socket) {
+            this.socket.onclose = null;
             this.socket.close();
         }
-        if (this.notificationSocket) {
-            this.notificationSocket.close();
-        }
-        if (this.chatSocket) {
-            this.chatSocket.close();
-        }
     }
 }
 
@@ -259,7 +372,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
 // Connect to chat if on chat page
 if (window.location.pathname.includes('/chat/')) {
-    const roomName = window.location.pathname.split('/').pop();
+    const roomName = window.location.pathname.split('/').filter(Boolean).pop();
     wsManager.connectChat(roomName);
 }
 